@@ -0,0 +1,353 @@
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+# offline end-to-end benchmark of the backend. it builds synthetic Java repositories and pull
+# requests, serves them with a local stand-in for github (REST API, .diff files and git over
+# http), starts the backend against it and drives reviews through the HTTP endpoints at the
+# given concurrency. the results are printed as JSON, to be compared between commits:
+#   python benchmark.py --repositories 2 --files 200 --pulls 20 --modified-files 10 --concurrency 4
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+GIT_IDENTITY = ['-c', 'user.name=benchmark', '-c', 'user.email=benchmark@localhost']
+
+
+def git(folder, *args):
+    s = subprocess.run(['git'] + GIT_IDENTITY + list(args), cwd=folder, stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    return s.stdout.strip()
+
+
+# source of a synthetic class calling the methods of some other classes
+def java_class(index, files, methods, rng, extra_calls=0):
+    package = 'p{}'.format(index % 10)
+    lines = ['package {};'.format(package), '', 'public class C{} {{'.format(index)]
+    for method in range(methods):
+        lines.append('    public int m{}(int x) {{'.format(method))
+        for _ in range(2 + (extra_calls if method == 0 else 0)):
+            target = rng.randrange(files)
+            lines.append('        x += new p{}.C{}().m{}(x);'.format(target % 10, target, rng.randrange(methods)))
+        lines.append('        return x;')
+        lines.append('    }')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def class_path(index):
+    return 'src/main/java/p{}/C{}.java'.format(index % 10, index)
+
+
+# create a repository with `files` classes of `methods` methods each, and `pulls` branches
+# modifying `modified_files` of them. returns the base commit and the head commit of each pull
+def build_repository(folder, files, methods, pulls, modified_files, seed):
+    rng = random.Random(seed)
+    os.makedirs(folder)
+    git(folder, 'init', '-q')
+    git(folder, 'config', 'uploadpack.allowFilter', 'true')
+    git(folder, 'config', 'uploadpack.allowAnySHA1InWant', 'true')
+    for index in range(files):
+        path = os.path.join(folder, class_path(index))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as java_file:
+            java_file.write(java_class(index, files, methods, rng))
+    git(folder, 'add', '-A')
+    git(folder, 'commit', '-q', '-m', 'base')
+    git(folder, 'branch', '-M', 'master')
+    base = git(folder, 'rev-parse', 'HEAD')
+    heads = []
+    for pull in range(pulls):
+        git(folder, 'checkout', '-q', '-b', 'pull{}'.format(pull), base)
+        for index in rng.sample(range(files), min(modified_files, files)):
+            with open(os.path.join(folder, class_path(index)), 'w') as java_file:
+                java_file.write(java_class(index, files, methods, rng, extra_calls=1 + pull % 3))
+        git(folder, 'commit', '-q', '-a', '-m', 'pull {}'.format(pull))
+        heads.append(git(folder, 'rev-parse', 'HEAD'))
+    git(folder, 'checkout', '-q', 'master')
+    return base, heads
+
+
+# stand-in for github, serving the pull requests of the repositories in `remotes_dir`
+class FakeGitHub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, remotes_dir, pulls):
+        super().__init__(('127.0.0.1', 0), FakeGitHubHandler)
+        self.remotes_dir = remotes_dir
+        # (user, repo, number) -> (base, head)
+        self.pulls = pulls
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _pull(self, user, repo, number):
+        return self.server.pulls.get((user, repo, number))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        parts = path.strip('/').split('/')
+        if len(parts) == 5 and parts[0] == 'repos' and parts[3] == 'pulls':
+            pull = self._pull(parts[1], parts[2], parts[4])
+            if pull is None:
+                return self._send(404)
+            etag = '"{}"'.format(pull[1])
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers=[('ETag', etag)])
+            body = json.dumps({'base': {'sha': pull[0]}, 'head': {'sha': pull[1]}}).encode('utf-8')
+            return self._send(200, body, [('ETag', etag), ('Content-Type', 'application/json')])
+        if len(parts) == 4 and parts[0] == 'repos' and parts[3] == 'pulls':
+            # all the pull requests are open, and fit in a page
+            pulls = [{'number': int(number), 'base': {'sha': base}, 'head': {'sha': head}}
+                     for (user, repo, number), (base, head) in sorted(self.server.pulls.items())
+                     if (user, repo) == (parts[1], parts[2])]
+            body = json.dumps(pulls).encode('utf-8')
+            return self._send(200, body, [('Content-Type', 'application/json')])
+        if len(parts) == 3 and parts[0] == 'repos':
+            body = json.dumps({'fork': False}).encode('utf-8')
+            return self._send(200, body, [('Content-Type', 'application/json')])
+        if len(parts) == 4 and parts[2] == 'pull' and parts[3].endswith('.diff'):
+            pull = self._pull(parts[0], parts[1], parts[3][:-len('.diff')])
+            if pull is None:
+                return self._send(404)
+            s = subprocess.run(['git', 'diff', '--no-color', pull[0], pull[1]], stdout=subprocess.PIPE,
+                               cwd=os.path.join(self.server.remotes_dir, parts[0], parts[1]))
+            return self._send(200, s.stdout, [('Content-Type', 'text/plain')])
+        return self._git()
+
+    def do_POST(self):
+        return self._git()
+
+    # git smart http protocol, served by git http-backend
+    def _git(self):
+        split = urlsplit(self.path)
+        env = dict(os.environ, GIT_PROJECT_ROOT=self.server.remotes_dir, GIT_HTTP_EXPORT_ALL='1',
+                   PATH_INFO=split.path, QUERY_STRING=split.query, REQUEST_METHOD=self.command,
+                   CONTENT_TYPE=self.headers.get('Content-Type', ''), GIT_PROTOCOL=self.headers.get('Git-Protocol', ''),
+                   HTTP_CONTENT_ENCODING=self.headers.get('Content-Encoding', ''), REMOTE_ADDR='127.0.0.1')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        s = subprocess.run(['git', 'http-backend'], input=body, env=env, stdout=subprocess.PIPE)
+        head, _, content = s.stdout.partition(b'\r\n\r\n')
+        status, headers = 200, []
+        for line in head.decode('latin-1').split('\r\n'):
+            name, _, value = line.partition(': ')
+            if name.lower() == 'status':
+                status = int(value.split()[0])
+            elif name:
+                headers.append((name, value))
+        return self._send(status, content, headers)
+
+
+# peak resident memory of a process and its children, sampled from /proc
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def _tree(self, pid):
+        pids = [pid]
+        try:
+            with open('/proc/{}/task/{}/children'.format(pid, pid)) as children:
+                for child in children.read().split():
+                    pids += self._tree(int(child))
+        except OSError:
+            pass
+        return pids
+
+    def _rss(self, pid):
+        try:
+            with open('/proc/{}/status'.format(pid)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, sum(self._rss(pid) for pid in self._tree(self.pid)))
+
+
+# nearest-rank percentiles of a list of durations
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    pick = lambda p: values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+    return {'count': len(values), 'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': values[-1]}
+
+
+class Driver:
+    def __init__(self, backend_url, timeout, batch_files=False):
+        self.backend_url = backend_url
+        self.timeout = timeout
+        self.batch_files = batch_files
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.review_times = []
+        self.errors = []
+
+    def _get(self, endpoint, resource, **params):
+        start = time.monotonic()
+        resp = self.session.get(self.backend_url + resource, params=params)
+        latency = time.monotonic() - start
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+        resp.raise_for_status()
+        if resp.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+            return [json.loads(line) for line in resp.text.splitlines()]
+        return resp.json()
+
+    # run a review as the frontend would: start it, wait for it, get its method calls and the
+    # contents and the diff of the files it modifies
+    def review(self, pr_url, modified_files):
+        start = time.monotonic()
+        try:
+            data = self._get('start', '/review/start', pr=pr_url)
+            while data['status'] == 'ok' and data['data']['review_status'] == 'processing':
+                if time.monotonic() - start > self.timeout:
+                    raise RuntimeError('timed out')
+                time.sleep(0.2)
+                data = self._get('poll', '/review/start', pr=pr_url)
+            if data['status'] != 'ok' or data['data']['review_status'] != 'ready':
+                raise RuntimeError('review failed: {}'.format(data))
+            review_id = data['data']['id']
+            self._get('methodcalls', '/review/{}/methodcalls'.format(review_id))
+            if self.batch_files:
+                self._get('files', '/review/{}/files'.format(review_id))
+            else:
+                for path in modified_files:
+                    self._get('file', '/review/{}/file'.format(review_id), path=path)
+                    self._get('diff', '/review/{}/diff'.format(review_id), path=path)
+        except Exception as e:
+            with self.lock:
+                self.errors.append('{}: {}'.format(pr_url, e))
+            return
+        with self.lock:
+            self.review_times.append(time.monotonic() - start)
+
+
+def wait_for_backend(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('backend exited with code {}'.format(process.returncode))
+        try:
+            requests.get(url + '/jobs/stats', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError('backend not reachable at {}'.format(url))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of the review backend')
+    parser.add_argument('--repositories', type=int, default=1, help='number of synthetic repositories')
+    parser.add_argument('--files', type=int, default=100, help='Java files in each repository')
+    parser.add_argument('--methods', type=int, default=5, help='methods in each Java file')
+    parser.add_argument('--pulls', type=int, default=10, help='pull requests in each repository')
+    parser.add_argument('--modified-files', type=int, default=5, help='files modified by each pull request')
+    parser.add_argument('--concurrency', type=int, default=4, help='reviews driven at the same time')
+    parser.add_argument('--batch-files', action='store_true', help='get the modified files with a single request to /files')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds before a review is considered failed')
+    parser.add_argument('--port', type=int, default=5123, help='port of the backend')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--work-dir', help='folder for the repositories and the backend data (default: temporary)')
+    parser.add_argument('--output', help='file to write the results to (default: stdout)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark-')
+    remotes_dir = os.path.join(work_dir, 'remotes')
+    backend_dir = os.path.join(work_dir, 'backend')
+    for folder in (remotes_dir, backend_dir):
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+    for folder in ('diffs', 'cloned_repos'):
+        os.makedirs(os.path.join(backend_dir, folder))
+
+    pulls, reviews = {}, []
+    for index in range(args.repositories):
+        user, repo = 'bench', 'repo{}'.format(index)
+        base, heads = build_repository(os.path.join(remotes_dir, user, repo), args.files, args.methods,
+                                       args.pulls, args.modified_files, args.seed + index)
+        for number, head in enumerate(heads, 1):
+            pulls[(user, repo, str(number))] = (base, head)
+            modified = git(os.path.join(remotes_dir, user, repo), 'diff', '--name-only', base, head).split('\n')
+            reviews.append(('https://github.com/{}/{}/pull/{}'.format(user, repo, number), modified))
+
+    github = FakeGitHub(remotes_dir, pulls)
+    threading.Thread(target=github.serve_forever, daemon=True).start()
+    env = dict(os.environ, GITHUB_API_URL=github.url, GITHUB_URL=github.url, PORT=str(args.port),
+               DATABASE=os.path.join(backend_dir, 'mydb.db'),
+               EXTRACTOR_JAR=os.environ.get('EXTRACTOR_JAR', os.path.join(BACKEND_DIR, 'mcextractor.jar')))
+    with open(os.path.join(backend_dir, 'backend.log'), 'w') as log:
+        backend = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'main.py')], cwd=backend_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    sampler = RssSampler(backend.pid)
+    try:
+        backend_url = 'http://127.0.0.1:{}'.format(args.port)
+        wait_for_backend(backend_url, backend)
+        sampler.start()
+        driver = Driver(backend_url, args.timeout, args.batch_files)
+        start = time.monotonic()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            for pr_url, modified in reviews:
+                executor.submit(driver.review, pr_url, modified)
+        elapsed = time.monotonic() - start
+    finally:
+        sampler.stopped.set()
+        backend.terminate()
+        backend.wait()
+        github.shutdown()
+
+    results = {
+        'parameters': vars(args),
+        'reviews': len(reviews),
+        'completed_reviews': len(driver.review_times),
+        'errors': driver.errors,
+        'elapsed_seconds': elapsed,
+        'reviews_per_minute': len(driver.review_times) / elapsed * 60 if elapsed else 0,
+        'review_seconds': percentiles(driver.review_times),
+        'latency_seconds': {endpoint: percentiles(values) for endpoint, values in sorted(driver.latencies.items())},
+        'peak_rss_bytes': sampler.peak,
+        'work_dir': work_dir,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+# helpers shared by the caches of the backend (file cache, extraction cache, github client)
+
+# fraction of its limit a cache is brought back to when it goes over it, so that it is not
+# trimmed again by the next few insertions
+TRIM_RATIO = 0.9
+
+
+# write some bytes to a file. they are written to a temporary file in the same folder, which
+# then replaces the file, so readers never see a partially written file
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+# entries to evict from a cache whose `total` size (in bytes, rows...) is over `max_total`.
+# `entries` are tuples (entry, size) from the least to the most recently used. returns a tuple
+# (evicted entries, total size left)
+def lru_trim(entries, total, max_total):
+    target = max_total * TRIM_RATIO
+    evicted = []
+    for entry, size in entries:
+        if total <= target:
+            break
+        evicted.append(entry)
+        total -= size
+    return evicted, total
@@ -0,0 +1,103 @@
+import interning
+
+# call graph of the method calls of a review, built once when they are stored, so that the
+# relations between the files and the methods of a review are looked up through indexes
+# instead of scanning all its method calls:
+#   declarations: the methods called in the review, with the number of calls to each of them
+#     and of the files calling them. each method call references the declaration it calls
+#     (declaration_id), so the callers of a declaration are found with the index on it
+#   filecalls: number of calls from a file to another
+#   filestats: totals of each file, and the number of lines of its longest call and of its
+#     longest declaration, which bound the range scans for the calls or the declarations
+#     overlapping some lines
+
+METHODCALL_FIELDS = ('id', 'review_id') + interning.COLUMNS
+DECLARATION_FIELDS = ('id', 'path', 'start_line', 'start_column', 'end_line', 'end_column', 'qualifier', 'calls', 'calling_files')
+FILE_STATS_FIELDS = ('calls_out', 'calls_in', 'called_files', 'calling_files', 'declarations', 'max_call_lines', 'max_declaration_lines')
+
+METHODCALLS_QUERY = 'SELECT m.`id`, m.`review_id`, {} FROM methodcallrows m'.format(', '.join(
+    interning.value_of('m.`{}_id`'.format(column)) if column in interning.STRING_COLUMNS else 'm.`{}`'.format(column)
+    for column in interning.COLUMNS))
+DECLARATIONS_QUERY = ('SELECT d.`id`, {}, d.`start_line`, d.`start_column`, d.`end_line`, d.`end_column`, {}, d.`calls`, '
+                      'd.`calling_files` FROM declarations d').format(interning.value_of('d.`file_id`'), interning.value_of('d.`qualifier_id`'))
+
+
+# build the call graph of a review from its method calls, replacing the previous one
+def build(conn, review_id):
+    delete(conn, review_id)
+    conn.execute('INSERT INTO declarations (review_id, file_id, start_line, start_column, end_line, end_column, qualifier_id, calls, calling_files) '
+        'SELECT review_id, to_file_id, declaration_start_line, declaration_start_column, declaration_end_line, declaration_end_column, '
+        'MIN(full_method_qualifier_id), COUNT(*), COUNT(DISTINCT from_file_id) FROM methodcallrows WHERE review_id = ? '
+        'GROUP BY to_file_id, declaration_start_line, declaration_start_column, declaration_end_line, declaration_end_column',
+        (review_id, ))
+    conn.execute('UPDATE methodcallrows SET declaration_id = (SELECT d.id FROM declarations d '
+        'WHERE d.review_id = methodcallrows.review_id AND d.file_id = methodcallrows.to_file_id '
+        'AND d.start_line = methodcallrows.declaration_start_line AND d.start_column = methodcallrows.declaration_start_column '
+        'AND d.end_line = methodcallrows.declaration_end_line AND d.end_column = methodcallrows.declaration_end_column) '
+        'WHERE review_id = ?', (review_id, ))
+    conn.execute('INSERT INTO filecalls (review_id, from_file_id, to_file_id, calls, declarations) '
+        'SELECT review_id, from_file_id, to_file_id, COUNT(*), COUNT(DISTINCT declaration_id) FROM methodcallrows '
+        'WHERE review_id = ? GROUP BY from_file_id, to_file_id', (review_id, ))
+    conn.execute('INSERT INTO filestats (review_id, file_id, {}) SELECT f.review_id, f.file_id, '
+        '(SELECT COALESCE(SUM(calls), 0) FROM filecalls WHERE review_id = f.review_id AND from_file_id = f.file_id), '
+        '(SELECT COALESCE(SUM(calls), 0) FROM filecalls WHERE review_id = f.review_id AND to_file_id = f.file_id), '
+        '(SELECT COUNT(*) FROM filecalls WHERE review_id = f.review_id AND from_file_id = f.file_id), '
+        '(SELECT COUNT(*) FROM filecalls WHERE review_id = f.review_id AND to_file_id = f.file_id), '
+        '(SELECT COUNT(*) FROM declarations WHERE review_id = f.review_id AND file_id = f.file_id), '
+        '(SELECT COALESCE(MAX(call_end_line - call_start_line), 0) FROM methodcallrows WHERE review_id = f.review_id AND from_file_id = f.file_id), '
+        '(SELECT COALESCE(MAX(end_line - start_line), 0) FROM declarations WHERE review_id = f.review_id AND file_id = f.file_id) '
+        'FROM (SELECT review_id, from_file_id AS file_id FROM filecalls WHERE review_id = ? '
+        'UNION SELECT review_id, to_file_id FROM filecalls WHERE review_id = ?) f'.format(', '.join(FILE_STATS_FIELDS)),
+        (review_id, review_id))
+
+
+# remove the call graph of a review
+def delete(conn, review_id):
+    for table in ('declarations', 'filecalls', 'filestats'):
+        conn.execute('DELETE FROM {} WHERE review_id = ?'.format(table), (review_id, ))
+
+
+# totals of a file, None if the file has no calls from or to it
+def file_stats(conn, review_id, file_id):
+    row = conn.execute('SELECT {} FROM filestats WHERE review_id = ? AND file_id = ?'.format(', '.join(FILE_STATS_FIELDS)),
+        (review_id, file_id)).fetchone()
+    return dict(zip(FILE_STATS_FIELDS, row)) if row else None
+
+
+# totals of all the files of a review, by path
+def all_file_stats(conn, review_id):
+    return {row[0]: dict(zip(FILE_STATS_FIELDS, row[1:])) for row in conn.execute(
+        'SELECT {}, {} FROM filestats s WHERE review_id = ?'.format(interning.value_of('s.`file_id`'), ', '.join(FILE_STATS_FIELDS)),
+        (review_id, ))}
+
+
+# declarations of a file containing a line, the innermost first. `stats` are the totals of the file
+def declarations_at(conn, review_id, file_id, line, stats):
+    return [dict(zip(DECLARATION_FIELDS, row)) for row in conn.execute(
+        DECLARATIONS_QUERY + ' WHERE d.review_id = ? AND d.file_id = ? AND d.start_line BETWEEN ? AND ? AND d.end_line >= ? '
+        'ORDER BY d.start_line DESC, d.start_column DESC', (review_id, file_id, line - stats['max_declaration_lines'], line, line))]
+
+
+# method calls to a declaration
+def callers(conn, declaration_id):
+    return _methodcalls(conn, 'm.declaration_id = ?', (declaration_id, ))
+
+
+# method calls from a file overlapping a range of lines. `stats` are the totals of the file
+def calls_in_lines(conn, review_id, file_id, start, end, stats):
+    return _methodcalls(conn, 'm.review_id = ? AND m.from_file_id = ? AND m.call_start_line BETWEEN ? AND ? AND m.call_end_line >= ?',
+        (review_id, file_id, start - stats['max_call_lines'], end, start))
+
+
+# files called by a file (or calling it if `reverse`), with the number of calls and of
+# declarations called
+def called_files(conn, review_id, file_id, reverse=False):
+    this, other = ('to_file_id', 'from_file_id') if reverse else ('from_file_id', 'to_file_id')
+    return [{'path': path, 'calls': calls, 'declarations': declarations} for path, calls, declarations in conn.execute(
+        'SELECT {}, calls, declarations FROM filecalls f WHERE review_id = ? AND {} = ? ORDER BY calls DESC'.format(
+            interning.value_of('f.`{}`'.format(other)), this), (review_id, file_id))]
+
+
+def _methodcalls(conn, condition, params):
+    return [dict(zip(METHODCALL_FIELDS, row)) for row in conn.execute(
+        METHODCALLS_QUERY + ' WHERE {} ORDER BY m.call_start_line, m.call_start_column, m.id'.format(condition), params)]
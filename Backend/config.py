@@ -0,0 +1,78 @@
+import os
+
+# settings of the backend. each of them can be overridden with an environment
+# variable with the same name
+
+# path of the method call extractor jar, built from the Engine project
+EXTRACTOR_JAR = os.environ.get('EXTRACTOR_JAR', 'mcextractor.jar')
+# options passed to the JVM running the extractor
+EXTRACTOR_JAVA_OPTIONS = os.environ.get('EXTRACTOR_JAVA_OPTIONS', '-Xmx1024m').split()
+# number of long-lived extractor processes
+EXTRACTOR_POOL_SIZE = int(os.environ.get('EXTRACTOR_POOL_SIZE', 2))
+# an idle extractor is pinged before being reused if it has not been used for this many seconds
+EXTRACTOR_HEALTH_CHECK_INTERVAL = float(os.environ.get('EXTRACTOR_HEALTH_CHECK_INTERVAL', 60))
+# number of method calls inserted in the db with a single statement
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+# path of the SQLite database
+DATABASE = os.environ.get('DATABASE', 'mydb.db')
+# seconds a connection waits for a lock held by another writer before failing
+DATABASE_BUSY_TIMEOUT = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 30))
+# maximum number of idle connections kept open for reuse
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+# folder of the cache of the file contents and diffs served to the frontend
+FILE_CACHE_DIR = os.environ.get('FILE_CACHE_DIR', 'file_cache')
+# maximum size in bytes of the file cache on disk, the least recently used entries are evicted
+FILE_CACHE_MAX_BYTES = int(os.environ.get('FILE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# maximum number of method calls kept in the cache of the extractor results shared across
+# reviews, the least recently used entries are evicted
+EXTRACTION_CACHE_MAX_ROWS = int(os.environ.get('EXTRACTION_CACHE_MAX_ROWS', 5000000))
+# number of workers running the background jobs that mostly download data (clones, fetches,
+# diffs), read git objects and run the extractor
+SCHEDULER_NETWORK_WORKERS = int(os.environ.get('SCHEDULER_NETWORK_WORKERS', 4))
+SCHEDULER_GIT_WORKERS = int(os.environ.get('SCHEDULER_GIT_WORKERS', 2))
+SCHEDULER_JVM_WORKERS = int(os.environ.get('SCHEDULER_JVM_WORKERS', EXTRACTOR_POOL_SIZE))
+# backend of the queue of the background jobs
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'sqlite')
+# seconds a worker holds a job without renewing its lease before the job is given to another worker
+JOB_LEASE_TIME = float(os.environ.get('JOB_LEASE_TIME', 60))
+# number of times a job is claimed before failing when its leases expire
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# seconds between the checks of idle workers for new jobs
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# run the workers inside the backend process. set to 0 when they are run as standalone processes
+JOB_WORKERS_IN_APP = os.environ.get('JOB_WORKERS_IN_APP', '1') == '1'
+# maximum number of background jobs (e.g. of prefetched reviews) running at the same time in
+# each stage, the other workers are kept for the reviews opened by the reviewers
+JOB_MAX_BACKGROUND_JOBS = int(os.environ.get('JOB_MAX_BACKGROUND_JOBS', 1))
+# seconds the finished jobs are kept, for the stats and for debugging, before the garbage
+# collection removes them
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))
+# token used to authenticate to github, the requests are anonymous if not set
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+# base urls of the github API and website, can point to a github enterprise server
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+GITHUB_URL = os.environ.get('GITHUB_URL', 'https://github.com')
+# folder of the cache of the responses of the github API, revalidated with their ETag
+GITHUB_CACHE_DIR = os.environ.get('GITHUB_CACHE_DIR', 'github_cache')
+# maximum seconds a request waits for the github rate limit to be reset
+GITHUB_MAX_RATE_LIMIT_WAIT = float(os.environ.get('GITHUB_MAX_RATE_LIMIT_WAIT', 300))
+# port the backend listens on
+PORT = int(os.environ.get('PORT', 5000))
+# gzip compression level of the streamed responses (e.g. the method calls of a review), 0
+# disables the compression
+RESPONSE_COMPRESSION_LEVEL = int(os.environ.get('RESPONSE_COMPRESSION_LEVEL', 6))
+# number of files of a review computed at the same time for the batch endpoint, and maximum
+# number of files requested to it at once
+FILE_BATCH_WORKERS = int(os.environ.get('FILE_BATCH_WORKERS', 4))
+FILE_BATCH_MAX_FILES = int(os.environ.get('FILE_BATCH_MAX_FILES', 1000))
+# gzip compression level of the diffs of the reviews stored on disk
+DIFF_COMPRESSION_LEVEL = int(os.environ.get('DIFF_COMPRESSION_LEVEL', 6))
+# maximum size in bytes of the clones of the repositories and of the diffs of the reviews on
+# disk. the garbage collection removes the least recently used clones, with the data of the
+# reviews of their repository, until they fit
+STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', 20 * 1024 * 1024 * 1024))
+# the data of the finished reviews not opened for this many seconds is removed by the garbage
+# collection. they are processed again if opened later
+REVIEW_MAX_AGE = float(os.environ.get('REVIEW_MAX_AGE', 30 * 24 * 3600))
+# seconds between runs of the garbage collection, 0 disables it
+GC_INTERVAL = float(os.environ.get('GC_INTERVAL', 3600))
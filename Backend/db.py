@@ -0,0 +1,78 @@
+import logging
+import os
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+
+import config
+
+# data access layer. connections are pooled and reused across requests and background
+# jobs, each of them used by a single thread at a time. the database runs in WAL mode, so
+# readers are not blocked by the background jobs writing to it
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_REGEX = r'^(\d+)_.*\.sql$'
+
+migration_file_regex = re.compile(MIGRATION_FILE_REGEX)
+logger = logging.getLogger(__name__)
+
+_idle = queue.LifoQueue()
+
+
+def _connect():
+    conn = sqlite3.connect(config.DATABASE, timeout=config.DATABASE_BUSY_TIMEOUT, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA busy_timeout = {}'.format(int(config.DATABASE_BUSY_TIMEOUT * 1000)))
+    # with WAL, NORMAL is still safe against corruption and avoids an fsync per commit
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+# context manager giving a connection from the pool. the transaction is committed when the
+# block exits normally and rolled back if it raises
+@contextmanager
+def connection():
+    try:
+        conn = _idle.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if _idle.qsize() < config.DATABASE_POOL_SIZE:
+            _idle.put(conn)
+        else:
+            conn.close()
+
+
+# bring the database schema up to date. schema.sql is the baseline (version 1), every file
+# NNN_description.sql in the migrations folder upgrades the schema to version NNN.
+# the current version is stored in the user_version pragma of the database
+def migrate():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        matches = migration_file_regex.match(filename)
+        if matches:
+            migrations.append((int(matches.group(1)), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+
+    conn = _connect()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target_version, path in [(1, SCHEMA_FILE)] + migrations:
+            if target_version <= version:
+                continue
+            logger.info('Migrating database to version {}'.format(target_version))
+            with open(path) as migration_file:
+                script = migration_file.read()
+            conn.executescript('BEGIN;\n{}\nPRAGMA user_version = {};\nCOMMIT;'.format(script, target_version))
+            version = target_version
+    finally:
+        conn.close()
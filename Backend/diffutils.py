@@ -0,0 +1,369 @@
+import codecs
+import gzip
+import re
+import zlib
+
+# parsing of unified diffs (as produced by git and served by github) and in-memory
+# application of their hunks, so that the post-patch version of a file and its
+# full-context diff can be computed without touching the working tree of a repository.
+# diffs are stored compressed with gzip, with a gzip member for each patch: a gzip file made
+# of many members decompresses to their concatenation, and each patch can still be read on
+# its own from the position of its member
+
+# the paths are quoted by git when they contain special characters
+DIFF_HEADER_REGEX = r'^diff --git ("(?:[^"\\]|\\.)*"|a/.*?) ("(?:[^"\\]|\\.)*"|b/.*)$'
+HUNK_HEADER_REGEX = r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@'
+NO_NEWLINE_MARKER = '\\ No newline at end of file\n'
+GZIP_MAGIC = b'\x1f\x8b'
+READ_CHUNK_SIZE = 64 * 1024
+
+diff_header_regex = re.compile(DIFF_HEADER_REGEX)
+hunk_header_regex = re.compile(HUNK_HEADER_REGEX)
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk:
+    def __init__(self, old_start, old_length, new_start, new_length):
+        self.old_start = old_start
+        self.old_length = old_length
+        self.new_start = new_start
+        self.new_length = new_length
+        # each line keeps its tag (' ', '-' or '+') as first character. lines that
+        # are not terminated by a newline in the file are stored without it
+        self.lines = []
+
+
+class FilePatch:
+    def __init__(self, old_path, new_path):
+        self.old_path = old_path
+        self.new_path = new_path
+        # header lines (diff --git, index, mode, rename...) as found in the diff
+        self.header = []
+        self.hunks = []
+        self.new_file = False
+        self.deleted_file = False
+        self.binary = False
+        self.mode_changed = False
+        # position and length in bytes of the patch in the diff file, set by scan_diff
+        self.offset = None
+        self.length = None
+
+    @property
+    def path(self):
+        return self.old_path if self.deleted_file else self.new_path
+
+    @property
+    def renamed(self):
+        return not self.new_file and not self.deleted_file and self.old_path != self.new_path
+
+    # apply the hunks to the base version of the file. returns the contents of the
+    # file after the patch and the full-context diff, as `git diff -U<inf>` would show it
+    def apply(self, base):
+        if self.binary:
+            raise PatchError('Cannot apply binary patch to {}'.format(self.path))
+        old = split_lines(base)
+        new, body = [], []
+        pos = 0
+        for hunk in self.hunks:
+            # for pure insertions the old start is the line after which to insert
+            start = hunk.old_start - 1 if hunk.old_length else hunk.old_start
+            if start < pos or start > len(old):
+                raise PatchError('Hunk out of range in {}'.format(self.path))
+            for line in old[pos:start]:
+                new.append(line)
+                body.append(' ' + line)
+            pos = start
+            for line in hunk.lines:
+                tag, text = line[0], line[1:]
+                if tag == '+':
+                    new.append(text)
+                    body.append(line)
+                    continue
+                if pos >= len(old) or old[pos] != text:
+                    raise PatchError('Hunk does not match base version of {}'.format(self.path))
+                if tag == ' ':
+                    new.append(text)
+                body.append(line)
+                pos += 1
+        for line in old[pos:]:
+            new.append(line)
+            body.append(' ' + line)
+
+        diff = list(self.header)
+        diff.append('--- {}\n'.format('/dev/null' if self.new_file else 'a/' + self.old_path))
+        diff.append('+++ {}\n'.format('/dev/null' if self.deleted_file else 'b/' + self.new_path))
+        if body:
+            diff.append('@@ -{} +{} @@\n'.format(hunk_range(len(old)), hunk_range(len(new))))
+            for line in body:
+                diff.append(line if line.endswith('\n') else line + '\n' + NO_NEWLINE_MARKER)
+        return ''.join(new), ''.join(diff)
+
+
+# same convention as git for the ranges in a hunk header
+def hunk_range(length):
+    if length == 0:
+        return '0,0'
+    if length == 1:
+        return '1'
+    return '1,{}'.format(length)
+
+
+# split text into lines keeping the line terminators. unlike str.splitlines only
+# '\n' is considered a line terminator, as for git and patch
+def split_lines(text):
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+# unquote a path in a diff header, if quoted by git
+def unquote_path(path):
+    path = path.rstrip('\n')
+    if path.startswith('"') and path.endswith('"'):
+        path = codecs.escape_decode(path[1:-1].encode('utf-8'))[0].decode('utf-8')
+    return path
+
+
+# strip the a/ or b/ prefix of a path in a diff header, unquoting it if needed
+def strip_path_prefix(path):
+    path = path.rstrip('\n')
+    # in the ---/+++ lines git ends the unquoted paths containing spaces with a tab
+    if not path.startswith('"'):
+        path = path.partition('\t')[0]
+    path = unquote_path(path)
+    if path == '/dev/null':
+        return None
+    return path[2:] if path[:2] in ('a/', 'b/') else path
+
+
+# start a patch from its "diff --git" line. the paths in this line are ambiguous if they
+# contain spaces, they are overridden by the ---/+++ or rename lines when available
+def _start_patch(line):
+    matches = diff_header_regex.match(line.rstrip('\n'))
+    if matches:
+        old_path, new_path = matches.groups()
+    else:
+        old_path, _, new_path = line[len('diff --git '):].rstrip('\n').partition(' b/')
+    patch = FilePatch(strip_path_prefix(old_path), strip_path_prefix(new_path) if matches else new_path)
+    patch.header.append(line)
+    return patch
+
+
+# parse an extended header line of a patch (the lines before its first hunk)
+def _parse_header_line(patch, line):
+    if patch.binary:
+        # data of a binary patch
+        return
+    if line.startswith('--- '):
+        path = strip_path_prefix(line[4:])
+        if path is not None:
+            patch.old_path = path
+        return
+    if line.startswith('+++ '):
+        path = strip_path_prefix(line[4:])
+        if path is not None:
+            patch.new_path = path
+        return
+    if line.startswith('new file mode'):
+        patch.new_file = True
+    elif line.startswith('deleted file mode'):
+        patch.deleted_file = True
+    elif line.startswith('old mode') or line.startswith('new mode'):
+        patch.mode_changed = True
+    elif line.startswith('rename from '):
+        patch.old_path = unquote_path(line[len('rename from '):])
+    elif line.startswith('rename to '):
+        patch.new_path = unquote_path(line[len('rename to '):])
+    elif line.startswith('Binary files') or line.startswith('GIT binary patch'):
+        patch.binary = True
+    patch.header.append(line)
+
+
+# parse the contents of a diff into a list of FilePatch objects
+def parse_diff(text):
+    patches = []
+    patch, hunk = None, None
+    for line in split_lines(text):
+        if line.startswith('diff --git '):
+            patch = _start_patch(line)
+            patches.append(patch)
+            hunk = None
+        elif patch is None:
+            continue
+        elif hunk is not None and line[:1] in (' ', '-', '+', '\n') and (hunk.old_length or hunk.new_length):
+            # some tools strip the trailing whitespace of empty context lines
+            if line == '\n':
+                line = ' \n'
+            hunk.lines.append(line)
+            if line[0] != '+':
+                hunk.old_length -= 1
+            if line[0] != '-':
+                hunk.new_length -= 1
+        elif hunk is not None and line.startswith('\\'):
+            # the previous line is not terminated by a newline in the file
+            if hunk.lines:
+                hunk.lines[-1] = hunk.lines[-1].rstrip('\n')
+        elif line.startswith('@@'):
+            matches = hunk_header_regex.match(line)
+            if not matches:
+                raise PatchError('Invalid hunk header: {}'.format(line.rstrip()))
+            old_start, old_length, new_start, new_length = matches.groups()
+            hunk = Hunk(int(old_start), int(1 if old_length is None else old_length),
+                        int(new_start), int(1 if new_length is None else new_length))
+            patch.hunks.append(hunk)
+        elif hunk is None:
+            _parse_header_line(patch, line)
+
+    # hunks keep track of the remaining lines while parsing, restore their length
+    for patch in patches:
+        for hunk in patch.hunks:
+            hunk.old_length = sum(1 for line in hunk.lines if line[0] != '+')
+            hunk.new_length = sum(1 for line in hunk.lines if line[0] != '-')
+    return patches
+
+
+# scan a diff given as an iterable of lines of bytes, without keeping it in memory. returns
+# a list of FilePatch objects with their headers only and the position of each of them in
+# the diff, to be read later with read_patch
+def scan_diff(lines):
+    patches = []
+    patch, in_hunks = None, False
+    offset = 0
+    for line in lines:
+        # hunk lines start with a tag, so they cannot be mistaken for the start of a patch
+        if line.startswith(b'diff --git '):
+            if patch is not None:
+                patch.length = offset - patch.offset
+            patch = _start_patch(line.decode('utf-8', errors='replace'))
+            patch.offset = offset
+            patches.append(patch)
+            in_hunks = False
+        elif patch is not None and not in_hunks:
+            if line.startswith(b'@@'):
+                in_hunks = True
+            else:
+                _parse_header_line(patch, line.decode('utf-8', errors='replace'))
+        offset += len(line)
+    if patch is not None:
+        patch.length = offset - patch.offset
+    return patches
+
+
+# split chunks of bytes into lines, keeping the line terminators
+def iter_lines(chunks):
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+# write a diff given as an iterable of lines of bytes to a gzip file, starting a new gzip member
+# at each patch. returns the patches as scan_diff, with the position and length of their
+# member in the file
+def write_compressed_diff(lines, diff_file, level):
+    # compressed (start, end) of the member starting at each position of the uncompressed diff
+    members = {}
+    compressor, member = None, None
+    offset = 0
+
+    def compress(lines):
+        nonlocal compressor, member, offset
+        for line in lines:
+            if compressor is None or line.startswith(b'diff --git '):
+                if compressor is not None:
+                    diff_file.write(compressor.flush())
+                    member[1] = diff_file.tell()
+                # wbits=31 writes the gzip header and trailer of each member
+                compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+                member = members[offset] = [diff_file.tell(), None]
+            diff_file.write(compressor.compress(line))
+            offset += len(line)
+            yield line
+        if compressor is not None:
+            diff_file.write(compressor.flush())
+            member[1] = diff_file.tell()
+
+    patches = scan_diff(compress(lines))
+    for patch in patches:
+        start, end = members[patch.offset]
+        patch.offset, patch.length = start, end - start
+    return patches
+
+
+# scan a diff file, compressed or not, as scan_diff does. the patches of a compressed diff
+# have the position and length of their member in the file
+def scan_diff_file(diff_file):
+    if diff_file.read(2) != GZIP_MAGIC:
+        diff_file.seek(0)
+        return scan_diff(diff_file)
+    diff_file.seek(0)
+    patches = []
+    for offset, length, data in iter_gzip_members(diff_file):
+        for patch in scan_diff(iter_lines([data])):
+            patch.offset, patch.length = offset, length
+            patches.append(patch)
+    return patches
+
+
+# decompress the members of a gzip file one at a time. yields tuples (position in the file,
+# length, decompressed data)
+def iter_gzip_members(diff_file):
+    offset, fed = 0, 0
+    decompressor, parts = zlib.decompressobj(31), []
+    pending = b''
+    while True:
+        if not pending:
+            pending = diff_file.read(READ_CHUNK_SIZE)
+            if not pending:
+                break
+        fed += len(pending)
+        parts.append(decompressor.decompress(pending))
+        pending = b''
+        if decompressor.eof:
+            # the data after the end of the member belongs to the next one
+            pending = decompressor.unused_data
+            length = fed - len(pending)
+            yield offset, length, b''.join(parts)
+            offset, fed = offset + length, 0
+            decompressor, parts = zlib.decompressobj(31), []
+    if fed:
+        raise PatchError('Truncated gzip member at offset {}'.format(offset))
+
+
+# open a diff file, compressed or not, to read its uncompressed contents
+def open_diff(path):
+    with open(path, 'rb') as diff_file:
+        compressed = diff_file.read(2) == GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+# read the bytes of a single patch from a diff file, given its position as found by scan_diff
+# or write_compressed_diff, decompressing them if needed
+def read_patch_bytes(diff_file, offset, length):
+    diff_file.seek(offset)
+    data = diff_file.read(length)
+    if data.startswith(GZIP_MAGIC):
+        try:
+            data = gzip.decompress(data)
+        except (OSError, EOFError, zlib.error) as e:
+            raise PatchError('Invalid compressed patch at offset {}: {}'.format(offset, e))
+    return data
+
+
+# read and parse a single patch from a diff file, given its position as found by scan_diff
+# or write_compressed_diff
+def read_patch(diff_file, offset, length):
+    patches = parse_diff(read_patch_bytes(diff_file, offset, length).decode('utf-8', errors='replace'))
+    if len(patches) != 1:
+        raise PatchError('No patch found at offset {}'.format(offset))
+    return patches[0]
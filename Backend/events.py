@@ -0,0 +1,58 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+
+import db
+
+# notifications of the progress of reviews. the background stages publish their transitions
+# and counters, the /review/<id>/events endpoint streams them to the frontend. the last state
+# of a review is stored in the db, so the stages run by worker processes reach the streams of
+# the application too: the subscribers in the same process are notified right away, the
+# others find the state when they poll the db
+
+FINAL_STAGES = ('ready', 'error')
+
+
+class ReviewEvents:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(list)
+
+    def publish(self, review_id, stage, **counters):
+        # the counters accumulated so far can come from stages run by other processes
+        with db.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            state = stored_state(conn, review_id) or {}
+            state.update(counters)
+            state['stage'] = stage
+            # the counters of a review processed again start from scratch
+            conn.execute('UPDATE reviews SET progress = ? WHERE id = ?',
+                         (None if stage in FINAL_STAGES else json.dumps(state), review_id))
+        with self.lock:
+            for subscriber in self.subscribers[review_id]:
+                subscriber.put(dict(state))
+
+    # returns a queue receiving the events of the review published by this process
+    def subscribe(self, review_id):
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers[review_id].append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, review_id, subscriber):
+        with self.lock:
+            self.subscribers[review_id].remove(subscriber)
+            if not self.subscribers[review_id]:
+                del self.subscribers[review_id]
+
+
+# last state published for a review being processed, None if not known
+def stored_state(conn, review_id):
+    row = conn.execute('SELECT progress FROM reviews WHERE id = ?', (review_id, )).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+# format an event for a text/event-stream response
+def format_event(event):
+    return 'data: {}\n\n'.format(json.dumps(event))
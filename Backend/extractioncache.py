@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import threading
+import time
+
+import cacheutils
+import gitstore
+import interning
+import javasource
+
+# cache of the extractor results shared across reviews. the method calls into a modified file
+# only depend on the base commit of the review, on the contents of the file and on the
+# contents of the other files of the review that call its methods (or that are removed).
+# an entry stores the method calls into one file and is keyed by all of them, so reviews of
+# the same repository touching the same files in the same way skip the extractor for them.
+# entries are evicted in least recently used order when the cache holds too many rows
+
+logger = logging.getLogger(__name__)
+
+# columns of the cached method calls, with the strings referenced by id
+METHODCALL_COLUMNS = ', '.join(interning.INTERNED_COLUMNS)
+
+
+class ExtractionCache:
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # cache keys of the method calls into each of the `targets`. `files` maps each Java file
+    # touched by the review to its contents after the diff is applied, None if removed.
+    # targets whose contents are not known have no key
+    def keys(self, repo_id, base_commit_sha, files, targets):
+        keys = {}
+        for target in targets:
+            contents = files.get(target)
+            if contents is None:
+                continue
+            names = javasource.callable_method_names(contents)
+            key = hashlib.sha1('{}\0{}\0{}\0{}\0'.format(
+                repo_id, base_commit_sha, target, gitstore.blob_hash(contents.encode('utf-8'))).encode('utf-8'))
+            for file_path in sorted(files):
+                other = files[file_path]
+                if file_path == target:
+                    continue
+                if other is None:
+                    key.update('{}\0-\0'.format(file_path).encode('utf-8'))
+                elif javasource.references_any(other, names):
+                    key.update('{}\0{}\0'.format(file_path, gitstore.blob_hash(other.encode('utf-8'))).encode('utf-8'))
+            keys[target] = key.hexdigest()
+        return keys
+
+    # find the cached entries of some targets. returns a dict from target to entry id
+    def lookup(self, conn, keys, targets):
+        found = {}
+        for target, key in keys.items():
+            row = conn.execute('SELECT id FROM extractioncache WHERE cache_key = ?', (key, )).fetchone()
+            if row:
+                found[target] = row[0]
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(targets) - len(found)
+        return found
+
+    # copy the method calls of some cached entries into the methodcalls of a review
+    def copy(self, conn, review_id, entry_ids):
+        now = time.time()
+        for entry_id in entry_ids:
+            conn.execute('INSERT INTO methodcallrows (review_id, {0}) SELECT ?, {0} FROM cachedmethodcalls WHERE entry_id = ?'.format(METHODCALL_COLUMNS),
+                (review_id, entry_id))
+            conn.execute('UPDATE extractioncache SET last_used = ? WHERE id = ?', (now, entry_id))
+
+    # store the method calls of a review into the files with the given keys, which have just
+    # been extracted
+    def store(self, conn, review_id, repo_id, base_commit_sha, keys):
+        now = time.time()
+        for target, key in keys.items():
+            cur = conn.execute('INSERT OR IGNORE INTO extractioncache (cache_key, repo_id, base_commit_sha, to_file, row_count, last_used) VALUES (?, ?, ?, ?, 0, ?)',
+                (key, repo_id, base_commit_sha, target, now))
+            if cur.rowcount == 0:
+                # stored in the meantime by another review
+                continue
+            entry_id = cur.lastrowid
+            cur = conn.execute('INSERT INTO cachedmethodcalls (entry_id, {0}) SELECT ?, {0} FROM methodcallrows '
+                'WHERE review_id = ? AND to_file_id = (SELECT id FROM strings WHERE value = ?)'.format(METHODCALL_COLUMNS),
+                (entry_id, review_id, target))
+            conn.execute('UPDATE extractioncache SET row_count = ? WHERE id = ?', (cur.rowcount, entry_id))
+        self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(row_count), 0) FROM extractioncache').fetchone()[0]
+        if total <= self.max_rows:
+            return
+        entries = [((entry_id, ), row_count) for entry_id, row_count in
+                   conn.execute('SELECT id, row_count FROM extractioncache ORDER BY last_used').fetchall()]
+        evicted, _ = cacheutils.lru_trim(entries, total, self.max_rows)
+        conn.executemany('DELETE FROM cachedmethodcalls WHERE entry_id = ?', evicted)
+        conn.executemany('DELETE FROM extractioncache WHERE id = ?', evicted)
+        logger.info('Evicted {} entries from the extraction cache'.format(len(evicted)))
@@ -0,0 +1,190 @@
+import atexit
+import logging
+import queue
+import select
+import subprocess
+import threading
+import time
+
+import config
+
+# client for the method call extractor running in server mode (java -jar mcextractor.jar --server).
+# the extractor processes are long-lived, so the JVM startup is paid once and the type solver
+# caches stay warm between reviews of the same repository
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractorError(Exception):
+    pass
+
+
+class ExtractorWorker:
+    def __init__(self, jar=None, java_options=None):
+        self.jar = jar or config.EXTRACTOR_JAR
+        self.java_options = java_options or config.EXTRACTOR_JAVA_OPTIONS
+        self.process = None
+        self.last_used = 0
+
+    def start(self):
+        command = ['java'] + self.java_options + ['-jar', self.jar, '--server']
+        logger.info('Starting extractor worker {}'.format(command))
+        # stderr is inherited, the extractor logs its progress there
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.last_used = time.monotonic()
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self._send('QUIT')
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _send(self, *fields):
+        self.process.stdin.write('\t'.join(fields).encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+
+    def _receive(self):
+        line = self.process.stdout.readline()
+        if not line:
+            # stdout was closed, the process is exiting
+            try:
+                code = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                code = None
+            raise ExtractorError('Extractor process exited with code {}'.format(code))
+        return line.decode('utf-8').rstrip('\n')
+
+    # check that the process is alive and answering requests
+    def ping(self, timeout=10):
+        if not self.alive():
+            return False
+        try:
+            self._send('PING')
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            return bool(ready) and self._receive() == 'PONG'
+        except (OSError, ExtractorError):
+            return False
+
+    # extract the method calls from and to the given files of the repository. `revision` is the
+    # checked out commit and `state` identifies the whole working tree (revision and applied diff),
+    # they are used by the extractor to decide which caches can be reused.
+    # the rows are yielded as they are read from the pipe, so they are never all held in memory.
+    # if the generator is not exhausted the worker is left with unread output and must be stopped
+    def extract(self, revision, state, repo_folder, files):
+        self.last_used = time.monotonic()
+        try:
+            self._send('EXTRACT', revision, state, repo_folder, *files)
+            while True:
+                line = self._receive()
+                tag, _, payload = line.partition('\t')
+                if tag == 'R':
+                    yield payload
+                elif tag == 'OK':
+                    return
+                elif tag == 'ERR':
+                    raise ExtractorError(payload)
+                else:
+                    raise ExtractorError('Unexpected extractor output: {}'.format(line))
+        except OSError as e:
+            raise ExtractorError('Cannot communicate with extractor: {}'.format(e))
+        finally:
+            self.last_used = time.monotonic()
+
+
+class ExtractorPool:
+    def __init__(self, size=None):
+        self.size = size or config.EXTRACTOR_POOL_SIZE
+        self.idle = queue.Queue()
+        self.workers = []
+        for _ in range(self.size):
+            worker = ExtractorWorker()
+            self.workers.append(worker)
+            self.idle.put(worker)
+
+    # take an idle worker, making sure it is healthy. workers are started lazily
+    def _acquire(self):
+        worker = self.idle.get()
+        try:
+            if not worker.alive():
+                worker.restart()
+            elif time.monotonic() - worker.last_used > config.EXTRACTOR_HEALTH_CHECK_INTERVAL and not worker.ping():
+                logger.warning('Extractor worker not responding, restarting it')
+                worker.restart()
+        except Exception:
+            self.idle.put(worker)
+            raise
+        return worker
+
+    # generator over the rows extracted by one of the workers, see ExtractorWorker.extract
+    def extract(self, revision, state, repo_folder, files):
+        worker = self._acquire()
+        completed = False
+        try:
+            yielded = False
+            try:
+                for row in worker.extract(revision, state, repo_folder, files):
+                    yielded = True
+                    yield row
+            except ExtractorError:
+                if worker.alive() or yielded:
+                    # the request failed but the worker is fine, or the rows
+                    # already consumed cannot be taken back
+                    raise
+                # the worker crashed before answering, restart it and retry once
+                logger.warning('Extractor worker crashed, restarting it')
+                worker.restart()
+                yield from worker.extract(revision, state, repo_folder, files)
+            completed = True
+        finally:
+            if not completed and worker.alive():
+                # the protocol is out of sync, the worker will be restarted when acquired again
+                worker.stop()
+            self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+# parse a row of the extractor output into the values of a methodcalls record:
+# (from_file, call_start_line, call_start_column, call_end_line, call_end_column, method_call,
+#  short_method_qualifier, full_method_qualifier, to_file, declaration_start_line,
+#  declaration_start_column, declaration_end_line, declaration_end_column).
+# raises ValueError if the row is malformed
+def parse_row(row):
+    fields = row.split(';')
+    if len(fields) != 13:
+        raise ValueError('Expected 13 fields, got {}'.format(len(fields)))
+    o_file, o_s_l, o_s_c, o_e_l, o_e_c, method_call, short_qual, long_qual, d_file, d_s_l, d_s_c, d_e_l, d_e_c = fields
+    if not o_file or not d_file:
+        raise ValueError('Missing file path')
+    # the extractor escapes the semicolons in the method call
+    method_call = method_call.replace('&%&', ';')
+    return (o_file, int(o_s_l), int(o_s_c), int(o_e_l), int(o_e_c), method_call, short_qual, long_qual,
+            d_file, int(d_s_l), int(d_s_c), int(d_e_l), int(d_e_c))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# get the pool of extractor workers shared by the whole process
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractorPool()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,85 @@
+import os
+import threading
+import zlib
+
+import cacheutils
+import gitstore
+
+# content-addressed cache of the file contents and diffs served to the frontend. entries are
+# keyed by their git blob hash, stored compressed on disk and evicted in least recently used
+# order when the total size goes over the configured limit
+
+
+class FileCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key[2:])
+
+    def _scan(self):
+        # size of the cache on disk, computed once and then kept up to date
+        if self.total_bytes is None:
+            self.total_bytes = 0
+            for entry in self._entries():
+                self.total_bytes += entry[2]
+
+    def _entries(self):
+        if not os.path.isdir(self.folder):
+            return
+        for prefix in os.listdir(self.folder):
+            prefix_folder = os.path.join(self.folder, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_folder):
+                continue
+            for name in os.listdir(prefix_folder):
+                path = os.path.join(prefix_folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    # store a string in the cache, returns its key
+    def put(self, data):
+        encoded = data.encode('utf-8')
+        key = gitstore.blob_hash(encoded)
+        path = self._path(key)
+        with self.lock:
+            self._scan()
+            if os.path.exists(path):
+                os.utime(path)
+                return key
+            compressed = zlib.compress(encoded)
+            cacheutils.write_atomic(path, compressed)
+            self.total_bytes += len(compressed)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return key
+
+    # get a string from the cache, None if not cached
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                data = zlib.decompress(entry.read()).decode('utf-8')
+            # the modification time is used as last access time for the eviction
+            os.utime(path)
+        except (FileNotFoundError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        evicted, self.total_bytes = cacheutils.lru_trim([(path, size) for path, _, size in entries], self.total_bytes, self.max_bytes)
+        for path in evicted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
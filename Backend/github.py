@@ -0,0 +1,199 @@
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cacheutils
+import config
+
+# client for github. all the requests go through a single keep-alive session. responses of
+# the REST API are cached on disk with their ETag and revalidated with If-None-Match, so
+# unchanged resources do not count against the rate limit. when the rate limit is exhausted
+# the requests wait for it to be reset, and rejected requests are retried after the time
+# github asks for
+
+logger = logging.getLogger(__name__)
+
+# attempts of a request rejected because of the rate limit or of a server error
+MAX_ATTEMPTS = 4
+# pull requests looked up with a single GraphQL query
+GRAPHQL_BATCH_SIZE = 50
+# items in each page of the lists of the REST API
+PAGE_SIZE = 100
+# seconds waited after a rate limited response whose Retry-After header cannot be parsed
+DEFAULT_RETRY_AFTER = 60
+
+
+class GitHubError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GitHubClient:
+    def __init__(self, api_url, web_url, token=None, cache_dir=None, pool_size=10):
+        self.api_url = api_url.rstrip('/')
+        self.web_url = web_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = 'VisualisationOfCodeChanges'
+        if token:
+            self.session.headers['Authorization'] = 'token {}'.format(token)
+        self.lock = threading.Lock()
+        # time before which no request is sent, because the rate limit is exhausted
+        self.blocked_until = 0
+        self.requests = 0
+        self.not_modified = 0
+
+    def _wait_rate_limit(self):
+        with self.lock:
+            delay = self.blocked_until - time.time()
+        if delay > 0:
+            delay = min(delay, config.GITHUB_MAX_RATE_LIMIT_WAIT)
+            logger.warning('Github rate limit exhausted, waiting {:.0f}s'.format(delay))
+            time.sleep(delay)
+
+    def _update_rate_limit(self, resp):
+        remaining = resp.headers.get('X-RateLimit-Remaining')
+        reset = resp.headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None and int(remaining) == 0:
+            with self.lock:
+                self.blocked_until = max(self.blocked_until, float(reset))
+
+    # send a request, waiting and retrying if it is rejected because of the rate limit
+    def request(self, method, url, **kwargs):
+        for attempt in range(MAX_ATTEMPTS):
+            self._wait_rate_limit()
+            resp = self.session.request(method, url, **kwargs)
+            with self.lock:
+                self.requests += 1
+            self._update_rate_limit(resp)
+            retry_after = resp.headers.get('Retry-After')
+            if resp.status_code in (403, 429) and (retry_after or resp.headers.get('X-RateLimit-Remaining') == '0'):
+                # primary or secondary rate limit, wait for the time asked by github
+                if retry_after:
+                    with self.lock:
+                        self.blocked_until = max(self.blocked_until, time.time() + retry_after_delay(retry_after))
+            elif resp.status_code < 500:
+                return resp
+            elif attempt < MAX_ATTEMPTS - 1:
+                time.sleep(2 ** attempt)
+            if attempt < MAX_ATTEMPTS - 1:
+                resp.close()
+        return resp
+
+    def _cache_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key[2:] + '.json')
+
+    def _read_cache(self, url):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(url)) as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_cache(self, url, etag, data):
+        if not self.cache_dir:
+            return
+        cacheutils.write_atomic(self._cache_path(url), json.dumps({'etag': etag, 'data': data}).encode('utf-8'))
+
+    # get a resource of the REST API, revalidating the cached version if any
+    def get_json(self, path):
+        url = self.api_url + path
+        cached = self._read_cache(url)
+        headers = {'Accept': 'application/vnd.github.v3+json'}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        resp = self.request('GET', url, headers=headers)
+        if resp.status_code == 304 and cached:
+            with self.lock:
+                self.not_modified += 1
+            return cached['data']
+        if resp.status_code != 200:
+            raise GitHubError('GET {} failed with status {}'.format(url, resp.status_code), resp.status_code)
+        data = resp.json()
+        if resp.headers.get('ETag'):
+            self._write_cache(url, resp.headers['ETag'], data)
+        return data
+
+    def get_pull_request(self, user, repo, number):
+        return self.get_json('/repos/{}/{}/pulls/{}'.format(user, repo, number))
+
+    def get_repository(self, user, repo):
+        return self.get_json('/repos/{}/{}'.format(user, repo))
+
+    # get the open pull requests of a repository, all the pages of them
+    def get_open_pull_requests(self, user, repo):
+        pulls = []
+        page = 1
+        while True:
+            batch = self.get_json('/repos/{}/{}/pulls?state=open&per_page={}&page={}'.format(user, repo, PAGE_SIZE, page))
+            pulls += batch
+            if len(batch) < PAGE_SIZE:
+                return pulls
+            page += 1
+
+    # get the diff of a pull request as a streamed response, to be closed by the caller
+    def get_diff(self, user, repo, number):
+        url = '{}/{}/{}/pull/{}.diff'.format(self.web_url, user, repo, number)
+        resp = self.request('GET', url, stream=True)
+        if resp.status_code != 200:
+            resp.close()
+            raise GitHubError('Cannot download diff from {}, status {}'.format(url, resp.status_code), resp.status_code)
+        return resp
+
+    # get the base and head commits of many pull requests, with a GraphQL query for each
+    # batch of them. `pulls` is a list of tuples (user, repo, number), the result maps each of
+    # them to a tuple (base sha, head sha), or None if the pull request does not exist
+    def get_pull_request_commits(self, pulls):
+        result = {}
+        for start in range(0, len(pulls), GRAPHQL_BATCH_SIZE):
+            batch = pulls[start:start + GRAPHQL_BATCH_SIZE]
+            fields = ['p{}: repository(owner: {}, name: {}) {{ pullRequest(number: {}) {{ baseRefOid headRefOid }} }}'.format(
+                i, json.dumps(user), json.dumps(repo), int(number)) for i, (user, repo, number) in enumerate(batch)]
+            resp = self.request('POST', self.api_url + '/graphql', json={'query': '{ ' + ' '.join(fields) + ' }'})
+            if resp.status_code != 200:
+                raise GitHubError('GraphQL query failed with status {}'.format(resp.status_code), resp.status_code)
+            data = resp.json().get('data') or {}
+            for i, pull in enumerate(batch):
+                pull_request = (data.get('p{}'.format(i)) or {}).get('pullRequest')
+                result[pull] = (pull_request['baseRefOid'], pull_request['headRefOid']) if pull_request else None
+        return result
+
+
+# seconds to wait given by a Retry-After header, either a number of seconds or an HTTP date
+def retry_after_delay(value):
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        logger.warning('Invalid Retry-After header {!r}'.format(value))
+        return DEFAULT_RETRY_AFTER
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# get the github client configured in config.py, one for the whole process
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient(config.GITHUB_API_URL, config.GITHUB_URL, config.GITHUB_TOKEN, config.GITHUB_CACHE_DIR)
+        return _client
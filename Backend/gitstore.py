@@ -0,0 +1,96 @@
+import hashlib
+import os
+import subprocess
+import threading
+
+# read-only access to the object database of a cloned repository. blobs are read
+# through a long-lived `git cat-file --batch` process, which does not touch the working
+# tree, so reads are cheap and do not interfere with jobs that check out the repository.
+# the process is restarted if the folder is replaced (e.g. the clone was removed by the
+# garbage collection and cloned again)
+
+
+class ObjectStore:
+    def __init__(self, repo_folder):
+        self.repo_folder = repo_folder
+        self.lock = threading.Lock()
+        self.process = None
+        self.folder_id = None
+
+    def _start(self):
+        self.folder_id = self._folder_id()
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch=%(objectname) %(objecttype) %(objectsize)'], cwd=self.repo_folder,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _folder_id(self):
+        stat = os.stat(self.repo_folder)
+        return stat.st_dev, stat.st_ino
+
+    def _request(self, object_name):
+        if self.process is not None and self.process.poll() is None and self._folder_id() != self.folder_id:
+            self.close()
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        self.process.stdin.write(object_name.encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline()
+        if not header:
+            raise BrokenPipeError('git cat-file exited')
+        fields = header.decode('utf-8').rstrip('\n').split(' ')
+        # "<name> missing" or "<name> ambiguous", the name may contain spaces
+        if fields[-1] in ('missing', 'ambiguous'):
+            return None
+        oid, object_type, size = fields
+        data = self.process.stdout.read(int(size) + 1)[:-1]
+        return oid, object_type, data
+
+    # read the blob at `path` in revision `rev`. returns a tuple (oid, contents) or None
+    # if the path does not exist in that revision
+    def read(self, rev, path):
+        object_name = '{}:{}'.format(rev, path)
+        with self.lock:
+            try:
+                result = self._request(object_name)
+            except (BrokenPipeError, OSError):
+                # the process died, restart it and retry once
+                self.close()
+                result = self._request(object_name)
+        if result is None or result[1] != 'blob':
+            return None
+        return result[0], result[2]
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.wait()
+            self.process = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# get the object store of a repository, one per repository folder for the whole process
+def get_store(repo_folder):
+    with _stores_lock:
+        store = _stores.get(repo_folder)
+        if store is None:
+            store = _stores[repo_folder] = ObjectStore(repo_folder)
+        return store
+
+
+# stop the object store of a repository folder, if any, before the folder is removed
+def close_store(repo_folder):
+    with _stores_lock:
+        store = _stores.pop(repo_folder, None)
+    if store is not None:
+        with store.lock:
+            store.close()
+
+
+# hash of some data as git would compute it for a blob with the same contents
+def blob_hash(data):
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
@@ -0,0 +1,62 @@
+# the strings of the method calls (file paths, method calls and qualifiers) are repeated on
+# many rows and across reviews, so they are stored once in the strings table. the method calls
+# of the reviews (methodcallrows) and of the extraction cache (cachedmethodcalls) reference
+# them by id, and the methodcalls view joins them back for the readers that need them.
+# strings are never updated, and the ones no longer referenced are removed by the garbage
+# collection
+
+STRING_COLUMNS = ('from_file', 'method_call', 'short_method_qualifier', 'full_method_qualifier', 'to_file')
+# columns of a method call, as in the methodcalls view
+COLUMNS = (
+    'from_file', 'call_start_line', 'call_start_column', 'call_end_line', 'call_end_column', 'method_call',
+    'short_method_qualifier', 'full_method_qualifier', 'to_file', 'declaration_start_line', 'declaration_start_column',
+    'declaration_end_line', 'declaration_end_column',
+)
+# the same columns in the tables referencing the strings by id
+INTERNED_COLUMNS = tuple(column + '_id' if column in STRING_COLUMNS else column for column in COLUMNS)
+# tables referencing the strings
+REFERENCING_TABLES = ('methodcallrows', 'cachedmethodcalls')
+# strings looked up with a single query
+LOOKUP_BATCH_SIZE = 500
+
+
+# add to the strings table the strings of the method calls in `table`, which has the columns
+# of the methodcalls view
+def intern(conn, table):
+    conn.execute('INSERT OR IGNORE INTO strings (`value`) {}'.format(' UNION '.join(
+        'SELECT `{0}` FROM {1} WHERE `{0}` IS NOT NULL'.format(column, table) for column in STRING_COLUMNS)))
+
+
+# expressions selecting INTERNED_COLUMNS from the rows of `alias`, a table with the columns of
+# the methodcalls view whose strings are interned
+def interned_values(alias):
+    return ', '.join('(SELECT `id` FROM strings WHERE `value` = {}.`{}`)'.format(alias, column) if column in STRING_COLUMNS
+                     else '{}.`{}`'.format(alias, column) for column in COLUMNS)
+
+
+# expression of the string with the id given by `expression`
+def value_of(expression):
+    return '(SELECT `value` FROM strings WHERE `id` = {})'.format(expression)
+
+
+# ids of some strings, by string. strings not stored are left out
+def ids(conn, values):
+    return dict(_lookup(conn, 'SELECT `value`, `id` FROM strings WHERE `value` IN ({})', list(values)))
+
+
+# strings with some ids, by id
+def values(conn, ids):
+    return dict(_lookup(conn, 'SELECT `id`, `value` FROM strings WHERE `id` IN ({})', list(ids)))
+
+
+def _lookup(conn, query, keys):
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        batch = keys[start:start + LOOKUP_BATCH_SIZE]
+        yield from conn.execute(query.format(','.join('?' * len(batch))), batch)
+
+
+# remove the strings not referenced by any method call. returns the number of removed strings
+def collect_garbage(conn):
+    referenced = ' UNION '.join('SELECT `{}` FROM {}'.format(column, table)
+                                for table in REFERENCING_TABLES for column in INTERNED_COLUMNS if column.endswith('_id'))
+    return conn.execute('DELETE FROM strings WHERE `id` NOT IN ({})'.format(referenced)).rowcount
@@ -0,0 +1,78 @@
+import re
+
+# lightweight heuristics on Java source code, used to decide which method calls can be
+# affected by a change without running the extractor
+
+# an identifier followed by "(" and preceded by a type (a word, or the end of generics or
+# of an array type). this matches all the method declarations, and a few method calls too
+METHOD_DECLARATION_REGEX = r'[\w>\]]\s+(\w+)\s*\('
+# a private method declaration, up to its name
+PRIVATE_METHOD_REGEX = r'\bprivate\s+(?:(?:static|final|synchronized|native|strictfp)\s+)*(?:<[^(){};]*>\s*)?[\w.$<>\[\]?,\s]+?\s(\w+)\s*\('
+# name of a class, interface, annotation, enum or record declaration
+TYPE_DECLARATION_REGEX = r'\b(?:class|interface|enum|record)\s+(\w+)'
+# the word (or annotation) ending a piece of source code
+LAST_WORD_REGEX = r'(@?\w+)\s*$'
+# words that can precede a method call and are never types
+NOT_TYPES = {'return', 'new', 'throw', 'else', 'case', 'yield', 'assert'}
+# words preceding the name of a constructor declaration, which has no return type
+CONSTRUCTOR_MODIFIERS = {'public', 'protected', 'private'}
+
+method_declaration_regex = re.compile(METHOD_DECLARATION_REGEX)
+private_method_regex = re.compile(PRIVATE_METHOD_REGEX)
+type_declaration_regex = re.compile(TYPE_DECLARATION_REGEX)
+last_word_regex = re.compile(LAST_WORD_REGEX)
+
+
+# names of the methods (possibly) declared in a Java source file. the result is a superset of
+# the declared names, so it is safe to use to check if a file may contain calls to them
+def declared_method_names(source):
+    return {matches.group(1) for matches in _method_declarations(source)}
+
+
+# names of the methods declared in a Java source file that other files can call. it is still
+# a superset of them: only the names that are certainly not called from another file are left
+# out, the private methods and the constructors (the extractor only reports method calls)
+def callable_method_names(source):
+    type_names = set(type_declaration_regex.findall(source))
+    private_names = {matches.start(1) for matches in private_method_regex.finditer(source)}
+    names = set()
+    for matches in _method_declarations(source):
+        if matches.start(1) in private_names:
+            continue
+        preceding = last_word_regex.search(source, max(0, matches.start() - 50), matches.start() + 1)
+        preceding = preceding.group(1) if preceding else ''
+        if matches.group(1) in type_names and (preceding in CONSTRUCTOR_MODIFIERS or preceding.startswith('@')):
+            continue
+        names.add(matches.group(1))
+    return names
+
+
+def _method_declarations(source):
+    for matches in method_declaration_regex.finditer(source):
+        # skip calls preceded by a keyword, e.g. "return foo(...)"
+        preceding = source[max(0, matches.start() - 6):matches.start() + 1].split()
+        if preceding and preceding[-1].lstrip('.;{}()=') in NOT_TYPES:
+            continue
+        yield matches
+
+
+# check if a source file contains a call to any of the given method names. this is the same
+# criterion used by the extractor to find the possible callers of a class
+def references_any(source, names):
+    if not names:
+        return False
+    regex = r'\b(?:{})\s*\('.format('|'.join(re.escape(name) for name in names))
+    return re.search(regex, source) is not None
+
+
+# files whose method calls may change when some other files change, because they declare
+# methods called by them. `files` maps the paths of the candidates to their contents and
+# `callers` are the contents of the changed files, before and after the change. returns the
+# paths of the affected files
+def affected_files(files, callers):
+    affected = []
+    for file_path, contents in files.items():
+        names = callable_method_names(contents)
+        if any(references_any(source, names) for source in callers):
+            affected.append(file_path)
+    return affected
@@ -0,0 +1,265 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+import config
+import db
+
+# durable queue of the background jobs. jobs are stored with the jobs they depend on, and
+# are claimed by the workers of any process sharing the queue with a time-limited lease,
+# which the workers renew while the jobs run. a job whose lease expires (e.g. because its
+# worker died) is claimed again by another worker, up to a maximum number of attempts.
+# a job can hold the lock of a resource (e.g. the folder of a repository it modifies): jobs
+# with the same lock are never run at the same time. queued jobs are claimed by priority
+# class and then in submission order, and at most a fixed number of background jobs run at
+# the same time in each stage, so the workers are never all busy with background work
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# job statuses
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.args = json.loads(row['args'])
+        self.review_id = row['review_id']
+        self.stage = row['stage']
+        self.priority = row['priority']
+        self.lease_owner = row['lease_owner']
+        self.attempts = row['attempts']
+
+
+# interface of the queue backends
+class JobQueue:
+    def __init__(self):
+        # wakes up the workers of this process when a job is enqueued, the workers of the
+        # other processes find it at their next poll
+        self.wakeup = threading.Condition()
+
+    def notify(self):
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def wait(self, timeout):
+        with self.wakeup:
+            self.wakeup.wait(timeout)
+
+    # add a job running handler `kind` with the given arguments on the workers of `stage`,
+    # once the jobs in `depends_on` are done. if a job with the same `dedup_key` is pending
+    # or running, no job is added and its id is returned. a job of a review gets the highest
+    # priority of the unfinished jobs of the review. returns the id of the job
+    def enqueue(self, kind, args, stage, depends_on=(), review_id=None, priority=INTERACTIVE, lock=None, dedup_key=None):
+        raise NotImplementedError
+
+    # claim the next runnable job of one of the stages for `owner`, None if there is none
+    def claim(self, stages, owner):
+        raise NotImplementedError
+
+    # give interactive priority to the unfinished jobs of a review, and to the ones they
+    # depend on (e.g. the clone of its repository)
+    def promote(self, review_id):
+        raise NotImplementedError
+
+    # extend the lease of a job held by `owner`. returns False if the lease was lost
+    def heartbeat(self, job_id, owner):
+        raise NotImplementedError
+
+    def complete(self, job_id, owner):
+        raise NotImplementedError
+
+    # mark a job as failed, with the jobs depending on it. returns the failed jobs
+    def fail(self, job_id, owner, error):
+        raise NotImplementedError
+
+    # fail the jobs whose lease expired too many times. returns the failed jobs
+    def reap(self):
+        raise NotImplementedError
+
+    # number of jobs by status and waiting times of each stage
+    def get_stats(self):
+        raise NotImplementedError
+
+    # remove the jobs finished before `finished_before`. returns the number of removed jobs
+    def purge(self, finished_before):
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, lease_time, max_attempts, max_background_jobs):
+        super().__init__()
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.max_background_jobs = max_background_jobs
+
+    def enqueue(self, kind, args, stage, depends_on=(), review_id=None, priority=INTERACTIVE, lock=None, dedup_key=None):
+        depends_on = [job_id for job_id in depends_on if job_id is not None]
+        with db.connection() as conn:
+            # the write lock is taken before the lookup of a duplicate, so that two processes
+            # enqueueing the same job cannot both find none and insert it twice
+            conn.execute('BEGIN IMMEDIATE')
+            if dedup_key is not None:
+                row = conn.execute('SELECT id FROM jobs WHERE dedup_key = ? AND status IN (?, ?)',
+                    (dedup_key, PENDING, RUNNING)).fetchone()
+                if row:
+                    return row[0]
+            if review_id is not None:
+                # e.g. the later stages of a prefetched review opened by a reviewer meanwhile
+                row = conn.execute('SELECT MIN(priority) FROM jobs WHERE review_id = ? AND status IN (?, ?)',
+                    (review_id, PENDING, RUNNING)).fetchone()
+                if row[0] is not None:
+                    priority = min(priority, row[0])
+            cur = conn.execute('INSERT INTO jobs (kind, args, review_id, stage, priority, lock_key, dedup_key, status, attempts, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)',
+                (kind, json.dumps(args), review_id, stage, priority, lock, dedup_key, PENDING, time.time()))
+            job_id = cur.lastrowid
+            conn.executemany('INSERT INTO jobdependencies (job_id, depends_on) VALUES (?, ?)',
+                [(job_id, dependency) for dependency in depends_on])
+            # a job depending on a failed job is never run
+            failed = conn.execute('SELECT error FROM jobs WHERE status = ? AND id IN ({})'.format(','.join('?' * len(depends_on))),
+                [FAILED] + depends_on).fetchone()
+            if failed:
+                self._fail(conn, job_id, 'a dependency failed: {}'.format(failed[0]))
+        self.notify()
+        return job_id
+
+    def claim(self, stages, owner):
+        now = time.time()
+        # the job is selected and leased by a single statement, so two workers cannot claim
+        # the same job, or two jobs with the same lock
+        token = '{}:{}'.format(owner, uuid.uuid4().hex)
+        with db.connection() as conn:
+            cur = conn.execute('''
+                UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1,
+                    started_at = COALESCE(started_at, ?)
+                WHERE id = (
+                    SELECT j.id FROM jobs j
+                    WHERE j.stage IN ({})
+                    AND (j.status = ? OR (j.status = ? AND j.lease_expires < ? AND j.attempts < ?))
+                    AND NOT EXISTS (SELECT 1 FROM jobdependencies d JOIN jobs p ON p.id = d.depends_on
+                                    WHERE d.job_id = j.id AND p.status != ?)
+                    AND (j.lock_key IS NULL OR NOT EXISTS (
+                        SELECT 1 FROM jobs o WHERE o.lock_key = j.lock_key AND o.id != j.id
+                        AND o.status = ? AND o.lease_expires >= ?))
+                    AND (j.priority = ? OR (
+                        SELECT COUNT(*) FROM jobs b WHERE b.stage = j.stage AND b.priority = ?
+                        AND b.status = ? AND b.lease_expires >= ?) < ?)
+                    ORDER BY j.priority, j.id LIMIT 1)'''.format(','.join('?' * len(stages))),
+                [RUNNING, token, now + self.lease_time, now] + list(stages) +
+                [PENDING, RUNNING, now, self.max_attempts, DONE, RUNNING, now] +
+                [INTERACTIVE, BACKGROUND, RUNNING, now, self.max_background_jobs])
+            if cur.rowcount == 0:
+                return None
+            row = conn.execute('SELECT * FROM jobs WHERE lease_owner = ? AND status = ?', (token, RUNNING)).fetchone()
+        return Job(row)
+
+    def promote(self, review_id):
+        with db.connection() as conn:
+            conn.execute('''
+                WITH RECURSIVE review_jobs(id) AS (
+                    SELECT id FROM jobs WHERE review_id = ?
+                    UNION SELECT d.depends_on FROM jobdependencies d JOIN review_jobs r ON d.job_id = r.id)
+                UPDATE jobs SET priority = ? WHERE id IN review_jobs AND status IN (?, ?) AND priority != ?''',
+                (review_id, INTERACTIVE, PENDING, RUNNING, INTERACTIVE))
+        self.notify()
+
+    def heartbeat(self, job_id, owner):
+        with db.connection() as conn:
+            cur = conn.execute('UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = ?',
+                (time.time() + self.lease_time, job_id, owner, RUNNING))
+        return cur.rowcount == 1
+
+    def complete(self, job_id, owner):
+        with db.connection() as conn:
+            conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND lease_owner = ?',
+                (DONE, time.time(), job_id, owner))
+        # jobs depending on this one may be runnable now
+        self.notify()
+
+    def fail(self, job_id, owner, error):
+        with db.connection() as conn:
+            row = conn.execute('SELECT id FROM jobs WHERE id = ? AND lease_owner = ?', (job_id, owner)).fetchone()
+            if not row:
+                # the lease was lost, the job is run again by another worker
+                return []
+            return self._fail(conn, job_id, error)
+
+    def reap(self):
+        now = time.time()
+        failed = []
+        with db.connection() as conn:
+            expired = conn.execute('SELECT id FROM jobs WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+                (RUNNING, now, self.max_attempts)).fetchall()
+            for row in expired:
+                failed += self._fail(conn, row[0], 'lease expired {} times'.format(self.max_attempts))
+        return failed
+
+    def _fail(self, conn, job_id, error):
+        failed = []
+        pending = [(job_id, error)]
+        while pending:
+            job_id, error = pending.pop()
+            conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (FAILED, str(error), time.time(), job_id))
+            failed.append(Job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id, )).fetchone()))
+            for row in conn.execute('SELECT j.id FROM jobdependencies d JOIN jobs j ON j.id = d.job_id WHERE d.depends_on = ? AND j.status = ?',
+                    (job_id, PENDING)).fetchall():
+                pending.append((row[0], 'a dependency failed: {}'.format(error)))
+        return failed
+
+    def get_stats(self):
+        stats = {}
+        since = time.time() - 3600
+        with db.connection() as conn:
+            for stage, status, priority, count in conn.execute(
+                    'SELECT stage, status, priority, COUNT(*) FROM jobs GROUP BY stage, status, priority'):
+                stage_stats = stats.setdefault(stage, {})
+                stage_stats[status] = stage_stats.get(status, 0) + count
+                if status == PENDING:
+                    key = 'pending_interactive' if priority == INTERACTIVE else 'pending_background'
+                    stage_stats[key] = stage_stats.get(key, 0) + count
+            # waiting times of the jobs started in the last hour
+            for stage, average_wait, max_wait in conn.execute(
+                    'SELECT stage, AVG(started_at - created_at), MAX(started_at - created_at) FROM jobs WHERE started_at >= ? GROUP BY stage',
+                    (since, )):
+                stats.setdefault(stage, {}).update(average_wait=average_wait, max_wait=max_wait)
+        return stats
+
+    def purge(self, finished_before):
+        with db.connection() as conn:
+            # a job still depended on by an unfinished job is kept, its status tells whether that
+            # job can run
+            cur = conn.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? AND NOT EXISTS ('
+                'SELECT 1 FROM jobdependencies d JOIN jobs o ON o.id = d.job_id WHERE d.depends_on = jobs.id AND o.status IN (?, ?))',
+                (DONE, FAILED, finished_before, PENDING, RUNNING))
+            conn.execute('DELETE FROM jobdependencies WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE id = jobdependencies.job_id)')
+        return cur.rowcount
+
+
+BACKENDS = {
+    'sqlite': SQLiteJobQueue,
+}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# get the job queue of the configured backend, one for the whole process
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            logger.info('Using {} job queue'.format(config.JOB_QUEUE_BACKEND))
+            _queue = BACKENDS[config.JOB_QUEUE_BACKEND](config.JOB_LEASE_TIME, config.JOB_MAX_ATTEMPTS,
+                                                         config.JOB_MAX_BACKGROUND_JOBS)
+        return _queue
@@ -1,24 +1,72 @@
-import sqlite3
 import re
 import requests
 import os
 import subprocess
-from time import sleep
-from flask import Flask, request, abort, redirect, url_for, g, jsonify
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice
+from flask import Flask, Response, request, abort, redirect, url_for, g, jsonify
 from flask_cors import CORS
+import callgraph
+import config
+import db
+import diffutils
+import events
+import extractioncache
+import filecache
+import extractor
+import github
+import gitstore
+import interning
+import javasource
+import jobqueue
+import repositories
+import tracing
+import worker
 
 DIFFS_DIR = 'diffs'
 CLONED_REPOS_DIR = 'cloned_repos'
-DATABASE = 'mydb.db'
 PR_URL_REGEX = r'^https?:\/\/(?:www\.)?github\.com\/(.*?)\/(.*?)\/pull\/(\w*?)$'
-DIFF_FILES_REGEX = r'^diff --git a\/(.*?\.java) b\/(.*?\.java)(?:\r\n|\r|\n)(?!deleted)'
+DIFF_CHUNK_SIZE = 64 * 1024
+# seconds between keepalive comments on the event streams
+EVENTS_KEEPALIVE_INTERVAL = 15
+# seconds between the checks of the progress stored in the db by the event streams, when no
+# event is published by this process
+EVENTS_POLL_INTERVAL = 1
+# columns of the method calls that can be requested, and the ones holding strings
+METHODCALL_FIELDS = (
+    'id', 'review_id', 'from_file', 'call_start_line', 'call_start_column', 'call_end_line', 'call_end_column',
+    'method_call', 'short_method_qualifier', 'full_method_qualifier', 'to_file', 'declaration_start_line',
+    'declaration_start_column', 'declaration_end_line', 'declaration_end_column',
+)
+METHODCALL_STRING_FIELDS = {'from_file', 'method_call', 'short_method_qualifier', 'full_method_qualifier', 'to_file'}
+# filters of the method calls by line range: parameter -> condition
+METHODCALL_LINE_FILTERS = {
+    'min_line': '`call_end_line` >= ?',
+    'max_line': '`call_start_line` <= ?',
+    'min_declaration_line': '`declaration_end_line` >= ?',
+    'max_declaration_line': '`declaration_start_line` <= ?',
+}
+# method calls serialized in a single chunk of a streamed response
+METHODCALLS_CHUNK_ROWS = 500
 
 # compile regex to improve performance
 pr_url_regex = re.compile(PR_URL_REGEX)
-diff_files_regex = re.compile(DIFF_FILES_REGEX, re.M)
 
-executor = ThreadPoolExecutor(4)
+job_queue = jobqueue.get_queue()
+review_events = events.ReviewEvents()
+file_cache = filecache.FileCache(config.FILE_CACHE_DIR, config.FILE_CACHE_MAX_BYTES)
+extraction_cache = extractioncache.ExtractionCache(config.EXTRACTION_CACHE_MAX_ROWS)
+# computes the files requested together to the batch endpoint
+file_batch_executor = ThreadPoolExecutor(config.FILE_BATCH_WORKERS)
 app = Flask(__name__)
 CORS(app)
 
@@ -35,13 +83,11 @@ def debug():
         'methodcalls': '3-methodcalls'
     }
     output = {}
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    for table in tables:
-        rows = cur.execute('SELECT * FROM {}'.format(table)).fetchall()
-        output[mapping[table]] = [dict(ix) for ix in rows]
-    conn.close()
+    with db.connection() as conn:
+        cur = conn.cursor()
+        for table in tables:
+            rows = cur.execute('SELECT * FROM {}'.format(table)).fetchall()
+            output[mapping[table]] = [dict(ix) for ix in rows]
 
     return jsonify(status='ok', data=output)
 
@@ -61,246 +107,1160 @@ def start_review():
     user, repo, pull_id = matches.group(1), matches.group(2), matches.group(3)
 
     # check if this review was already started
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    res = cur.execute('SELECT * FROM reviews WHERE pr_url = ?', (pr_url, ))
-    row = res.fetchone()
-
-    # if there is already a record for the current pull request
-    if row:
+    with db.connection() as conn:
+        row = conn.execute('SELECT * FROM reviews WHERE pr_url = ?', (pr_url, )).fetchone()
+
+    # if there is already a record for the current pull request. failed reviews are processed
+    # again if a retry is requested, ready ones are updated if a refresh is requested
+    retry = row and row['status'] == 'error' and request.args.get('retry')
+    refresh = row and row['status'] == 'ready' and request.args.get('refresh')
+    # the data of evicted reviews was removed by the garbage collection, they are processed again
+    evicted = row and row['status'] == 'evicted'
+    if row and not (retry or refresh or evicted):
         review_id = row['id']
         app.logger.info('Review already exists with id {}'.format(row['id']))
+        with db.connection() as conn:
+            conn.execute('UPDATE reviews SET last_accessed = ? WHERE id = ?', (time.time(), review_id))
+        if row['status'] == 'processing':
+            # a reviewer is waiting for it now, e.g. it was being prefetched
+            job_queue.promote(review_id)
         # return its info
         return jsonify(status='ok', data={'review_status': row['status'], 'id': review_id})
 
     # otherwise, we get first the pr info from the github api.
-    api_pull_url = 'https://api.github.com/repos/{}/{}/pulls/{}'.format(user, repo, pull_id)
-    app.logger.info('Getting info from Github API, URL: {}'.format(api_pull_url))
-    resp = requests.get(api_pull_url, auth=('joined', '14570db4b1e5b63c6d2e6678c4721533c3f2bfd8'))
-    if resp.status_code != 200:
-        app.logger.error('Problem with Github API')
+    app.logger.info('Getting info from Github API for pull request {}/{}#{}'.format(user, repo, pull_id))
+    try:
+        with tracing.span('github_pull_request'):
+            pr_json_info = github.get_client().get_pull_request(user, repo, pull_id)
+    except (github.GitHubError, requests.RequestException) as e:
+        app.logger.error('Problem with Github API: {}'.format(e))
         return jsonify(status='error', error='Error getting pull request info from Github')
-    pr_json_info = resp.json()
     base_commit_sha = pr_json_info['base']['sha']
     head_commit_sha = pr_json_info['head']['sha']
     app.logger.info('Got info from Github API. Base commit: {}, head commit: {}'.format(base_commit_sha, head_commit_sha))
 
-    # check if the repository has already been cloned
-    res = cur.execute('SELECT * FROM repositories WHERE user = ? AND repo = ?', (user, repo))
-    row = res.fetchone()
-    if row:
-        # if the repository has already been cloned
-        app.logger.info('Repository already exists')
-        repository_id = row['id']
-    else:
-        # if it has not been cloned, clone it
-        app.logger.info('Cloning the repository')
-        cur.execute('INSERT INTO repositories VALUES (null, ?, ?, ?)', (user, repo, 'cloning'))
-        conn.commit()
-        executor.submit(clone_repository, user, repo)
-        repository_id = cur.lastrowid
-
-    app.logger.info('Creating review in database')
-    cur.execute('INSERT INTO reviews VALUES (null, ?, ?, ?, ?, ?)',
-        ('processing', repository_id, pr_url, base_commit_sha, head_commit_sha)
-    )
-    review_id = cur.lastrowid
+    if refresh and row['head_commit_sha'] == head_commit_sha and row['base_commit_sha'] == base_commit_sha:
+        app.logger.info('Review {} is up to date'.format(row['id']))
+        return jsonify(status='ok', data={'review_status': row['status'], 'id': row['id']})
 
-    conn.commit()
-    conn.close()
+    review_id, repository_id, repository_status, refresh_only = create_review(
+        pr_url, user, repo, base_commit_sha, head_commit_sha, row, refresh)
 
-    executor.submit(update_diff, cur.lastrowid)
+    # the jobs are submitted once the records are committed
+    schedule_review(review_id, repository_id, user, repo, repository_status, refresh_only)
 
     return jsonify(status='ok', data={'review_status': 'processing', 'id': review_id})
 
-# update the diff corresponding to the pull request. either for the first time or the following ones
+# store a review to be processed, and its repository if it is new. `previous_review` is the
+# row of the review of the same pull request if any, processed again from scratch or only
+# updated to the new head if `refresh` is set. returns a tuple (review id, repository id,
+# repository status, True if only the head of the review changed)
+def create_review(pr_url, user, repo, base_commit_sha, head_commit_sha, previous_review=None, refresh=False):
+    with db.connection() as conn:
+        cur = conn.cursor()
+        # add the repository if it is not there yet. the check and the insert are a single
+        # statement, so concurrent reviews of a new repository do not clone it twice
+        cur.execute('INSERT INTO repositories SELECT null, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM repositories WHERE user = ? AND repo = ?)',
+            (user, repo, 'cloning', user, repo))
+        if cur.rowcount == 1:
+            # if it has not been cloned, clone it
+            app.logger.info('Cloning the repository')
+            repository_id, repository_status = cur.lastrowid, 'cloning'
+        else:
+            # if the repository has already been cloned
+            app.logger.info('Repository already exists')
+            row = cur.execute('SELECT * FROM repositories WHERE user = ? AND repo = ?', (user, repo)).fetchone()
+            repository_id, repository_status = row['id'], row['status']
+
+        if refresh and previous_review['base_commit_sha'] == base_commit_sha:
+            # only the head of the pull request moved, the method calls of the files not affected
+            # by the new commits are kept
+            review_id = previous_review['id']
+            app.logger.info('Updating review {} to head commit {}'.format(review_id, head_commit_sha))
+            cur.execute('UPDATE reviews SET status = ?, head_commit_sha = ?, last_accessed = ? WHERE id = ?',
+                ('processing', head_commit_sha, time.time(), review_id))
+            refresh_only = True
+        elif previous_review:
+            review_id = previous_review['id']
+            app.logger.info('Processing again review {}'.format(review_id))
+            cur.execute('UPDATE reviews SET status = ?, repo_id = ?, base_commit_sha = ?, head_commit_sha = ?, last_accessed = ? WHERE id = ?',
+                ('processing', repository_id, base_commit_sha, head_commit_sha, time.time(), review_id))
+            cur.execute('DELETE FROM modifiedfiles WHERE review_id = ?', (review_id, ))
+            cur.execute('DELETE FROM methodcallrows WHERE review_id = ?', (review_id, ))
+            callgraph.delete(conn, review_id)
+            refresh_only = False
+        else:
+            app.logger.info('Creating review in database')
+            cur.execute('INSERT INTO reviews (status, repo_id, pr_url, base_commit_sha, head_commit_sha, last_accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                ('processing', repository_id, pr_url, base_commit_sha, head_commit_sha, time.time())
+            )
+            review_id = cur.lastrowid
+            refresh_only = False
+    return review_id, repository_id, repository_status, refresh_only
+
+# pull requests to prefetch, from a list of pull request urls or from a repository
+# ("user/repo") whose open pull requests are all prefetched. returns a tuple (list of
+# (user, repo, number), their (base, head) commits if known). raises ValueError if an url
+# or the repository is not valid
+def prefetch_targets(pr_urls=None, repository=None):
+    pulls, commits = [], {}
+    for pr_url in pr_urls or []:
+        matches = pr_url_regex.match(pr_url) if isinstance(pr_url, str) else None
+        if not matches:
+            raise ValueError('Invalid pull request URL: {}'.format(pr_url))
+        pulls.append(matches.groups())
+    if repository:
+        user, _, repo = repository.partition('/')
+        if not user or not repo:
+            raise ValueError('Invalid repository: {}'.format(repository))
+        for pull_request in github.get_client().get_open_pull_requests(user, repo):
+            pull = (user, repo, str(pull_request['number']))
+            pulls.append(pull)
+            commits[pull] = (pull_request['base']['sha'], pull_request['head']['sha'])
+    return pulls, commits
+
+# start the reviews of pull requests not reviewed yet at background priority, so that they
+# are ready when the reviewers open them. `pulls` is a list of tuples (user, repo, number),
+# `commits` maps them to their (base, head) commits when they are already known. returns the
+# review of each pull request by url
+def prefetch_reviews(pulls, commits=None):
+    pr_urls = {pull: 'https://github.com/{}/{}/pull/{}'.format(*pull) for pull in pulls}
+    result, new_pulls, previous = {}, [], {}
+    with db.connection() as conn:
+        for pull, pr_url in pr_urls.items():
+            row = conn.execute('SELECT * FROM reviews WHERE pr_url = ?', (pr_url, )).fetchone()
+            if row and row['status'] != 'evicted':
+                result[pr_url] = {'id': row['id'], 'review_status': row['status']}
+            else:
+                new_pulls.append(pull)
+                previous[pull] = row
+    commits = dict(commits or {})
+    # the commits of the pull requests are looked up with a single query for each batch of them
+    unknown = [pull for pull in new_pulls if pull not in commits]
+    if unknown:
+        with tracing.span('github_pull_request_commits'):
+            commits.update(github.get_client().get_pull_request_commits(unknown))
+    app.logger.info('Prefetching {} reviews'.format(len(new_pulls)))
+    for pull in new_pulls:
+        user, repo, _ = pull
+        if commits.get(pull) is None:
+            result[pr_urls[pull]] = {'error': 'pull_request_not_found'}
+            continue
+        review_id, repository_id, repository_status, _ = create_review(pr_urls[pull], user, repo, *commits[pull],
+                                                                       previous_review=previous[pull])
+        schedule_review(review_id, repository_id, user, repo, repository_status, priority=jobqueue.BACKGROUND)
+        result[pr_urls[pull]] = {'id': review_id, 'review_status': 'processing'}
+    return result
+
+# schedule the background stages of a review as jobs. each stage starts as soon as the ones
+# it depends on are completed, and a failure marks the review as failed:
+#   clone -> fetch ----------\
+#   diff download -------------> file precomputation -> method call extraction -> ready
+# the diff stage (update_diff or refresh_diff) finds the files to extract the method calls
+# of and the files whose method calls are outdated. the stages modifying the repository
+# folder hold its lock, so they never run at the same time for the same repository
+def schedule_review(review_id, repository_id, user, repo, repository_status, refresh=False, priority=jobqueue.INTERACTIVE):
+    clone = repository_job(repository_id, user, repo, repository_status, priority)
+    if clone is not None:
+        review_events.publish(review_id, 'cloning')
+    fetch = enqueue_job(fetch_repository, review_id, depends_on=[clone], review_id=review_id,
+                        stage='network', priority=priority, lock=repository_folder(user, repo))
+    # the refresh compares the files of the new diff with the ones in the repository
+    enqueue_job(process_diff, review_id, refresh, fetch, priority, depends_on=[fetch] if refresh else [],
+                review_id=review_id, stage='network', priority=priority)
+
+# add a job running fn(*args) to the job queue. returns its id
+def enqueue_job(fn, *args, **options):
+    return job_queue.enqueue(fn.__name__, list(args), **options)
+
+# get the id of the job cloning a repository, adding it if needed. reviews of a repository
+# being cloned all wait for the same clone. None if the repository is already cloned
+def repository_job(repository_id, user, repo, repository_status, priority=jobqueue.INTERACTIVE):
+    if repository_status == 'cloned':
+        return None
+    return enqueue_job(clone_repository, repository_id, user, repo, stage='network', priority=priority,
+                       lock=repository_folder(user, repo), dedup_key='clone:{}'.format(repository_id))
+
+# download the diff of a review and schedule the extraction of the method calls of the files
+# it modifies, once the repository is fetched
+def process_diff(review_id, refresh, fetch_job, priority):
+    target_files, stale_files = (refresh_diff if refresh else update_diff)(review_id)
+    if not target_files and not stale_files:
+        # no modified Java files, nothing to extract
+        finish_review(review_id, 'ready')
+        return
+    repo_folder = review_repository(review_id)[0]
+    precomputation = enqueue_job(precompute_review_files, review_id, depends_on=[fetch_job], review_id=review_id,
+                                 stage='git', priority=priority)
+    enqueue_job(extract_methodcalls, review_id, target_files, stale_files, depends_on=[precomputation], review_id=review_id,
+                stage='jvm', priority=priority, lock=repo_folder)
+
+# last stage of a review
+def extract_methodcalls(review_id, target_files, stale_files):
+    compute_methodcalls(review_id, target_files, stale_files)
+    finish_review(review_id, 'ready')
+
+# mark the review as ready or failed
+def finish_review(review_id, status):
+    app.logger.info('Marking review {} as {}'.format(review_id, status))
+    with db.connection() as conn:
+        conn.execute('UPDATE reviews SET status = ? WHERE id = ?', (status, review_id))
+    review_events.publish(review_id, status)
+
+# a job failed, mark its review as failed
+def job_failed(job, error):
+    if job.review_id is None:
+        return
+    with db.connection() as conn:
+        status = conn.execute('SELECT status FROM reviews WHERE id = ?', (job.review_id, )).fetchone()
+    if status and status[0] == 'processing':
+        app.logger.error('Processing of review {} failed: {}'.format(job.review_id, error))
+        finish_review(job.review_id, 'error')
+
+# download the diff corresponding to the pull request and write it to the diffs folder.
+# returns its text
+def download_diff(review_id):
+    # get pr url so that we can retrieve the diff from github
+    with db.connection() as conn:
+        row = conn.execute('SELECT * FROM reviews WHERE id = ?', (review_id, )).fetchone()
+    user, repo, pull_id = pr_url_regex.match(row['pr_url']).groups()
+    review_events.publish(review_id, 'downloading_diff')
+    app.logger.info('Getting diff for PR {}'.format(row['pr_url']))
+    with tracing.span('diff_download', review_id):
+        resp = github.get_client().get_diff(user, repo, pull_id)
+
+        # the diff is compressed to disk and its file headers parsed as it is downloaded, so large
+        # diffs are never held in memory. it replaces the previous diff only once complete
+        app.logger.info('Streaming diff to file')
+        diff_path = compressed_diff_path(review_id)
+        with resp, open(diff_path + '.part', 'wb') as diff_file:
+            patches = diffutils.write_compressed_diff(diffutils.iter_lines(resp.iter_content(DIFF_CHUNK_SIZE)),
+                                                      diff_file, config.DIFF_COMPRESSION_LEVEL)
+        os.replace(diff_path + '.part', diff_path)
+        remove_file(legacy_diff_path(review_id))
+    return patches
+
+# path of the diff of a review. diffs are stored compressed, the ones stored before are read
+# as they are until they are downloaded again
+def review_diff_path(review_id):
+    if not os.path.exists(compressed_diff_path(review_id)) and os.path.exists(legacy_diff_path(review_id)):
+        return legacy_diff_path(review_id)
+    return compressed_diff_path(review_id)
+
+def compressed_diff_path(review_id):
+    return '{}/{}.diff.gz'.format(DIFFS_DIR, review_id)
+
+def legacy_diff_path(review_id):
+    return '{}/{}.diff'.format(DIFFS_DIR, review_id)
+
+# remove a file if it exists
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# the patches of a diff that modify Java files whose method calls can be extracted
+def java_patches(patches):
+    return [patch for patch in patches
+            if patch.new_path.endswith('.java') and not patch.deleted_file and not patch.binary]
+
+# store the modified Java files of a review, with the position of their patch in the diff
+def insert_modifiedfiles(conn, review_id, patches):
+    conn.executemany('INSERT INTO modifiedfiles (review_id, old_filename, new_filename, diff_offset, diff_length) VALUES (?, ?, ?, ?, ?)',
+        [(review_id, patch.old_path, patch.new_path, patch.offset, patch.length) for patch in patches]
+    )
+
+# update the diff corresponding to the pull request for the first time. all the modified
+# Java files are to be extracted
 def update_diff(review_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    # get pr url so that we can retrieve the url from the github api
-    res = cur.execute('SELECT * FROM reviews WHERE id = ?', (review_id, ))
-    row = res.fetchone()
-    diff_url = row['pr_url'] + '.diff'
-    app.logger.info('Getting diff for PR from URL {}'.format(diff_url))
-    resp = requests.get(diff_url)
-    diff = resp.text
-
-    app.logger.info('Writing diff to file')
-    with open("{}/{}.diff".format(DIFFS_DIR, review_id), "w") as diff_file:
-        diff_file.write(diff)
-
-    matches = diff_files_regex.findall(diff)
-    app.logger.info('Found {} modified Java files, storing them in the db'.format(len(matches)))
-    for old_filename, new_filename in matches:
-        cur.execute('INSERT INTO modifiedfiles VALUES (null, ?, ?, ?)',
-            (review_id, old_filename, new_filename)
-        )
+    patches = java_patches(download_diff(review_id))
+    app.logger.info('Found {} modified Java files, storing them in the db'.format(len(patches)))
+    with db.connection() as conn:
+        insert_modifiedfiles(conn, review_id, patches)
+    review_events.publish(review_id, 'diff_downloaded', files=len(patches))
+    return [patch.new_path for patch in patches], []
 
-    if not matches:
-        cur.execute('UPDATE reviews SET status = "ready" WHERE id = ?', (review_id, ))
-        conn.commit()
-        conn.close()
-    else:
-        conn.commit()
-        conn.close()
-        executor.submit(compute_methodcalls, review_id)
+# update the diff of a review whose pull request got new commits on the same base commit.
+# the patches of the old and the new diff are compared file by file: the method calls are
+# extracted again only for the files whose patch changed, and for the unchanged files that
+# are called by the changed ones (before or after the change)
+def refresh_diff(review_id):
+    repo_folder, base_commit_sha = review_repository(review_id)
+    with db.connection() as conn:
+        old_files = {row['new_filename']: row for row in conn.execute(
+            'SELECT new_filename, contents_hash, diff_offset, diff_length FROM modifiedfiles WHERE review_id = ?', (review_id, ))}
 
-# method call extraction
-def compute_methodcalls(review_id):
-    app.logger.info('Computing method calls')
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    res = cur.execute('SELECT pr_url, base_commit_sha, repo_id FROM reviews WHERE id = ?', (review_id, ))
-    row = res.fetchone()
+    # contents of a modified file after applying its patch, from the file cache when possible
+    def patched_contents(diff_file, offset, length, contents_hash=None):
+        contents = file_cache.get(contents_hash) if contents_hash else None
+        if contents is None and offset is not None:
+            try:
+                patch = diffutils.read_patch(diff_file, offset, length)
+                if not patch.deleted_file:
+                    contents = apply_review_patch(repo_folder, base_commit_sha, patch)[0]
+            except diffutils.PatchError as e:
+                app.logger.warning('Cannot compute patched file at offset {}: {}'.format(offset, e))
+        return contents or ''
+
+    def patch_bytes(diff_file, offset, length):
+        if offset is None:
+            return None
+        return diffutils.read_patch_bytes(diff_file, offset, length)
+
+    # the old diff can still be read from this file object once the new one replaces it
+    with open(review_diff_path(review_id), 'rb') as old_diff:
+        new_patches = {patch.new_path: patch for patch in java_patches(download_diff(review_id))}
+        with open(review_diff_path(review_id), 'rb') as new_diff:
+            changed = set()
+            for file_path in set(old_files) | set(new_patches):
+                old, new = old_files.get(file_path), new_patches.get(file_path)
+                if old is None or new is None or \
+                        patch_bytes(old_diff, old['diff_offset'], old['diff_length']) != patch_bytes(new_diff, new.offset, new.length):
+                    changed.add(file_path)
+            unchanged = [file_path for file_path in new_patches if file_path not in changed]
+
+            with db.connection() as conn:
+                conn.execute('DELETE FROM modifiedfiles WHERE review_id = ? AND new_filename NOT IN ({})'.format(','.join('?' * len(unchanged))),
+                    [review_id] + unchanged)
+                # the patches of the unchanged files may have moved in the diff
+                conn.executemany('UPDATE modifiedfiles SET diff_offset = ?, diff_length = ? WHERE review_id = ? AND new_filename = ?',
+                    [(new_patches[file_path].offset, new_patches[file_path].length, review_id, file_path) for file_path in unchanged])
+                insert_modifiedfiles(conn, review_id, [patch for file_path, patch in new_patches.items() if file_path in changed])
+
+            # the calls into an unchanged file can only have changed if a changed file calls its methods
+            callers = [patched_contents(old_diff, old_files[file_path]['diff_offset'], old_files[file_path]['diff_length'],
+                                        old_files[file_path]['contents_hash'])
+                       for file_path in changed if file_path in old_files]
+            callers += [patched_contents(new_diff, new_patches[file_path].offset, new_patches[file_path].length)
+                        for file_path in changed if file_path in new_patches]
+            affected = javasource.affected_files(
+                {file_path: patched_contents(new_diff, new_patches[file_path].offset, new_patches[file_path].length,
+                                             old_files[file_path]['contents_hash']) for file_path in unchanged},
+                callers)
+    target_files = [file_path for file_path in new_patches if file_path in changed] + affected
+    app.logger.info('Diff updated: {} changed and {} affected Java files out of {}'.format(len(changed), len(affected), len(new_patches)))
+    review_events.publish(review_id, 'diff_downloaded', files=len(target_files))
+    return target_files, sorted(changed) + affected
+
+# get the local folder of the repository of a review and the base commit of the review,
+# (None, None) if the review does not exist
+def review_repository(review_id):
+    with db.connection() as conn:
+        row = conn.execute('SELECT pr_url, base_commit_sha FROM reviews WHERE id = ?', (review_id, )).fetchone()
+    if not row:
+        return None, None
     matches = pr_url_regex.match(row[0])
-    user, repo = matches.group(1), matches.group(2)
-    base_commit_sha, repo_id = row[1], row[2]
-    # check that the repo was cloned.
-    # to compute the method calls we need to be sure the repo is fully cloned.
+    return repository_folder(matches.group(1), matches.group(2)), row[1]
+
+# local folder of the clone of a repository
+def repository_folder(user, repo):
+    return os.path.abspath('{}/{}_{}'.format(CLONED_REPOS_DIR, user, repo))
+
+# make sure the base commit of the review is available in the repository, fetching it only
+# if it is missing. the head commit is not needed, the diff is applied to the base commit
+def fetch_repository(review_id):
+    repo_folder, base_commit_sha = review_repository(review_id)
+    review_events.publish(review_id, 'fetching')
+    with tracing.span('fetch', review_id):
+        transfer = repositories.fetch_commits(repo_folder, [base_commit_sha])
+    if transfer:
+        app.logger.info('Fetched {} bytes in {:.1f}s'.format(*transfer))
+        with db.connection() as conn:
+            repository_id = conn.execute('SELECT repo_id FROM reviews WHERE id = ?', (review_id, )).fetchone()[0]
+            record_transfer(conn, repository_id, review_id, 'fetch', transfer)
+
+# method call extraction. the method calls into `mod_files` are extracted, the ones into
+# `stale_files` computed before are replaced. the files found in the extraction cache are
+# not extracted again. the method calls the review already has into all of them are replaced,
+# so a job retried after a crash does not store them twice
+def compute_methodcalls(review_id, mod_files, stale_files=()):
+    app.logger.info('Computing method calls')
+    repo_folder, base_commit_sha = review_repository(review_id)
+    with tracing.span('extraction_cache_lookup', review_id), db.connection() as conn:
+        repository_id = conn.execute('SELECT repo_id FROM reviews WHERE id = ?', (review_id, )).fetchone()[0]
+        keys = extraction_cache.keys(repository_id, base_commit_sha, review_java_files(review_id, repo_folder, base_commit_sha), mod_files)
+        cached = extraction_cache.lookup(conn, keys, mod_files)
+    replaced_files = set(mod_files) | set(stale_files)
+    mod_files = [file_path for file_path in mod_files if file_path not in cached]
+    app.logger.info('Found {} files in the extraction cache, {} to extract'.format(len(cached), len(mod_files)))
+
+    # the method calls of the review are replaced in a single transaction, with its call graph
+    def replace_methodcalls(conn):
+        delete_methodcalls(conn, review_id, replaced_files)
+        extraction_cache.copy(conn, review_id, cached.values())
+
+    if not mod_files:
+        with tracing.span('store', review_id), db.connection() as conn:
+            replace_methodcalls(conn)
+            with tracing.span('call_graph'):
+                callgraph.build(conn, review_id)
+        return
+    try:
+        # checkout the repo at the version corresponding to the base commit of the PR
+        app.logger.info('Checking out the repository at commit {}'.format(base_commit_sha))
+        with tracing.span('checkout', review_id):
+            s = subprocess.run(['git', 'checkout', base_commit_sha], cwd=repo_folder)
+        if s.returncode != 0:
+            raise RuntimeError('Cannot check out commit {}'.format(base_commit_sha))
+        app.logger.info('Applying diff')
+        # the state of the working tree is identified by the base commit and the applied diff
+        diff_hash = hashlib.sha1()
+        with tracing.span('patch', review_id), tempfile.NamedTemporaryFile(dir=DIFFS_DIR, suffix='.diff') as patch_file:
+            # patch reads the diff decompressed
+            with diffutils.open_diff(review_diff_path(review_id)) as diff_file:
+                for chunk in iter(lambda: diff_file.read(DIFF_CHUNK_SIZE), b''):
+                    diff_hash.update(chunk)
+                    patch_file.write(chunk)
+            patch_file.flush()
+            s = subprocess.run(['patch', '-p1', '-i', os.path.abspath(patch_file.name)], cwd=repo_folder, stdout=subprocess.PIPE)
+        app.logger.info(s)
+        app.logger.info('Extracting method calls from {} modified files'.format(len(mod_files)))
+        review_events.publish(review_id, 'extracting', calls=0)
+        state = '{}:{}'.format(base_commit_sha, diff_hash.hexdigest())
+        rows = extractor.get_pool().extract(base_commit_sha, state, repo_folder, mod_files)
+        # the extractor streams its rows while they are stored, so this covers both
+        with tracing.span('extraction', review_id), db.connection() as conn:
+            stored, rejected = ingest_methodcalls(conn, review_id, rows,
+                progress=lambda calls: review_events.publish(review_id, 'extracting', calls=calls),
+                before_copy=replace_methodcalls)
+            extraction_cache.store(conn, review_id, repository_id, base_commit_sha,
+                {file_path: keys[file_path] for file_path in mod_files if file_path in keys})
+            # not timed per review, that would write to the db while this transaction holds the lock
+            with tracing.span('call_graph'):
+                callgraph.build(conn, review_id)
+        app.logger.info('Stored {} method calls, rejected {} malformed lines'.format(stored, rejected))
+    finally:
+        app.logger.info('Restoring working tree')
+        with tracing.span('restore', review_id):
+            s = subprocess.run(['git', 'checkout', '--', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
+            s = subprocess.run(['git', 'clean', '-qfdx'], cwd=repo_folder, stdout=subprocess.PIPE)
+
+# delete the method calls into some files of a review
+def delete_methodcalls(conn, review_id, files):
+    conn.executemany('DELETE FROM methodcallrows WHERE review_id = ? AND to_file_id = (SELECT id FROM strings WHERE value = ?)',
+        [(review_id, file_path) for file_path in files])
+
+# store the rows produced by the extractor in the methodcalls table. the rows are consumed
+# in chunks, so memory does not grow with the number of method calls. malformed rows are
+# skipped. returns the number of stored and rejected rows. `progress` is called with the
+# number of rows stored so far after each chunk.
+# while the extractor is running the rows are staged in a temporary table, so that the write
+# lock on the database is only held for the final copy and other writers are not blocked.
+# `before_copy` is called with the connection in the transaction of the copy, once the write
+# lock is held. the strings of the rows are interned during the copy
+def ingest_methodcalls(conn, review_id, rows, progress=None, before_copy=None):
+    stored, rejected = 0, 0
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS pending_methodcalls AS SELECT * FROM methodcalls WHERE 0')
+    conn.execute('DELETE FROM temp.pending_methodcalls')
+
+    def records():
+        nonlocal rejected
+        for row in rows:
+            if not row:
+                continue
+            try:
+                yield (review_id, ) + extractor.parse_row(row)
+            except ValueError as e:
+                rejected += 1
+                if rejected <= 10:
+                    app.logger.warning('Rejecting malformed extractor output {!r}: {}'.format(row, e))
+
+    pending = records()
     while True:
-        res = cur.execute('SELECT status FROM repositories WHERE id = ?', (repo_id, ))
-        row = res.fetchone()
-        repo_status = row[0]
-        if repo_status == 'cloned':
+        batch = list(islice(pending, config.INGEST_BATCH_SIZE))
+        if not batch:
             break
-        app.logger.info('Waiting for the git clone to finish...')
-        sleep(1)
-    repo_folder = os.path.abspath('{}/{}_{}'.format(CLONED_REPOS_DIR, user, repo))
-    # pull to have the latest version of the repo
-    app.logger.info('Pulling latest version of repo')
-    s = subprocess.run(['git', 'fetch', '--all'], cwd=repo_folder)
-    app.logger.info(s)
-    # checkout the repo at the version corresponding to the base commit of the PR
-    app.logger.info('Checking out the repository at commit {}'.format(base_commit_sha))
-    s = subprocess.run(['git', 'checkout', base_commit_sha], cwd=repo_folder)
-    app.logger.info('Applying diff')
-    s = subprocess.run(['patch', '-p1', '-i', '../../{}/{}.diff'.format(DIFFS_DIR, review_id)], cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info(s)
-    res = cur.execute('SELECT new_filename FROM modifiedfiles WHERE review_id = ?', (review_id, ))
-    mod_files = [row[0] for row in res]
-    app.logger.info('Extracting method calls from {} modified files'.format(len(mod_files)))
-    command = ['java', '-Xmx1024m', '-jar', 'mcextractor.jar', repo_folder]
-    command.extend(mod_files)
-    app.logger.info('Issuing command {}'.format(command))
-    s = subprocess.run(command, stdout=subprocess.PIPE)
-    methodcalls = [mc for mc in s.stdout.splitlines() if len(mc)]
-    app.logger.info('Extracted {} method calls, storing them in the db'.format(len(methodcalls)))
-    for mc in methodcalls:
-        app.logger.info('Storing method call {}'.format(mc))
-        o_file, o_s_l, o_s_c, o_e_l, o_e_c, method_call, short_qual, long_qual, d_file, d_s_l, d_s_c, d_e_l, d_e_c = mc.decode('utf-8').split(';')
-        method_call = method_call.replace('&%&', ';')
-        cur.execute('INSERT INTO methodcalls VALUES (null, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-            (review_id, o_file, o_s_l, o_s_c, o_e_l, o_e_c, method_call, short_qual, long_qual, d_file, d_s_l, d_s_c, d_e_l, d_e_c))
-    app.logger.info('Restoring working tree')
-    s = subprocess.run(['git', 'checkout', '--', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
-    s = subprocess.run(['git', 'clean', '-qfdx'], cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Marking the review as ready')
-    cur.execute('UPDATE reviews SET status = "ready" WHERE id = ?', (review_id, ))
+        conn.executemany('INSERT INTO temp.pending_methodcalls VALUES (null, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+        stored += len(batch)
+        if progress:
+            progress(stored)
+    # the write lock is taken at the start of the transaction of the copy, waiting for the other
+    # writers. upgrading the staging transaction instead would fail right away if another
+    # connection wrote since it started
     conn.commit()
-    conn.close()
+    conn.execute('BEGIN IMMEDIATE')
+    if before_copy:
+        before_copy(conn)
+    interning.intern(conn, 'temp.pending_methodcalls')
+    conn.execute('INSERT INTO methodcallrows (review_id, {}) SELECT p.review_id, {} FROM temp.pending_methodcalls p'.format(
+        ', '.join(interning.INTERNED_COLUMNS), interning.interned_values('p')))
+    conn.execute('DELETE FROM temp.pending_methodcalls')
+    return stored, rejected
 
 # clone a repository from github and update its status in the db
-def clone_repository(user, repo):
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    repository_url = 'https://github.com/{}/{}'.format(user, repo)
-    cur.execute('SELECT id FROM repositories WHERE user = ? AND repo = ?', (user, repo))
-    repository_id = cur.fetchone()[0]
-    app.logger.info('Issuing git clone {}'.format(repository_url))
-    subprocess.run(['git', 'clone', '-q', repository_url, '{}_{}'.format(user, repo)], cwd=CLONED_REPOS_DIR, stderr=subprocess.STDOUT)
-    cur.execute('UPDATE repositories SET status = "cloned" WHERE id = ?', (repository_id, ))
-    conn.commit()
-    conn.close()
+def clone_repository(repository_id, user, repo):
+    repository_url = '{}/{}/{}'.format(config.GITHUB_URL, user, repo)
+    with db.connection() as conn:
+        conn.execute('UPDATE repositories SET status = "cloning" WHERE id = ?', (repository_id, ))
+    # leftover of an interrupted or failed clone
+    repo_folder = repository_folder(user, repo)
+    if os.path.exists(repo_folder):
+        shutil.rmtree(repo_folder)
+    reference = fork_reference(user, repo)
+    app.logger.info('Issuing git clone {}{}'.format(repository_url, ' borrowing objects from ' + reference if reference else ''))
+    try:
+        with tracing.span('clone'):
+            transfer = repositories.clone(repository_url, repo_folder, reference)
+    except RuntimeError:
+        with db.connection() as conn:
+            conn.execute('UPDATE repositories SET status = ? WHERE id = ?', ('error', repository_id))
+        raise
+    app.logger.info('Cloned {} bytes in {:.1f}s'.format(*transfer))
+    with db.connection() as conn:
+        conn.execute('UPDATE repositories SET status = ? WHERE id = ?', ('cloned', repository_id))
+        record_transfer(conn, repository_id, None, 'clone', transfer)
+
+# folder of the local clone of the repository a fork was created from, None if the repository
+# is not a fork or its upstream has not been cloned
+def fork_reference(user, repo):
+    try:
+        repository_info = github.get_client().get_repository(user, repo)
+    except (github.GitHubError, requests.RequestException) as e:
+        app.logger.warning('Cannot get info on repository {}/{}: {}'.format(user, repo, e))
+        return None
+    if not repository_info.get('fork'):
+        return None
+    source = repository_info.get('source') or {}
+    source_user, source_repo = source.get('owner', {}).get('login'), source.get('name')
+    with db.connection() as conn:
+        row = conn.execute('SELECT status FROM repositories WHERE user = ? AND repo = ?', (source_user, source_repo)).fetchone()
+    if not row or row['status'] != 'cloned':
+        return None
+    return repository_folder(source_user, source_repo)
+
+# record the bytes and the duration of a clone or a fetch
+def record_transfer(conn, repository_id, review_id, operation, transfer):
+    conn.execute('INSERT INTO repositorytransfers (repo_id, review_id, operation, bytes, duration, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (repository_id, review_id, operation, transfer[0], transfer[1], time.time()))
+
+# garbage collection of the data on disk, run periodically as a background job:
+#   - the data of the finished reviews not opened for REVIEW_MAX_AGE seconds is removed
+#   - while the clones and the diffs take more than STORAGE_MAX_BYTES, the least recently used
+#     clones are removed with the data of the reviews of their repository. the clones used by
+#     a review being processed, or whose objects are borrowed by the clone of a fork, are kept
+#   - the strings no longer referenced by any method call are removed
+def collect_garbage():
+    with tracing.span('garbage_collection'):
+        accessed_before = time.time() - config.REVIEW_MAX_AGE
+        with db.connection() as conn:
+            old_reviews = [row[0] for row in conn.execute('SELECT id FROM reviews WHERE status IN (?, ?) AND last_accessed < ?',
+                ('ready', 'error', accessed_before))]
+            evicted = evict_reviews(conn, old_reviews, accessed_before)
+        remove_review_diffs(evicted)
+
+        with db.connection() as conn:
+            clones = conn.execute('SELECT r.id, r.user, r.repo, MAX(v.last_accessed) AS last_accessed FROM repositories r '
+                'LEFT JOIN reviews v ON v.repo_id = r.id WHERE r.status = ? GROUP BY r.id ORDER BY last_accessed', ('cloned', )).fetchall()
+        folders = {row['id']: repository_folder(row['user'], row['repo']) for row in clones}
+        sizes = {repository_id: repositories.disk_size(folder) for repository_id, folder in folders.items()}
+        # folders of the clones borrowing the objects of each clone
+        borrowers = {}
+        for folder in folders.values():
+            for upstream in repositories.alternates(folder):
+                borrowers.setdefault(os.path.realpath(upstream), set()).add(os.path.realpath(folder))
+        evicted_clones = 0
+        usage = sum(sizes.values()) + repositories.disk_size(DIFFS_DIR)
+        while usage > config.STORAGE_MAX_BYTES:
+            for row in clones:
+                if row['id'] not in sizes or borrowers.get(os.path.realpath(folders[row['id']])):
+                    continue
+                reviews = evict_clone(row['id'], row['user'], row['repo'])
+                if reviews is not None:
+                    break
+            else:
+                app.logger.warning('Cannot bring the storage under {} bytes, the remaining clones are in use'.format(config.STORAGE_MAX_BYTES))
+                break
+            # the upstream of the removed clone may be removable now
+            for folder_borrowers in borrowers.values():
+                folder_borrowers.discard(os.path.realpath(folders[row['id']]))
+            del sizes[row['id']]
+            evicted += reviews
+            evicted_clones += 1
+            usage = sum(sizes.values()) + repositories.disk_size(DIFFS_DIR)
+
+        with db.connection() as conn:
+            strings = interning.collect_garbage(conn)
+        jobs = job_queue.purge(time.time() - config.JOB_RETENTION)
+    app.logger.info('Garbage collection removed {} reviews, {} clones, {} strings and {} jobs, storage is now {} bytes'.format(
+        len(evicted), evicted_clones, strings, jobs, usage))
+
+# remove the data of some finished reviews (method calls, modified files), keeping their
+# records with the 'evicted' status so that they are processed again if opened. only the
+# reviews not opened since `accessed_before` are evicted, if given. their diffs are to be
+# removed with remove_review_diffs once the transaction is committed. returns the evicted reviews
+def evict_reviews(conn, review_ids, accessed_before=None):
+    evicted = []
+    for review_id in review_ids:
+        if accessed_before is None:
+            cur = conn.execute('UPDATE reviews SET status = ? WHERE id = ? AND status IN (?, ?)',
+                ('evicted', review_id, 'ready', 'error'))
+        else:
+            cur = conn.execute('UPDATE reviews SET status = ? WHERE id = ? AND status IN (?, ?) AND last_accessed < ?',
+                ('evicted', review_id, 'ready', 'error', accessed_before))
+        if cur.rowcount == 1:
+            conn.execute('DELETE FROM methodcallrows WHERE review_id = ?', (review_id, ))
+            conn.execute('DELETE FROM modifiedfiles WHERE review_id = ?', (review_id, ))
+            callgraph.delete(conn, review_id)
+            evicted.append(review_id)
+    return evicted
+
+def remove_review_diffs(review_ids):
+    for review_id in review_ids:
+        remove_file(compressed_diff_path(review_id))
+        remove_file(legacy_diff_path(review_id))
+
+# remove the clone of a repository, with the data of the reviews of the repository which need
+# it to be served. the repository is cloned again by its next review. returns the evicted
+# reviews, None if the clone is in use
+def evict_clone(repository_id, user, repo):
+    repo_folder = repository_folder(user, repo)
+    # dot-prefixed, it cannot be the folder of a repository
+    trash_folder = tempfile.mkdtemp(prefix='.evicted-', dir=CLONED_REPOS_DIR)
+    moved_folder = os.path.join(trash_folder, 'repository')
+    try:
+        with db.connection() as conn:
+            # checked by the same statement that marks the repository as evicted, so no review of
+            # the repository can start meanwhile. a clone being made may borrow its objects
+            cur = conn.execute('UPDATE repositories SET status = ? WHERE id = ? AND status = ? '
+                'AND NOT EXISTS (SELECT 1 FROM reviews WHERE repo_id = ? AND status = ?) '
+                'AND NOT EXISTS (SELECT 1 FROM repositories WHERE status = ?)',
+                ('evicted', repository_id, 'cloned', repository_id, 'processing', 'cloning'))
+            if cur.rowcount == 0:
+                return None
+            review_ids = [row[0] for row in conn.execute('SELECT id FROM reviews WHERE repo_id = ?', (repository_id, ))]
+            evicted = evict_reviews(conn, review_ids)
+            gitstore.close_store(repo_folder)
+            # moved away before the transaction is committed, so the next clone of the repository
+            # never finds the folder being removed
+            if os.path.exists(repo_folder):
+                os.rename(repo_folder, moved_folder)
+    except BaseException:
+        # the repository is still cloned if the transaction failed
+        if os.path.exists(moved_folder):
+            os.rename(moved_folder, repo_folder)
+        raise
+    finally:
+        shutil.rmtree(trash_folder, ignore_errors=True)
+    remove_review_diffs(evicted)
+    app.logger.info('Removed the clone of {}/{} and the data of {} reviews'.format(user, repo, len(evicted)))
+    return evicted
+
+# enqueue the garbage collection every GC_INTERVAL seconds. a single one is queued at a time,
+# whichever process enqueues it
+def schedule_garbage_collection():
+    def run():
+        while True:
+            try:
+                enqueue_job(collect_garbage, stage='git', priority=jobqueue.BACKGROUND, dedup_key='garbage_collection')
+            except Exception:
+                app.logger.exception('Cannot schedule the garbage collection')
+            time.sleep(config.GC_INTERVAL)
+
+    if config.GC_INTERVAL > 0:
+        threading.Thread(target=run, name='garbage-collection', daemon=True).start()
+
+@app.route('/jobs/stats')
+def get_job_stats():
+    return jsonify(status='ok', data=job_queue.get_stats())
+
+# prefetch the reviews of many pull requests in the background. the body is a JSON object
+# with `pull_requests`, a list of pull request urls, and/or `repository` ("user/repo") to
+# prefetch all its open pull requests
+@app.route('/reviews/prefetch', methods=['POST'])
+def prefetch():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('pull_requests', []), list):
+        return jsonify(status='error', error='invalid_request')
+    try:
+        pulls, commits = prefetch_targets(body.get('pull_requests'), body.get('repository'))
+        data = prefetch_reviews(pulls, commits)
+    except ValueError as e:
+        app.logger.error(str(e))
+        return jsonify(status='error', error='invalid_request')
+    except (github.GitHubError, requests.RequestException) as e:
+        app.logger.error('Problem with Github API: {}'.format(e))
+        return jsonify(status='error', error='github_error')
+    return jsonify(status='ok', data=data)
+
+@app.route('/review/<int:review_id>/events')
+def stream_review_events(review_id):
+    # stream the stage transitions and progress counters of a review as server-sent events,
+    # until the review is ready or failed
+    subscriber = review_events.subscribe(review_id)
+    with db.connection() as conn:
+        row = conn.execute('SELECT status FROM reviews WHERE id = ?', (review_id, )).fetchone()
+        state = events.stored_state(conn, review_id)
+    if not row:
+        review_events.unsubscribe(review_id, subscriber)
+        app.logger.error('Review with id {} not existing'.format(review_id))
+        return jsonify(status='error', error='review_not_existing')
+
+    def stream():
+        try:
+            # the status stored in the db is authoritative, the progress only has the details
+            if row['status'] in events.FINAL_STAGES:
+                yield events.format_event({'stage': row['status']})
+                return
+            last = state or {'stage': row['status']}
+            yield events.format_event(last)
+            idle = 0
+            while True:
+                try:
+                    event = subscriber.get(timeout=EVENTS_POLL_INTERVAL)
+                except queue.Empty:
+                    # the review could be processed by another process, check the db
+                    with db.connection() as conn:
+                        status = conn.execute('SELECT status FROM reviews WHERE id = ?', (review_id, )).fetchone()[0]
+                        event = events.stored_state(conn, review_id)
+                    if status in events.FINAL_STAGES:
+                        yield events.format_event({'stage': status})
+                        return
+                    if event is None or event == last:
+                        idle += EVENTS_POLL_INTERVAL
+                        if idle >= EVENTS_KEEPALIVE_INTERVAL:
+                            idle = 0
+                            yield ': keepalive\n\n'
+                        continue
+                idle = 0
+                if event == last:
+                    continue
+                last = event
+                yield events.format_event(event)
+                if event['stage'] in events.FINAL_STAGES:
+                    return
+        finally:
+            review_events.unsubscribe(review_id, subscriber)
 
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# method calls of a review. the rows are streamed from the db as they are serialized, and
+# can be filtered and paginated with these parameters:
+#   from_file, to_file: only the calls from/to these files (can be repeated)
+#   min_line, max_line: only the calls overlapping these lines of from_file
+#   min_declaration_line, max_declaration_line: only the calls to methods overlapping these
+#     lines of to_file
+#   fields: comma-separated columns to return (default: all)
+#   limit: maximum number of calls to return. if there are more, the response has a
+#     next_cursor to pass as `cursor` to get the next ones
+# with format=compact each call is a list of the values of `fields` in that order, and each
+# string is sent once in `strings` and referenced by its index in it. the strings are read
+# from the strings table once, after the calls referencing them by id
 @app.route('/review/<int:review_id>/methodcalls')
 def dump_methodcalls(review_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    rows = cur.execute('SELECT * FROM methodcalls WHERE review_id = ?', (review_id, )).fetchall()
-    output = [dict(ix) for ix in rows]
-    conn.close()
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(METHODCALL_FIELDS)
+    if not fields or any(field not in METHODCALL_FIELDS for field in fields):
+        return jsonify(status='error', error='invalid_fields')
+    compact = request.args.get('format', 'rows') == 'compact'
+    conditions, params = ['m.`review_id` = ?'], [review_id]
+    for column in ('from_file', 'to_file'):
+        values = request.args.getlist(column)
+        if values:
+            conditions.append('m.`{}_id` IN (SELECT `id` FROM strings WHERE `value` IN ({}))'.format(column, ','.join('?' * len(values))))
+            params += values
+    try:
+        for name, condition in METHODCALL_LINE_FILTERS.items():
+            if name in request.args:
+                conditions.append(condition)
+                params.append(int(request.args[name]))
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify(status='error', error='invalid_parameter')
+    if limit is not None and limit <= 0:
+        return jsonify(status='error', error='invalid_parameter')
 
-    return jsonify(status='ok', data=output)
+    # the id of the strings for the compact format, the strings themselves otherwise
+    def column(field):
+        if field not in METHODCALL_STRING_FIELDS:
+            return 'm.`{}`'.format(field)
+        if compact:
+            return 'm.`{}_id`'.format(field)
+        return interning.value_of('m.`{}_id`'.format(field))
 
-@app.route('/review/<int:review_id>/file')
-def get_file(review_id):
-    # check that a file path is provided
+    # one more row than the limit is read to know if there is a next page
+    query = 'SELECT m.`id`, {} FROM methodcallrows m WHERE {} AND m.`id` > ? ORDER BY m.`id` LIMIT ?'.format(
+        ', '.join(column(field) for field in fields), ' AND '.join(conditions))
+    params += [cursor, limit + 1 if limit is not None else -1]
+
+    def stream():
+        strings = {}
+        string_columns = [i for i, field in enumerate(fields) if field in METHODCALL_STRING_FIELDS]
+        if compact:
+            yield '{{"status": "ok", "format": "compact", "fields": {}, "data": ['.format(json.dumps(fields))
+        else:
+            yield '{"status": "ok", "data": ['
+        count, last_id, more, chunk, separator = 0, None, False, [], ''
+        with db.connection() as conn:
+            for row in conn.execute(query, params):
+                if count == limit:
+                    more = True
+                    break
+                count += 1
+                last_id = row[0]
+                values = list(row)[1:]
+                if compact:
+                    for i in string_columns:
+                        if values[i] is not None:
+                            values[i] = strings.setdefault(values[i], len(strings))
+                    chunk.append(json.dumps(values))
+                else:
+                    chunk.append(json.dumps(dict(zip(fields, values))))
+                if len(chunk) == METHODCALLS_CHUNK_ROWS:
+                    yield separator + ','.join(chunk)
+                    chunk, separator = [], ','
+            if compact:
+                string_values = interning.values(conn, strings)
+        if chunk:
+            yield separator + ','.join(chunk)
+        next_cursor = last_id if more else None
+        if compact:
+            yield '], "strings": {}, "next_cursor": {}}}'.format(json.dumps([string_values[string_id] for string_id in strings]),
+                                                                 json.dumps(next_cursor))
+        else:
+            yield '], "next_cursor": {}}}'.format(json.dumps(next_cursor))
+
+    return streamed_response(stream(), 'application/json')
+
+# queries on the call graph of a review, built when its method calls are stored. the file is
+# given by the `path` parameter. a file without method calls from or to it has empty results
+
+# declarations of a file containing the given `line`, the innermost first, each of them with
+# the method calls to it
+@app.route('/review/<int:review_id>/callers')
+def get_callers(review_id):
+    try:
+        line = int(request.args['line'])
+    except (KeyError, ValueError):
+        return jsonify(status='error', error='invalid_parameter')
+
+    def query(conn, file_id, stats):
+        declarations = callgraph.declarations_at(conn, review_id, file_id, line, stats)
+        for declaration in declarations:
+            declaration['method_calls'] = callgraph.callers(conn, declaration['id'])
+        return declarations
+
+    return call_graph_response(review_id, query, [])
+
+# files called by a file and calling it, with the number of calls, and the totals of the file
+@app.route('/review/<int:review_id>/callees')
+def get_callees(review_id):
+    def query(conn, file_id, stats):
+        return {
+            'stats': stats,
+            'called_files': callgraph.called_files(conn, review_id, file_id),
+            'calling_files': callgraph.called_files(conn, review_id, file_id, reverse=True),
+        }
+
+    return call_graph_response(review_id, query, {'stats': None, 'called_files': [], 'calling_files': []})
+
+# method calls from a file overlapping the lines from `start` to `end` (default: `start`)
+@app.route('/review/<int:review_id>/lines')
+def get_lines(review_id):
+    try:
+        start = int(request.args['start'])
+        end = int(request.args.get('end', start))
+    except (KeyError, ValueError):
+        return jsonify(status='error', error='invalid_parameter')
+    return call_graph_response(review_id, lambda conn, file_id, stats: callgraph.calls_in_lines(conn, review_id, file_id, start, end, stats), [])
+
+# totals of all the files of a review with method calls from or to them, by path
+@app.route('/review/<int:review_id>/callgraph')
+def get_call_graph(review_id):
+    with db.connection() as conn:
+        if not conn.execute('SELECT 1 FROM reviews WHERE id = ?', (review_id, )).fetchone():
+            app.logger.error('Review with id {} not existing'.format(review_id))
+            return jsonify(status='error', error='review_not_existing')
+        return jsonify(status='ok', data=callgraph.all_file_stats(conn, review_id))
+
+# answer a query on the file of the `path` parameter. query(conn, file id, totals of the file)
+# is only called if the file has method calls, `empty` is the result otherwise
+def call_graph_response(review_id, query, empty):
     file_path = request.args.get('path')
     if not file_path:
         app.logger.error('No file path provided')
         return jsonify(status='error', error='file_path_not_provided')
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    row = cur.execute('SELECT base_commit_sha, pr_url FROM reviews WHERE id = ?', (review_id, )).fetchone()
-    if not row:
-        app.logger.error('Review with id {} not existing'.format(review_id))
-        return jsonify(status='error', error='review_not_existing')
-    conn.close()
-    base_commit_sha, pr_url = row[0], row[1]
-    matches = pr_url_regex.match(pr_url)
-    user, repo = matches.group(1), matches.group(2)
-    repo_folder = os.path.abspath('{}/{}_{}'.format(CLONED_REPOS_DIR, user, repo))
-    app.logger.info('Checking out base commit {}'.format(base_commit_sha))
-    command = ['git', 'checkout', base_commit_sha]
-    s = subprocess.run(command, cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Applying diff')
-    s = subprocess.run(['patch', '-p1', '-i', '../../{}/{}.diff'.format(DIFFS_DIR, review_id)], cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Reading file')
-    try:
-        contents = open('{}/{}'.format(repo_folder, file_path), 'r').read()
-        app.logger.info('Restoring state of repository')
-        s = subprocess.run(['git', 'checkout', '--', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
-        s = subprocess.run(['git', 'clean', '-qfdx'], cwd=repo_folder, stdout=subprocess.PIPE)
-        return jsonify(status='ok', data=contents)
-    except:
-        app.logger.info('Restoring state of repository')
-        s = subprocess.run(['git', 'checkout', '--', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
-        s = subprocess.run(['git', 'clean', '-qfdx'], cwd=repo_folder, stdout=subprocess.PIPE)
-        return jsonify(status='error', error='file_not_found')
+    with tracing.span('call_graph_query'), db.connection() as conn:
+        if not conn.execute('SELECT 1 FROM reviews WHERE id = ?', (review_id, )).fetchone():
+            app.logger.error('Review with id {} not existing'.format(review_id))
+            return jsonify(status='error', error='review_not_existing')
+        file_id = interning.ids(conn, [file_path]).get(file_path)
+        stats = callgraph.file_stats(conn, review_id, file_id) if file_id is not None else None
+        data = query(conn, file_id, stats) if stats else empty
+    return jsonify(status='ok', data=data)
 
+# response sending the chunks of a generator as they are produced, compressed with gzip if
+# the client accepts it
+def streamed_response(chunks, mimetype):
+    if config.RESPONSE_COMPRESSION_LEVEL and 'gzip' in request.accept_encodings:
+        response = Response(gzip_chunks(chunks), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response((chunk.encode('utf-8') for chunk in chunks), mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
-@app.route('/review/<int:review_id>/diff')
-def get_diff(review_id):
+def gzip_chunks(chunks):
+    # wbits=31 writes the gzip header and trailer
+    compressor = zlib.compressobj(config.RESPONSE_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # flushed after every chunk, so the client can use the data as soon as it is sent
+        yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+# index of the file patches in the diff of a review, by path. only the headers of the
+# patches and their position in the diff are kept, each patch is read when needed with
+# load_review_patch. the result is cached as long as the diff file on disk does not change
+def load_review_index(review_id):
+    diff_path = review_diff_path(review_id)
+    return _scan_diff_file(diff_path, os.stat(diff_path).st_mtime_ns)
+
+@lru_cache(maxsize=64)
+def _scan_diff_file(diff_path, mtime):
+    with open(diff_path, 'rb') as diff_file:
+        patches = diffutils.scan_diff_file(diff_file)
+    indexed = {patch.path: patch for patch in patches}
+    # files renamed by the pull request can also be looked up by their old path
+    for patch in patches:
+        indexed.setdefault(patch.old_path, patch)
+    return indexed
+
+# read the patch of a file from the diff of a review, None if the file is not modified
+def load_review_patch(review_id, file_path):
+    entry = load_review_index(review_id).get(file_path)
+    if entry is None:
+        return None
+    with open(review_diff_path(review_id), 'rb') as diff_file:
+        return diffutils.read_patch(diff_file, entry.offset, entry.length)
+
+# compute the contents of a file after applying the diff of the review and its full-context
+# diff. the base version is read from the object store of the repository, the working tree
+# is never touched. returns a tuple (contents, diff), each of them None if not existing
+def read_review_file(review_id, repo_folder, base_commit_sha, file_path):
+    patch = load_review_patch(review_id, file_path)
+    if patch is None:
+        # file not modified by the pull request, its diff is empty
+        blob = gitstore.get_store(repo_folder).read(base_commit_sha, file_path)
+        if blob is None:
+            return None, None
+        return blob[1].decode('utf-8', errors='replace'), ''
+    contents, diff = apply_review_patch(repo_folder, base_commit_sha, patch)
+    if patch.deleted_file or file_path != patch.new_path:
+        # deleted, or renamed and looked up by its old path
+        contents = None
+    return contents, diff
+
+# apply the patch of a file to its version in the base commit. returns a tuple (contents, diff)
+def apply_review_patch(repo_folder, base_commit_sha, patch):
+    base = ''
+    if not patch.new_file:
+        blob = gitstore.get_store(repo_folder).read(base_commit_sha, patch.old_path)
+        if blob is None:
+            raise diffutils.PatchError('Base version of {} not found'.format(patch.old_path))
+        base = blob[1].decode('utf-8', errors='replace')
+    return patch.apply(base)
+
+# compute the contents and the diff of a file modified by a review and store them in the
+# file cache. returns their cache keys
+def precompute_review_file(review_id, repo_folder, base_commit_sha, file_path):
+    contents, diff = read_review_file(review_id, repo_folder, base_commit_sha, file_path)
+    contents_hash = file_cache.put(contents) if contents is not None else None
+    diff_hash = file_cache.put(diff) if diff is not None else None
+    with db.connection() as conn:
+        conn.execute('UPDATE modifiedfiles SET contents_hash = ?, diff_hash = ? WHERE review_id = ? AND new_filename = ?',
+            (contents_hash, diff_hash, review_id, file_path))
+    return contents_hash, diff_hash
+
+# contents of the Java files touched by a review after its diff is applied, indexed by path.
+# the files removed or renamed by the review are mapped to None. the contents of the files
+# that cannot be computed are left out
+def review_java_files(review_id, repo_folder, base_commit_sha):
+    files = {}
+    for patch in load_review_index(review_id).values():
+        if patch.old_path.endswith('.java') and (patch.deleted_file or patch.renamed):
+            files[patch.old_path] = None
+    with db.connection() as conn:
+        rows = conn.execute('SELECT new_filename, contents_hash FROM modifiedfiles WHERE review_id = ?', (review_id, )).fetchall()
+    for file_path, contents_hash in rows:
+        contents = file_cache.get(contents_hash) if contents_hash else None
+        if contents is None:
+            try:
+                contents = read_review_file(review_id, repo_folder, base_commit_sha, file_path)[0]
+            except diffutils.PatchError:
+                continue
+        if contents is not None:
+            files[file_path] = contents
+    return files
+
+# precompute the contents and the diff of the files modified by a review which are not
+# precomputed yet. the files shown to the reviewers only depend on the base commit and the
+# diff, so they can be computed once for all of them. a file that cannot be precomputed is
+# computed again when requested
+def precompute_review_files(review_id):
+    repo_folder, base_commit_sha = review_repository(review_id)
+    with db.connection() as conn:
+        mod_files = [row[0] for row in conn.execute('SELECT new_filename FROM modifiedfiles WHERE review_id = ? AND contents_hash IS NULL', (review_id, ))]
+    app.logger.info('Precomputing contents and diff of {} modified files'.format(len(mod_files)))
+    # the base versions of the files of the review are fetched together, before they are read
+    base_paths = sorted({patch.old_path for patch in load_review_index(review_id).values() if not patch.new_file})
+    with tracing.span('fetch_files', review_id):
+        transfer = repositories.fetch_blobs(repo_folder, base_commit_sha, base_paths)
+    if transfer:
+        app.logger.info('Fetched {} bytes of files in {:.1f}s'.format(*transfer))
+        with db.connection() as conn:
+            repository_id = conn.execute('SELECT repo_id FROM reviews WHERE id = ?', (review_id, )).fetchone()[0]
+            record_transfer(conn, repository_id, review_id, 'fetch_files', transfer)
+    with tracing.span('precompute', review_id):
+        for file_path in mod_files:
+            try:
+                precompute_review_file(review_id, repo_folder, base_commit_sha, file_path)
+            except diffutils.PatchError as e:
+                app.logger.warning('Cannot precompute {}: {}'.format(file_path, e))
+
+# serve the contents (kind 0) or the diff (kind 1) of a file of a review, from the file cache
+# when possible. responses carry the cache key of the data as strong ETag, so that clients
+# can revalidate them and get a 304 Not Modified
+def serve_review_file(review_id, kind):
     # check that a file path is provided
     file_path = request.args.get('path')
     if not file_path:
         app.logger.error('No file path provided')
         return jsonify(status='error', error='file_path_not_provided')
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    row = cur.execute('SELECT base_commit_sha, pr_url FROM reviews WHERE id = ?', (review_id, )).fetchone()
-    if not row:
+    repo_folder, base_commit_sha = review_repository(review_id)
+    if not base_commit_sha:
         app.logger.error('Review with id {} not existing'.format(review_id))
         return jsonify(status='error', error='review_not_existing')
-    conn.close()
-    base_commit_sha, pr_url = row[0], row[1]
-    matches = pr_url_regex.match(pr_url)
-    user, repo = matches.group(1), matches.group(2)
-    repo_folder = os.path.abspath('{}/{}_{}'.format(CLONED_REPOS_DIR, user, repo))
-    app.logger.info('Checking out base commit {}'.format(base_commit_sha))
-    command = ['git', 'checkout', base_commit_sha]
-    s = subprocess.run(command, cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Applying diff')
-    s = subprocess.run(['patch', '-p1', '-i', '../../{}/{}.diff'.format(DIFFS_DIR, review_id)], cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Reading file')
-    app.logger.info('Getting diff of file')
-    subprocess.run(['git', 'add', '-N', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
-    s = subprocess.run(['git', '--no-pager', 'diff', '-U99999999', file_path], cwd=repo_folder, stdout=subprocess.PIPE)
-    app.logger.info('Restoring state of repository')
-    subprocess.run(['git', 'reset'], cwd=repo_folder, stdout=subprocess.PIPE)
-    subprocess.run(['git', 'checkout', '--', '.'], cwd=repo_folder, stdout=subprocess.PIPE)
-    subprocess.run(['git', 'clean', '-qfdx'], cwd=repo_folder, stdout=subprocess.PIPE)
-    if s.returncode != 0:
+    with db.connection() as conn:
+        row = conn.execute('SELECT contents_hash, diff_hash FROM modifiedfiles WHERE review_id = ? AND new_filename = ?',
+            (review_id, file_path)).fetchone()
+    key = row[kind] if row else None
+    if key and request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+
+    data = file_cache.get(key) if key else None
+    if data is None:
+        app.logger.info('Computing {} of file {} at base commit {}'.format(('contents', 'diff')[kind], file_path, base_commit_sha))
+        try:
+            if row:
+                # modified file, store it in the cache for the next requests
+                key = precompute_review_file(review_id, repo_folder, base_commit_sha, file_path)[kind]
+                data = file_cache.get(key) if key else None
+            else:
+                data = read_review_file(review_id, repo_folder, base_commit_sha, file_path)[kind]
+                key = gitstore.blob_hash(data.encode('utf-8')) if data is not None else None
+        except diffutils.PatchError as e:
+            app.logger.error('Cannot apply diff: {}'.format(e))
+            return jsonify(status='error', error='patch_failed')
+    if data is None:
         return jsonify(status='error', error='file_not_found')
-    else:
-        contents = s.stdout.decode('utf-8')
-        return jsonify(status='ok', data=contents)
+    response = jsonify(status='ok', data=data)
+    response.set_etag(key)
+    return response.make_conditional(request)
+
+# contents and diff of a file for the batch endpoint. `keys` are the cache keys of the file
+# in modifiedfiles, None if the file is not modified by the review
+def review_file_entry(review_id, repo_folder, base_commit_sha, file_path, keys):
+    try:
+        if keys is None:
+            data = read_review_file(review_id, repo_folder, base_commit_sha, file_path)
+        else:
+            data = [file_cache.get(key) if key else None for key in keys]
+            if not any(keys) or any(key and value is None for key, value in zip(keys, data)):
+                # not precomputed yet, or evicted from the cache
+                keys = precompute_review_file(review_id, repo_folder, base_commit_sha, file_path)
+                data = [file_cache.get(key) if key else None for key in keys]
+    except diffutils.PatchError as e:
+        app.logger.error('Cannot apply diff: {}'.format(e))
+        return {'path': file_path, 'status': 'error', 'error': 'patch_failed'}
+    if data[0] is None and data[1] is None:
+        return {'path': file_path, 'status': 'error', 'error': 'file_not_found'}
+    return {'path': file_path, 'status': 'ok', 'contents': data[0], 'diff': data[1]}
+
+# contents and diffs of many files of a review in a single request. the files are the `path`
+# parameters, or a JSON list of paths in the body of a POST, or all the files modified by
+# the review if none is given. they are computed in parallel and streamed as NDJSON in the
+# order they are ready, one object {"path", "status", "contents", "diff"} per line
+@app.route('/review/<int:review_id>/files', methods=['GET', 'POST'])
+def get_files(review_id):
+    paths = request.args.getlist('path')
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, list) or not all(isinstance(path, str) for path in body):
+            return jsonify(status='error', error='invalid_paths')
+        paths += body
+    if len(paths) > config.FILE_BATCH_MAX_FILES:
+        return jsonify(status='error', error='too_many_paths')
+    repo_folder, base_commit_sha = review_repository(review_id)
+    if not base_commit_sha:
+        app.logger.error('Review with id {} not existing'.format(review_id))
+        return jsonify(status='error', error='review_not_existing')
+    with db.connection() as conn:
+        modified = {row[0]: (row[1], row[2]) for row in conn.execute(
+            'SELECT new_filename, contents_hash, diff_hash FROM modifiedfiles WHERE review_id = ?', (review_id, ))}
+    # each file once, in the order requested
+    paths = list(dict.fromkeys(paths)) if paths else list(modified)
+
+    def stream():
+        futures = [file_batch_executor.submit(review_file_entry, review_id, repo_folder, base_commit_sha, path, modified.get(path))
+                   for path in paths]
+        try:
+            with tracing.span('get_files'):
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + '\n'
+        finally:
+            # the client went away, skip the files not started yet
+            for future in futures:
+                future.cancel()
+
+    return streamed_response(stream(), 'application/x-ndjson')
+
+@app.route('/review/<int:review_id>/file')
+def get_file(review_id):
+    with tracing.span('get_file'):
+        return serve_review_file(review_id, 0)
+
+@app.route('/review/<int:review_id>/diff')
+def get_diff(review_id):
+    with tracing.span('get_diff'):
+        return serve_review_file(review_id, 1)
+
+# metrics of the backend, in the Prometheus text format
+@app.route('/metrics')
+def get_metrics():
+    return Response(tracing.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def _job_counts():
+    return [({'stage': stage, 'status': status}, count)
+            for stage, counts in job_queue.get_stats().items()
+            for status, count in counts.items() if status in (jobqueue.PENDING, jobqueue.RUNNING)]
+
+def _cache_counts(*caches):
+    return [({'cache': name, 'result': result}, count)
+            for name, cache in caches for result, count in (('hit', cache.hits), ('miss', cache.misses))]
+
+tracing.registry.collector('jobs', 'gauge', 'Jobs queued and in flight, by stage', _job_counts)
+tracing.registry.collector('cache_lookups_total', 'counter', 'Lookups in the caches of this process, by result',
+    lambda: _cache_counts(('file', file_cache), ('extraction', extraction_cache)))
+tracing.registry.collector('github_requests_total', 'counter', 'Requests sent to github by this process',
+    lambda: github.get_client().requests)
+tracing.registry.collector('github_not_modified_total', 'counter', 'Github requests answered from the ETag cache',
+    lambda: github.get_client().not_modified)
+
+# handlers of the jobs, by kind
+JOB_HANDLERS = {fn.__name__: fn for fn in (
+    clone_repository, fetch_repository, process_diff, precompute_review_files, extract_methodcalls, collect_garbage,
+)}
+
+# run the workers of the job queue inside this process
+def start_workers():
+    worker.Worker(job_queue, JOB_HANDLERS, worker.configured_threads(), on_failure=job_failed).start()
 
 if __name__ == '__main__':
-    app.run()
+    db.migrate()
+    if config.JOB_WORKERS_IN_APP:
+        start_workers()
+    schedule_garbage_collection()
+    app.run(port=config.PORT)
@@ -0,0 +1,43 @@
+-- pr_url was declared INTEGER and methodcalls.review_id TEXT, so the values stored in
+-- them did not have the affinity of the values used to look them up. the tables are
+-- rebuilt with the right column types, since SQLite cannot alter the type of a column.
+CREATE TABLE `reviews_new` (
+	`id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+	`status`	TEXT,
+	`repo_id`	INTEGER,
+	`pr_url`	TEXT,
+	`base_commit_sha` TEXT,
+	`head_commit_sha` TEXT
+);
+INSERT INTO `reviews_new` SELECT `id`, `status`, `repo_id`, CAST(`pr_url` AS TEXT), `base_commit_sha`, `head_commit_sha` FROM `reviews`;
+DROP TABLE `reviews`;
+ALTER TABLE `reviews_new` RENAME TO `reviews`;
+
+CREATE TABLE `methodcalls_new` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `review_id` INTEGER,
+    `from_file` TEXT,
+    `call_start_line` INTEGER,
+    `call_start_column` INTEGER,
+    `call_end_line` INTEGER,
+    `call_end_column` INTEGER,
+    `method_call` TEXT,
+    `short_method_qualifier` TEXT,
+    `full_method_qualifier` TEXT,
+    `to_file` TEXT,
+    `declaration_start_line` INTEGER,
+    `declaration_start_column` INTEGER,
+    `declaration_end_line` INTEGER,
+    `declaration_end_column` INTEGER
+);
+INSERT INTO `methodcalls_new` SELECT `id`, CAST(`review_id` AS INTEGER), `from_file`, `call_start_line`,
+    `call_start_column`, `call_end_line`, `call_end_column`, `method_call`, `short_method_qualifier`,
+    `full_method_qualifier`, `to_file`, `declaration_start_line`, `declaration_start_column`,
+    `declaration_end_line`, `declaration_end_column` FROM `methodcalls`;
+DROP TABLE `methodcalls`;
+ALTER TABLE `methodcalls_new` RENAME TO `methodcalls`;
+
+CREATE INDEX IF NOT EXISTS `reviews_pr_url` ON `reviews` (`pr_url`);
+CREATE INDEX IF NOT EXISTS `repositories_user_repo` ON `repositories` (`user`, `repo`);
+CREATE INDEX IF NOT EXISTS `modifiedfiles_review_id` ON `modifiedfiles` (`review_id`);
+CREATE INDEX IF NOT EXISTS `methodcalls_review_id` ON `methodcalls` (`review_id`);
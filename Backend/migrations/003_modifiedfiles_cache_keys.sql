@@ -0,0 +1,5 @@
+-- keys in the file cache of the contents and of the full-context diff of each modified file,
+-- after the diff of the review is applied
+ALTER TABLE `modifiedfiles` ADD COLUMN `contents_hash` TEXT;
+ALTER TABLE `modifiedfiles` ADD COLUMN `diff_hash` TEXT;
+CREATE INDEX IF NOT EXISTS `modifiedfiles_review_id_new_filename` ON `modifiedfiles` (`review_id`, `new_filename`);
@@ -0,0 +1,30 @@
+-- results of the extractor shared across reviews. an entry holds the method calls into a
+-- file, for a given repository state (see extractioncache.py for how the key is computed)
+CREATE TABLE IF NOT EXISTS `extractioncache` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `cache_key` TEXT NOT NULL UNIQUE,
+    `repo_id` INTEGER,
+    `base_commit_sha` TEXT,
+    `to_file` TEXT,
+    `row_count` INTEGER,
+    `last_used` REAL
+);
+CREATE TABLE IF NOT EXISTS `cachedmethodcalls` (
+    `entry_id` INTEGER,
+    `from_file` TEXT,
+    `call_start_line` INTEGER,
+    `call_start_column` INTEGER,
+    `call_end_line` INTEGER,
+    `call_end_column` INTEGER,
+    `method_call` TEXT,
+    `short_method_qualifier` TEXT,
+    `full_method_qualifier` TEXT,
+    `to_file` TEXT,
+    `declaration_start_line` INTEGER,
+    `declaration_start_column` INTEGER,
+    `declaration_end_line` INTEGER,
+    `declaration_end_column` INTEGER
+);
+CREATE INDEX IF NOT EXISTS `extractioncache_last_used` ON `extractioncache` (`last_used`);
+CREATE INDEX IF NOT EXISTS `cachedmethodcalls_entry_id` ON `cachedmethodcalls` (`entry_id`);
+CREATE INDEX IF NOT EXISTS `methodcalls_review_id_to_file` ON `methodcalls` (`review_id`, `to_file`);
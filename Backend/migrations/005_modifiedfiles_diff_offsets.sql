@@ -0,0 +1,4 @@
+-- position in bytes of the patch of each modified file in the diff of the review, so that
+-- it can be read without parsing the whole diff
+ALTER TABLE `modifiedfiles` ADD COLUMN `diff_offset` INTEGER;
+ALTER TABLE `modifiedfiles` ADD COLUMN `diff_length` INTEGER;
@@ -0,0 +1,12 @@
+-- clones and fetches of the repositories, with the bytes they added to the local object
+-- store and their duration, to keep track of the cost of acquiring the repositories
+CREATE TABLE IF NOT EXISTS `repositorytransfers` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `repo_id` INTEGER,
+    `review_id` INTEGER,
+    `operation` TEXT,
+    `bytes` INTEGER,
+    `duration` REAL,
+    `created_at` REAL
+);
+CREATE INDEX IF NOT EXISTS `repositorytransfers_repo_id` ON `repositorytransfers` (`repo_id`);
@@ -0,0 +1,29 @@
+-- durable queue of the background jobs, see jobqueue.py
+CREATE TABLE IF NOT EXISTS `jobs` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `kind` TEXT,
+    `args` TEXT,
+    `review_id` INTEGER,
+    `stage` TEXT,
+    `priority` INTEGER,
+    `lock_key` TEXT,
+    `dedup_key` TEXT,
+    `status` TEXT,
+    `attempts` INTEGER,
+    `lease_owner` TEXT,
+    `lease_expires` REAL,
+    `error` TEXT,
+    `created_at` REAL,
+    `started_at` REAL,
+    `finished_at` REAL
+);
+CREATE TABLE IF NOT EXISTS `jobdependencies` (
+    `job_id` INTEGER,
+    `depends_on` INTEGER
+);
+CREATE INDEX IF NOT EXISTS `jobs_status_stage_priority` ON `jobs` (`status`, `stage`, `priority`, `id`);
+CREATE INDEX IF NOT EXISTS `jobs_lock_key` ON `jobs` (`lock_key`, `status`);
+CREATE INDEX IF NOT EXISTS `jobs_dedup_key` ON `jobs` (`dedup_key`, `status`);
+CREATE INDEX IF NOT EXISTS `jobs_lease_owner` ON `jobs` (`lease_owner`);
+CREATE INDEX IF NOT EXISTS `jobdependencies_job_id` ON `jobdependencies` (`job_id`);
+CREATE INDEX IF NOT EXISTS `jobdependencies_depends_on` ON `jobdependencies` (`depends_on`);
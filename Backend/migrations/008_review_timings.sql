@@ -0,0 +1,10 @@
+-- duration of each stage of the processing of the reviews, see tracing.py
+CREATE TABLE IF NOT EXISTS `review_timings` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `review_id` INTEGER,
+    `stage` TEXT,
+    `started_at` REAL,
+    `duration` REAL,
+    `succeeded` INTEGER
+);
+CREATE INDEX IF NOT EXISTS `review_timings_review_id` ON `review_timings` (`review_id`);
@@ -0,0 +1,2 @@
+-- the method calls of a review can be filtered by the file they are in
+CREATE INDEX IF NOT EXISTS `methodcalls_review_id_from_file` ON `methodcalls` (`review_id`, `from_file`);
@@ -0,0 +1,91 @@
+-- the file paths, method calls and qualifiers of the method calls are repeated on many rows
+-- and across reviews. they are stored once in `strings` and the method calls reference them
+-- by id (see interning.py). `methodcalls` becomes a view joining the strings back, for the
+-- readers of the old table
+CREATE TABLE IF NOT EXISTS `strings` (
+    `id`	INTEGER PRIMARY KEY,
+    `value` TEXT NOT NULL UNIQUE
+);
+INSERT OR IGNORE INTO `strings` (`value`)
+    SELECT `from_file` FROM `methodcalls` UNION SELECT `method_call` FROM `methodcalls`
+    UNION SELECT `short_method_qualifier` FROM `methodcalls` UNION SELECT `full_method_qualifier` FROM `methodcalls`
+    UNION SELECT `to_file` FROM `methodcalls`
+    UNION SELECT `from_file` FROM `cachedmethodcalls` UNION SELECT `method_call` FROM `cachedmethodcalls`
+    UNION SELECT `short_method_qualifier` FROM `cachedmethodcalls` UNION SELECT `full_method_qualifier` FROM `cachedmethodcalls`
+    UNION SELECT `to_file` FROM `cachedmethodcalls`;
+
+CREATE TABLE `methodcallrows` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `review_id` INTEGER,
+    `from_file_id` INTEGER,
+    `call_start_line` INTEGER,
+    `call_start_column` INTEGER,
+    `call_end_line` INTEGER,
+    `call_end_column` INTEGER,
+    `method_call_id` INTEGER,
+    `short_method_qualifier_id` INTEGER,
+    `full_method_qualifier_id` INTEGER,
+    `to_file_id` INTEGER,
+    `declaration_start_line` INTEGER,
+    `declaration_start_column` INTEGER,
+    `declaration_end_line` INTEGER,
+    `declaration_end_column` INTEGER
+);
+INSERT INTO `methodcallrows` SELECT m.`id`, m.`review_id`, (SELECT `id` FROM `strings` WHERE `value` = m.`from_file`),
+    m.`call_start_line`, m.`call_start_column`, m.`call_end_line`, m.`call_end_column`,
+    (SELECT `id` FROM `strings` WHERE `value` = m.`method_call`),
+    (SELECT `id` FROM `strings` WHERE `value` = m.`short_method_qualifier`),
+    (SELECT `id` FROM `strings` WHERE `value` = m.`full_method_qualifier`),
+    (SELECT `id` FROM `strings` WHERE `value` = m.`to_file`),
+    m.`declaration_start_line`, m.`declaration_start_column`, m.`declaration_end_line`, m.`declaration_end_column`
+    FROM `methodcalls` m;
+DROP TABLE `methodcalls`;
+
+CREATE TABLE `cachedmethodcalls_new` (
+    `entry_id` INTEGER,
+    `from_file_id` INTEGER,
+    `call_start_line` INTEGER,
+    `call_start_column` INTEGER,
+    `call_end_line` INTEGER,
+    `call_end_column` INTEGER,
+    `method_call_id` INTEGER,
+    `short_method_qualifier_id` INTEGER,
+    `full_method_qualifier_id` INTEGER,
+    `to_file_id` INTEGER,
+    `declaration_start_line` INTEGER,
+    `declaration_start_column` INTEGER,
+    `declaration_end_line` INTEGER,
+    `declaration_end_column` INTEGER
+);
+INSERT INTO `cachedmethodcalls_new` SELECT c.`entry_id`, (SELECT `id` FROM `strings` WHERE `value` = c.`from_file`),
+    c.`call_start_line`, c.`call_start_column`, c.`call_end_line`, c.`call_end_column`,
+    (SELECT `id` FROM `strings` WHERE `value` = c.`method_call`),
+    (SELECT `id` FROM `strings` WHERE `value` = c.`short_method_qualifier`),
+    (SELECT `id` FROM `strings` WHERE `value` = c.`full_method_qualifier`),
+    (SELECT `id` FROM `strings` WHERE `value` = c.`to_file`),
+    c.`declaration_start_line`, c.`declaration_start_column`, c.`declaration_end_line`, c.`declaration_end_column`
+    FROM `cachedmethodcalls` c;
+DROP TABLE `cachedmethodcalls`;
+ALTER TABLE `cachedmethodcalls_new` RENAME TO `cachedmethodcalls`;
+
+CREATE VIEW `methodcalls` AS SELECT m.`id`, m.`review_id`, f.`value` AS `from_file`,
+    m.`call_start_line`, m.`call_start_column`, m.`call_end_line`, m.`call_end_column`,
+    c.`value` AS `method_call`, s.`value` AS `short_method_qualifier`, q.`value` AS `full_method_qualifier`,
+    t.`value` AS `to_file`,
+    m.`declaration_start_line`, m.`declaration_start_column`, m.`declaration_end_line`, m.`declaration_end_column`
+    FROM `methodcallrows` m
+    LEFT JOIN `strings` f ON f.`id` = m.`from_file_id`
+    LEFT JOIN `strings` c ON c.`id` = m.`method_call_id`
+    LEFT JOIN `strings` s ON s.`id` = m.`short_method_qualifier_id`
+    LEFT JOIN `strings` q ON q.`id` = m.`full_method_qualifier_id`
+    LEFT JOIN `strings` t ON t.`id` = m.`to_file_id`;
+
+CREATE INDEX IF NOT EXISTS `methodcallrows_review_id` ON `methodcallrows` (`review_id`);
+CREATE INDEX IF NOT EXISTS `methodcallrows_review_id_to_file_id` ON `methodcallrows` (`review_id`, `to_file_id`);
+CREATE INDEX IF NOT EXISTS `methodcallrows_review_id_from_file_id` ON `methodcallrows` (`review_id`, `from_file_id`);
+CREATE INDEX IF NOT EXISTS `cachedmethodcalls_entry_id` ON `cachedmethodcalls` (`entry_id`);
+
+-- last time each review was opened, the garbage collection removes the data of the reviews
+-- not opened for a long time
+ALTER TABLE `reviews` ADD COLUMN `last_accessed` REAL;
+UPDATE `reviews` SET `last_accessed` = CAST(strftime('%s', 'now') AS REAL);
@@ -0,0 +1,68 @@
+-- call graph of each review, built from its method calls when they are stored (see
+-- callgraph.py): the methods called (declarations) with the number of their callers, the
+-- declaration of each method call, the calls between each pair of files and per-file totals
+CREATE TABLE IF NOT EXISTS `declarations` (
+    `id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+    `review_id` INTEGER,
+    `file_id` INTEGER,
+    `start_line` INTEGER,
+    `start_column` INTEGER,
+    `end_line` INTEGER,
+    `end_column` INTEGER,
+    `qualifier_id` INTEGER,
+    `calls` INTEGER,
+    `calling_files` INTEGER
+);
+CREATE TABLE IF NOT EXISTS `filecalls` (
+    `review_id` INTEGER,
+    `from_file_id` INTEGER,
+    `to_file_id` INTEGER,
+    `calls` INTEGER,
+    `declarations` INTEGER
+);
+CREATE TABLE IF NOT EXISTS `filestats` (
+    `review_id` INTEGER,
+    `file_id` INTEGER,
+    `calls_out` INTEGER,
+    `calls_in` INTEGER,
+    `called_files` INTEGER,
+    `calling_files` INTEGER,
+    `declarations` INTEGER,
+    `max_call_lines` INTEGER,
+    `max_declaration_lines` INTEGER
+);
+ALTER TABLE `methodcallrows` ADD COLUMN `declaration_id` INTEGER;
+
+CREATE INDEX IF NOT EXISTS `declarations_review_id_file_id_start_line` ON `declarations` (`review_id`, `file_id`, `start_line`);
+CREATE INDEX IF NOT EXISTS `filecalls_review_id_from_file_id` ON `filecalls` (`review_id`, `from_file_id`);
+CREATE INDEX IF NOT EXISTS `filecalls_review_id_to_file_id` ON `filecalls` (`review_id`, `to_file_id`);
+CREATE UNIQUE INDEX IF NOT EXISTS `filestats_review_id_file_id` ON `filestats` (`review_id`, `file_id`);
+CREATE INDEX IF NOT EXISTS `methodcallrows_declaration_id` ON `methodcallrows` (`declaration_id`);
+-- the calls in a range of lines of a file are found with a range scan
+DROP INDEX IF EXISTS `methodcallrows_review_id_from_file_id`;
+CREATE INDEX IF NOT EXISTS `methodcallrows_review_id_from_file_id_call_start_line` ON `methodcallrows` (`review_id`, `from_file_id`, `call_start_line`);
+
+-- call graph of the reviews processed before
+INSERT INTO `declarations` (`review_id`, `file_id`, `start_line`, `start_column`, `end_line`, `end_column`, `qualifier_id`, `calls`, `calling_files`)
+    SELECT `review_id`, `to_file_id`, `declaration_start_line`, `declaration_start_column`, `declaration_end_line`,
+    `declaration_end_column`, MIN(`full_method_qualifier_id`), COUNT(*), COUNT(DISTINCT `from_file_id`)
+    FROM `methodcallrows` GROUP BY `review_id`, `to_file_id`, `declaration_start_line`, `declaration_start_column`,
+    `declaration_end_line`, `declaration_end_column`;
+UPDATE `methodcallrows` SET `declaration_id` = (SELECT d.`id` FROM `declarations` d
+    WHERE d.`review_id` = `methodcallrows`.`review_id` AND d.`file_id` = `methodcallrows`.`to_file_id`
+    AND d.`start_line` = `methodcallrows`.`declaration_start_line` AND d.`start_column` = `methodcallrows`.`declaration_start_column`
+    AND d.`end_line` = `methodcallrows`.`declaration_end_line` AND d.`end_column` = `methodcallrows`.`declaration_end_column`);
+INSERT INTO `filecalls` (`review_id`, `from_file_id`, `to_file_id`, `calls`, `declarations`)
+    SELECT `review_id`, `from_file_id`, `to_file_id`, COUNT(*), COUNT(DISTINCT `declaration_id`)
+    FROM `methodcallrows` GROUP BY `review_id`, `from_file_id`, `to_file_id`;
+INSERT INTO `filestats` (`review_id`, `file_id`, `calls_out`, `calls_in`, `called_files`, `calling_files`, `declarations`,
+    `max_call_lines`, `max_declaration_lines`)
+    SELECT f.`review_id`, f.`file_id`,
+    (SELECT COALESCE(SUM(`calls`), 0) FROM `filecalls` WHERE `review_id` = f.`review_id` AND `from_file_id` = f.`file_id`),
+    (SELECT COALESCE(SUM(`calls`), 0) FROM `filecalls` WHERE `review_id` = f.`review_id` AND `to_file_id` = f.`file_id`),
+    (SELECT COUNT(*) FROM `filecalls` WHERE `review_id` = f.`review_id` AND `from_file_id` = f.`file_id`),
+    (SELECT COUNT(*) FROM `filecalls` WHERE `review_id` = f.`review_id` AND `to_file_id` = f.`file_id`),
+    (SELECT COUNT(*) FROM `declarations` WHERE `review_id` = f.`review_id` AND `file_id` = f.`file_id`),
+    (SELECT COALESCE(MAX(`call_end_line` - `call_start_line`), 0) FROM `methodcallrows` WHERE `review_id` = f.`review_id` AND `from_file_id` = f.`file_id`),
+    (SELECT COALESCE(MAX(`end_line` - `start_line`), 0) FROM `declarations` WHERE `review_id` = f.`review_id` AND `file_id` = f.`file_id`)
+    FROM (SELECT `review_id`, `from_file_id` AS `file_id` FROM `filecalls` UNION SELECT `review_id`, `to_file_id` FROM `filecalls`) f;
@@ -0,0 +1,4 @@
+-- the finished jobs are removed by the garbage collection once they are older than
+-- JOB_RETENTION, and the waiting times are computed over the jobs started recently
+CREATE INDEX IF NOT EXISTS `jobs_started_at` ON `jobs` (`started_at`, `stage`);
+CREATE INDEX IF NOT EXISTS `jobs_finished_at` ON `jobs` (`finished_at`);
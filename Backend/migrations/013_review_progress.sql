@@ -0,0 +1,3 @@
+-- last stage and progress counters published for a review being processed, as JSON. the
+-- event streams poll it, so they follow the reviews processed by other processes too
+ALTER TABLE `reviews` ADD COLUMN `progress` TEXT;
@@ -0,0 +1,31 @@
+import argparse
+import json
+import logging
+import sys
+
+# queue the reviews of pull requests at background priority, so that they are ready when the
+# reviewers open them. the jobs are run by the workers of the backend or of worker.py:
+#   python prefetch.py https://github.com/user/repo/pull/1 https://github.com/user/repo/pull/2
+#   python prefetch.py --repository user/repo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prefetch the reviews of pull requests in the background')
+    parser.add_argument('pull_requests', nargs='*', metavar='pull_request_url')
+    parser.add_argument('--repository', help='prefetch all the open pull requests of a repository (user/repo)')
+    args = parser.parse_args()
+    if not args.pull_requests and not args.repository:
+        parser.error('no pull requests given')
+    logging.basicConfig(level=logging.INFO)
+
+    import db
+    import main
+    db.migrate()
+    try:
+        pulls, commits = main.prefetch_targets(args.pull_requests, args.repository)
+    except ValueError as e:
+        parser.error(str(e))
+    result = main.prefetch_reviews(pulls, commits)
+    print(json.dumps(result, indent=2))
+    if any('error' in review for review in result.values()):
+        sys.exit(1)
@@ -0,0 +1,138 @@
+import logging
+import os
+import subprocess
+import time
+
+# acquisition of the repositories to review. clones are partial (blobless): the whole history
+# of commits and trees is downloaded, the file contents only when a checkout or a read needs
+# them. fetches only ask for the commits that are missing locally, and forks can borrow the
+# objects of an already cloned upstream repository through git alternates, so an upstream
+# clone cannot be removed while the clone of one of its forks exists
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_CLONE_FILTER = 'blob:none'
+# paths passed to a single git command
+PATHS_PER_COMMAND = 500
+
+
+# size in bytes of the objects stored in a repository, not counting the ones borrowed
+# from its alternates
+def objects_size(repo_folder):
+    s = subprocess.run(['git', 'count-objects', '-v'], cwd=repo_folder, stdout=subprocess.PIPE, universal_newlines=True)
+    if s.returncode != 0:
+        return 0
+    counts = dict(line.split(': ', 1) for line in s.stdout.splitlines() if ': ' in line)
+    # sizes are given in KiB
+    return (int(counts.get('size', 0)) + int(counts.get('size-pack', 0))) * 1024
+
+
+# size in bytes of a folder on disk (e.g. a clone, with its working tree)
+def disk_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+# folders of the repositories whose objects a repository borrows through git alternates
+def alternates(repo_folder):
+    try:
+        with open(os.path.join(repo_folder, '.git', 'objects', 'info', 'alternates')) as alternates_file:
+            lines = alternates_file.read().splitlines()
+    except FileNotFoundError:
+        return []
+    folders = []
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        objects_folder = os.path.normpath(os.path.join(repo_folder, '.git', 'objects', line))
+        # <repository>/.git/objects, or <repository>/objects for a bare repository
+        folder = os.path.dirname(objects_folder)
+        if os.path.basename(folder) == '.git':
+            folder = os.path.dirname(folder)
+        folders.append(folder)
+    return folders
+
+
+# environment of the git commands that must not fetch the missing objects on demand
+def _no_lazy_fetch():
+    return dict(os.environ, GIT_NO_LAZY_FETCH='1')
+
+
+# check if a commit is available locally. in a partial clone git would fetch a missing
+# object on demand, which is disabled here so that fetches are done (and measured) explicitly
+def has_commit(repo_folder, sha):
+    s = subprocess.run(['git', 'cat-file', '-e', '{}^{{commit}}'.format(sha)], cwd=repo_folder,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=_no_lazy_fetch())
+    return s.returncode == 0
+
+
+# clone a repository into repo_folder. `reference` is the folder of a clone of a repository
+# sharing its history (e.g. the upstream of a fork), whose objects are not downloaded again.
+# returns the bytes downloaded and the duration of the clone in seconds
+def clone(url, repo_folder, reference=None):
+    started = time.monotonic()
+    command = ['git', 'clone', '-q', '--filter={}'.format(PARTIAL_CLONE_FILTER)]
+    if reference:
+        command += ['--reference-if-able', reference]
+    s = subprocess.run(command + [url, repo_folder], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if s.returncode != 0:
+        raise RuntimeError('git clone {} failed with code {}: {}'.format(url, s.returncode, s.stdout.strip()))
+    return objects_size(repo_folder), time.monotonic() - started
+
+
+# make sure that the given commits are available in a repository, fetching only the missing
+# ones. returns the bytes downloaded and the duration of the fetch in seconds, or None if
+# nothing had to be fetched
+def fetch_commits(repo_folder, shas):
+    missing = [sha for sha in shas if not has_commit(repo_folder, sha)]
+    if not missing:
+        return None
+    started = time.monotonic()
+    size = objects_size(repo_folder)
+    logger.info('Fetching {} missing commits in {}'.format(len(missing), repo_folder))
+    s = subprocess.run(['git', 'fetch', '-q', 'origin'] + missing, cwd=repo_folder)
+    if s.returncode != 0:
+        # the server does not allow fetching commits by id, fetch all the branches instead
+        logger.info('Fetching commits by id failed, fetching all the branches of {}'.format(repo_folder))
+        subprocess.run(['git', 'fetch', '-q', 'origin'], cwd=repo_folder)
+    for sha in missing:
+        if not has_commit(repo_folder, sha):
+            raise RuntimeError('Commit {} not found in {}'.format(sha, repo_folder))
+    return objects_size(repo_folder) - size, time.monotonic() - started
+
+
+# make sure that the contents of some files at a commit are available in a repository. in a
+# partial clone each read of a missing file would fetch it on its own, here the missing ones
+# are fetched with a single request. returns the bytes downloaded and the duration of the fetch
+# in seconds, or None if nothing was fetched. if the fetch fails the files are left to be
+# fetched on demand
+def fetch_blobs(repo_folder, sha, paths):
+    missing = set()
+    for start in range(0, len(paths), PATHS_PER_COMMAND):
+        # the objects of the files, with the missing ones printed as ?<object>
+        s = subprocess.run(['git', '--literal-pathspecs', 'rev-list', '--objects', '--no-walk', '--missing=print', sha, '--']
+                           + paths[start:start + PATHS_PER_COMMAND], cwd=repo_folder, stdout=subprocess.PIPE,
+                           universal_newlines=True, env=_no_lazy_fetch())
+        if s.returncode != 0:
+            raise RuntimeError('Cannot list the files of commit {} in {}'.format(sha, repo_folder))
+        missing.update(line[1:] for line in s.stdout.splitlines() if line.startswith('?'))
+    if not missing:
+        return None
+    missing = sorted(missing)
+    started = time.monotonic()
+    size = objects_size(repo_folder)
+    logger.info('Fetching {} missing files in {}'.format(len(missing), repo_folder))
+    # the same request git makes to fetch a missing object on demand, for all of them
+    s = subprocess.run(['git', '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', '-q', 'origin', '--no-tags',
+                        '--no-write-fetch-head', '--recurse-submodules=no', '--filter={}'.format(PARTIAL_CLONE_FILTER), '--stdin'],
+                       cwd=repo_folder, input='\n'.join(missing) + '\n', universal_newlines=True)
+    if s.returncode != 0:
+        logger.warning('Fetching {} files in {} failed with code {}'.format(len(missing), repo_folder, s.returncode))
+        return None
+    return objects_size(repo_folder) - size, time.monotonic() - started
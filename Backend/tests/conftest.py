@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# the backend modules are imported as top-level modules, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def git(folder, *args):
+    return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                          cwd=folder, check=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
+
+
+# write some files (path: contents) in a repository and commit them. returns the commit sha
+def commit_files(folder, files, message='commit'):
+    for path, contents in files.items():
+        full_path = os.path.join(folder, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(contents)
+    git(folder, 'add', '-A')
+    git(folder, 'commit', '-q', '-m', message)
+    return git(folder, 'rev-parse', 'HEAD').strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    folder = str(tmp_path / 'repo')
+    os.makedirs(folder)
+    git(folder, 'init', '-q')
+    return folder
+
+
+# empty database with the current schema, used by the db module for the duration of a test
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    import config
+    import db
+
+    def close_connections():
+        while not db._idle.empty():
+            db._idle.get_nowait().close()
+
+    close_connections()
+    monkeypatch.setattr(config, 'DATABASE', str(tmp_path / 'test.db'))
+    db.migrate()
+    yield
+    close_connections()
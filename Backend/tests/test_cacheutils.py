@@ -0,0 +1,38 @@
+import os
+import time
+
+import cacheutils
+import filecache
+
+
+def test_lru_trim():
+    entries = [('a', 30), ('b', 30), ('c', 30), ('d', 30)]
+    # trimmed to TRIM_RATIO of the limit, the least recently used first
+    assert cacheutils.lru_trim(entries, 120, 100) == (['a'], 90)
+    assert cacheutils.lru_trim(entries, 120, 60) == (['a', 'b', 'c'], 30)
+    assert cacheutils.lru_trim(entries, 50, 100) == ([], 50)
+
+
+def test_write_atomic(tmp_path):
+    path = str(tmp_path / 'a' / 'b' / 'entry')
+    cacheutils.write_atomic(path, b'first')
+    cacheutils.write_atomic(path, b'second')
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+    # no temporary file is left behind
+    assert os.listdir(os.path.dirname(path)) == ['entry']
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = filecache.FileCache(str(tmp_path / 'cache'), max_bytes=10 ** 6)
+    keys = [cache.put(str(i) * 10000) for i in range(5)]
+    sizes = {key: os.path.getsize(cache._path(key)) for key in keys}
+    for i, key in enumerate(keys):
+        os.utime(cache._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    # the first entry is used again, so the second one is the least recently used
+    assert cache.get(keys[0]) == '0' * 10000
+    cache.max_bytes = sum(sizes.values()) - 1
+    cache.put('x' * 10000)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.total_bytes <= cache.max_bytes * cacheutils.TRIM_RATIO
@@ -0,0 +1,31 @@
+import io
+
+from conftest import commit_files, git
+
+import diffutils
+
+
+def test_paths_with_spaces_and_quotes(repo):
+    commit_files(repo, {'src/With Space.java': 'class A {}\n', 'src/Tést.java': 'class B {}\n', 'src/Plain.java': 'class C {}\n'})
+    commit_files(repo, {'src/With Space.java': 'class A { int x; }\n', 'src/Tést.java': 'class B { int y; }\n',
+                        'src/Plain.java': 'class C { int z; }\n'})
+    diff = git(repo, 'diff', 'HEAD~1', 'HEAD')
+    # git ends the ---/+++ paths containing spaces with a tab and quotes the non-ascii ones
+    assert '+++ b/src/With Space.java\t\n' in diff
+    assert '"b/src/T\\303\\251st.java"' in diff
+
+    expected = [('src/Plain.java', 'src/Plain.java'), ('src/Tést.java', 'src/Tést.java'),
+                ('src/With Space.java', 'src/With Space.java')]
+    patches = diffutils.parse_diff(diff)
+    assert sorted((patch.old_path, patch.new_path) for patch in patches) == expected
+    scanned = diffutils.scan_diff(io.BytesIO(diff.encode('utf-8')))
+    assert sorted((patch.old_path, patch.new_path) for patch in scanned) == expected
+
+
+def test_new_and_deleted_files_with_spaces(repo):
+    commit_files(repo, {'src/Old File.java': 'class A {}\n'})
+    git(repo, 'rm', '-q', 'src/Old File.java')
+    commit_files(repo, {'src/New File.java': 'class B {}\n'})
+    patches = {(patch.old_path, patch.new_path): patch for patch in diffutils.parse_diff(git(repo, 'diff', 'HEAD~1', 'HEAD'))}
+    assert patches[('src/Old File.java', 'src/Old File.java')].deleted_file
+    assert patches[('src/New File.java', 'src/New File.java')].new_file
@@ -0,0 +1,23 @@
+import db
+import events
+
+
+def test_progress_is_shared_through_the_db(database):
+    with db.connection() as conn:
+        review_id = conn.execute('INSERT INTO reviews (status) VALUES ("processing")').lastrowid
+    # two processes: the worker publishing, the application streaming the events
+    worker, application = events.ReviewEvents(), events.ReviewEvents()
+    subscriber = application.subscribe(review_id)
+
+    worker.publish(review_id, 'diff_downloaded', files=3)
+    events.ReviewEvents().publish(review_id, 'extracting', calls=10)
+    with db.connection() as conn:
+        assert events.stored_state(conn, review_id) == {'stage': 'extracting', 'files': 3, 'calls': 10}
+    assert subscriber.empty()
+
+    # the subscribers in the process publishing get the events right away
+    application.publish(review_id, 'ready')
+    assert subscriber.get_nowait() == {'stage': 'ready', 'files': 3, 'calls': 10}
+    with db.connection() as conn:
+        assert events.stored_state(conn, review_id) is None
+    application.unsubscribe(review_id, subscriber)
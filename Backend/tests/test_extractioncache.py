@@ -0,0 +1,39 @@
+import extractioncache
+
+REPOSITORY = '''package shop;
+
+public class Repository {
+    public void save(int id) {
+    }
+}
+'''
+
+BASE = '''package shop;
+
+public class Base {
+    protected void helper() {
+    }
+}
+'''
+
+
+def keys(files, target):
+    return extractioncache.ExtractionCache(1000).keys(1, 'base', files, [target])[target]
+
+
+# two reviews with the same target, differing only in a file calling into it without naming
+# its type, must not share the cached method calls of the target
+def test_callers_not_naming_the_type_are_part_of_the_key():
+    for before, after in [('f.repo().save(1);', 'f.repo().save(2);'),
+                          ('var r = f.repo(); r.save(1);', 'var r = f.repo(); r.save(2);')]:
+        caller = 'class A {{ void run(Factory f) {{ {} }} }}'
+        assert keys({'Repository.java': REPOSITORY, 'A.java': caller.format(before)}, 'Repository.java') != \
+            keys({'Repository.java': REPOSITORY, 'A.java': caller.format(after)}, 'Repository.java')
+    leaf = 'class Leaf extends Mid {{ void run() {{ {} }} }}'
+    assert keys({'Base.java': BASE, 'Leaf.java': leaf.format('helper();')}, 'Base.java') != \
+        keys({'Base.java': BASE, 'Leaf.java': leaf.format('int a; helper();')}, 'Base.java')
+
+
+def test_unrelated_files_are_not_part_of_the_key():
+    assert keys({'Repository.java': REPOSITORY, 'A.java': 'class A { void run() { other(); } }'}, 'Repository.java') == \
+        keys({'Repository.java': REPOSITORY, 'A.java': 'class A { void run() { other(1); } }'}, 'Repository.java')
@@ -0,0 +1,170 @@
+import email.utils
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import github
+
+graphql_field_regex = re.compile(r'p(\d+): repository\(owner: "([^"]*)", name: "([^"]*)"\) \{ pullRequest\(number: (\d+)\)')
+
+
+# local stand-in for github. `respond` is called with each request (method, path, headers,
+# body) and returns a tuple (status, headers, body), the requests are recorded in `requests`
+class StubGitHub:
+    def __init__(self):
+        self.requests = []
+        self.respond = lambda request: (404, {}, None)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = (self.command, self.path, dict(self.headers), self.rfile.read(length) if length else None)
+                stub.requests.append(request)
+                status, headers, body = stub.respond(request)
+                data = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = StubGitHub()
+    yield stub
+    stub.close()
+
+
+# the waits of the client are recorded instead of slept
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(github.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def make_client(stub, tmp_path):
+    return github.GitHubClient(stub.url, stub.url, cache_dir=str(tmp_path / 'cache'))
+
+
+def cache_files(tmp_path):
+    files = {}
+    for folder, _, names in os.walk(str(tmp_path / 'cache')):
+        for name in names:
+            path = os.path.join(folder, name)
+            files[path] = os.stat(path).st_mtime_ns
+    return files
+
+
+def test_etag_revalidation(stub, tmp_path):
+    def respond(request):
+        if request[2].get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, None
+        return 200, {'ETag': '"v1"'}, {'number': 1}
+    stub.respond = respond
+    client = make_client(stub, tmp_path)
+
+    assert client.get_pull_request('u', 'r', 1) == {'number': 1}
+    written = cache_files(tmp_path)
+    assert len(written) == 1
+    assert client.get_pull_request('u', 'r', 1) == {'number': 1}
+    assert stub.requests[1][2]['If-None-Match'] == '"v1"'
+    assert client.not_modified == 1
+    # the cached entry is not written again
+    assert cache_files(tmp_path) == written
+
+
+def test_retry_after_seconds(stub, tmp_path, sleeps):
+    responses = [(403, {'Retry-After': '7'}, {'message': 'secondary rate limit'}), (200, {}, {'id': 1})]
+    stub.respond = lambda request: responses.pop(0)
+
+    assert make_client(stub, tmp_path).get_repository('u', 'r') == {'id': 1}
+    assert len(stub.requests) == 2
+    assert len(sleeps) == 1 and 6 <= sleeps[0] <= 7
+
+
+def test_retry_after_http_date(stub, tmp_path, sleeps):
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+    responses = [(429, {'Retry-After': retry_at}, None), (200, {}, {'id': 1})]
+    stub.respond = lambda request: responses.pop(0)
+
+    assert make_client(stub, tmp_path).get_repository('u', 'r') == {'id': 1}
+    assert len(sleeps) == 1 and 27 <= sleeps[0] <= 30
+
+
+def test_rate_limit_exhausted(stub, tmp_path, sleeps):
+    reset = str(int(time.time()) + 20)
+    responses = [(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}, {'id': 1}),
+                 (403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}, {'message': 'rate limit'}),
+                 (200, {'X-RateLimit-Remaining': '4999', 'X-RateLimit-Reset': reset}, {'id': 2})]
+    stub.respond = lambda request: responses.pop(0)
+    client = make_client(stub, tmp_path)
+
+    assert client.get_repository('u', 'r') == {'id': 1}
+    assert sleeps == []
+    # the next request waits for the reset before being sent, and after being rejected
+    assert client.get_repository('u', 'other') == {'id': 2}
+    assert len(sleeps) == 2 and all(17 <= delay <= 20 for delay in sleeps)
+
+
+def test_server_errors_are_retried(stub, tmp_path, sleeps):
+    responses = [(502, {}, None), (503, {}, None), (200, {}, {'id': 1})]
+    stub.respond = lambda request: responses.pop(0)
+
+    assert make_client(stub, tmp_path).get_repository('u', 'r') == {'id': 1}
+    assert sleeps == [1, 2]
+
+
+def test_server_errors_give_up(stub, tmp_path, sleeps):
+    stub.respond = lambda request: (500, {}, None)
+
+    with pytest.raises(github.GitHubError) as error:
+        make_client(stub, tmp_path).get_repository('u', 'r')
+    assert error.value.status_code == 500
+    assert len(stub.requests) == github.MAX_ATTEMPTS
+
+
+def test_graphql_batches(stub, tmp_path):
+    def respond(request):
+        data = {}
+        for i, user, repo, number in graphql_field_regex.findall(json.loads(request[3])['query']):
+            if repo == 'missing':
+                data['p' + i] = None
+            elif int(number) % 7 == 0:
+                data['p' + i] = {'pullRequest': None}
+            else:
+                data['p' + i] = {'pullRequest': {'baseRefOid': 'base' + number, 'headRefOid': 'head' + number}}
+        return 200, {}, {'data': data}
+    stub.respond = respond
+    pulls = [('u', 'r', str(number)) for number in range(1, 2 * github.GRAPHQL_BATCH_SIZE + 11)] + [('u', 'missing', '1')]
+
+    result = make_client(stub, tmp_path).get_pull_request_commits(pulls)
+    assert len(stub.requests) == 3
+    assert all(request[:2] == ('POST', '/graphql') for request in stub.requests)
+    assert set(result) == set(pulls)
+    for user, repo, number in pulls:
+        if repo == 'missing' or int(number) % 7 == 0:
+            assert result[(user, repo, number)] is None
+        else:
+            assert result[(user, repo, number)] == ('base' + number, 'head' + number)
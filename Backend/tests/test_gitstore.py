@@ -0,0 +1,36 @@
+from conftest import commit_files
+
+import gitstore
+
+
+def test_read_blob(repo):
+    sha = commit_files(repo, {'src/A.java': 'class A {}\n'})
+    store = gitstore.ObjectStore(repo)
+    try:
+        oid, data = store.read(sha, 'src/A.java')
+    finally:
+        store.close()
+    assert data == b'class A {}\n'
+    assert oid == gitstore.blob_hash(data)
+
+
+def test_missing_paths(repo):
+    sha = commit_files(repo, {'src/With Space.java': 'class A {}\n'})
+    store = gitstore.ObjectStore(repo)
+    try:
+        # git answers "<name> missing", which has three fields for a name with a space
+        assert store.read(sha, 'src/Missing File.java') is None
+        assert store.read(sha, 'src/Missing.java') is None
+        # the process is still usable after a missing path
+        assert store.read(sha, 'src/With Space.java')[1] == b'class A {}\n'
+    finally:
+        store.close()
+
+
+def test_tree_is_not_a_blob(repo):
+    sha = commit_files(repo, {'src/A.java': 'class A {}\n'})
+    store = gitstore.ObjectStore(repo)
+    try:
+        assert store.read(sha, 'src') is None
+    finally:
+        store.close()
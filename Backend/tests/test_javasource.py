@@ -0,0 +1,159 @@
+import javasource
+
+ORDER = '''package shop;
+
+import java.util.List;
+
+public class Order {
+    private final List<Item> items;
+
+    public Order(List<Item> items) {
+        this.items = items;
+    }
+
+    public Item get(int i) {
+        return items.get(i);
+    }
+
+    public int total() {
+        int total = 0;
+        for (Item item : items) total += item.price();
+        return total;
+    }
+
+    @Override
+    public String toString() {
+        return "Order " + items.toString();
+    }
+
+    @Override
+    public boolean equals(Object other) {
+        return other instanceof Order && items.equals(((Order) other).items);
+    }
+}
+'''
+
+ITEM = '''package shop;
+
+public class Item {
+    private final int price;
+
+    public Item(int price) {
+        this.price = price;
+    }
+
+    public int price() {
+        return price;
+    }
+
+    public Item get() {
+        return this;
+    }
+
+    @Override
+    public String toString() {
+        return "Item " + price;
+    }
+}
+'''
+
+CUSTOMER = '''package shop.customers;
+
+import java.util.Map;
+
+public class Customer {
+    private final Map<String, String> details;
+
+    public Customer(Map<String, String> details) {
+        this.details = details;
+    }
+
+    public String get(String key) {
+        return details.get(key);
+    }
+
+    @Override
+    public String toString() {
+        return "Customer " + details.get("name");
+    }
+
+    @Override
+    public boolean equals(Object other) {
+        return other instanceof Customer && details.equals(((Customer) other).details);
+    }
+}
+'''
+
+
+REPOSITORY = '''package shop;
+
+public class Repository {
+    public Repository() {
+    }
+
+    public void save(int id) {
+        log(id);
+    }
+
+    private void log(int id) {
+    }
+}
+'''
+
+FACTORY = '''package shop;
+
+public class Factory {
+    public Repository repo() {
+        return new Repository();
+    }
+}
+'''
+
+BASE = '''package shop;
+
+public class Base {
+    protected void helper() {
+    }
+}
+'''
+
+# callers that never name the type declaring the method they call
+CHAINED_CALLER = 'class A { void run(Factory f) { f.repo().save(1); } }'
+VAR_CALLER = 'class B { void run(Factory f) { var r = f.repo(); r.save(2); } }'
+INHERITED_CALLER = 'class Leaf extends Mid { void run() { helper(); } }'
+
+
+def test_callable_method_names():
+    assert javasource.callable_method_names(ORDER) >= {'get', 'total', 'toString', 'equals'}
+    # constructors are not method calls, private methods cannot be called from other files
+    assert javasource.callable_method_names(REPOSITORY) == {'save'}
+    assert 'Repository' in javasource.declared_method_names(REPOSITORY)
+    assert 'log' in javasource.declared_method_names(REPOSITORY)
+    # a name declared both private and not private is kept
+    assert javasource.callable_method_names('class C { private void f(int a) {} public void f() {} }') == {'f'}
+
+
+def test_callers_not_naming_the_declaring_type():
+    for caller in (CHAINED_CALLER, VAR_CALLER):
+        assert javasource.affected_files({'Repository.java': REPOSITORY, 'Factory.java': FACTORY}, [caller]) == \
+            ['Repository.java', 'Factory.java']
+    assert javasource.affected_files({'Base.java': BASE}, [INHERITED_CALLER]) == ['Base.java']
+
+
+def test_fixup_affects_a_superset_of_the_callees():
+    # a one-line fixup in Order, which calls get (declared by Customer too) and price
+    fixed_order = ORDER.replace('return "Order " + items.toString();', 'return "Order of " + items.size() + " items";')
+    affected = javasource.affected_files({'Item.java': ITEM, 'Customer.java': CUSTOMER, 'Repository.java': REPOSITORY},
+                                         [ORDER, fixed_order])
+    assert affected == ['Item.java', 'Customer.java']
+
+
+def test_private_methods_and_constructors_are_not_called_from_other_files():
+    caller = 'class A { void run() { Repository r = new Repository(); log(1); } }'
+    assert javasource.affected_files({'Repository.java': REPOSITORY}, [caller]) == []
+
+
+def test_references_any():
+    assert javasource.references_any('int p = product.price();', {'price'})
+    assert not javasource.references_any('int price = 3;', {'price'})
+    assert not javasource.references_any('foo();', set())
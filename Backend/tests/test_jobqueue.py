@@ -0,0 +1,83 @@
+import threading
+import time
+
+import db
+import jobqueue
+
+
+def make_queue():
+    return jobqueue.SQLiteJobQueue(lease_time=60, max_attempts=3, max_background_jobs=1)
+
+
+def run(queue, stage='git'):
+    job = queue.claim([stage], 'test')
+    queue.complete(job.id, job.lease_owner)
+    return job
+
+
+def test_purge_finished_jobs(database):
+    queue = make_queue()
+    queue.enqueue('a', [], 'git')
+    run(queue)
+    failed = queue.enqueue('b', [], 'git')
+    job = queue.claim(['git'], 'test')
+    queue.fail(job.id, job.lease_owner, 'error')
+    queue.enqueue('c', [], 'git', depends_on=[failed])
+    pending = queue.enqueue('d', [], 'git')
+
+    # jobs finished after the cutoff are kept
+    assert queue.purge(time.time() - 3600) == 0
+    assert queue.purge(time.time() + 1) == 3
+    with db.connection() as conn:
+        assert [row[0] for row in conn.execute('SELECT id FROM jobs')] == [pending]
+        assert conn.execute('SELECT COUNT(*) FROM jobdependencies').fetchone()[0] == 0
+
+
+def test_purge_keeps_dependencies_of_unfinished_jobs(database):
+    queue = make_queue()
+    clone = queue.enqueue('clone', [], 'git')
+    run(queue)
+    fetch = queue.enqueue('fetch', [], 'network', depends_on=[clone])
+
+    assert queue.purge(time.time() + 1) == 0
+    # the dependent job can still run once the dependency is purged
+    assert run(queue, 'network').id == fetch
+    assert queue.purge(time.time() + 1) == 2
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM jobdependencies').fetchone()[0] == 0
+
+
+def test_stats_use_recent_jobs(database):
+    queue = make_queue()
+    queue.enqueue('a', [], 'git')
+    run(queue)
+    queue.enqueue('b', [], 'git', priority=jobqueue.BACKGROUND)
+    stats = queue.get_stats()['git']
+    assert stats['done'] == 1
+    assert stats['pending_background'] == 1
+    assert stats['max_wait'] >= 0
+    with db.connection() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT stage, AVG(started_at - created_at) FROM jobs WHERE started_at >= ? GROUP BY stage', (0, )))
+    assert 'jobs_started_at' in plan
+
+
+def test_concurrent_enqueues_are_deduplicated(database):
+    queue = make_queue()
+    barrier = threading.Barrier(8)
+    job_ids = []
+
+    def enqueue():
+        barrier.wait()
+        for i in range(20):
+            job_ids.append(queue.enqueue('clone', [], 'network', dedup_key='clone:{}'.format(i)))
+
+    threads = [threading.Thread(target=enqueue) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(job_ids)) == 20
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] == 20
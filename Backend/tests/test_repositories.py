@@ -0,0 +1,30 @@
+import os
+import subprocess
+
+import repositories
+from conftest import commit_files, git
+
+
+def has_blob(folder, sha, path):
+    s = subprocess.run(['git', 'cat-file', '-e', '{}:{}'.format(sha, path)], cwd=folder, stderr=subprocess.DEVNULL,
+                       env=dict(os.environ, GIT_NO_LAZY_FETCH='1'))
+    return s.returncode == 0
+
+
+def test_fetch_blobs(repo, tmp_path):
+    git(repo, 'config', 'uploadpack.allowFilter', 'true')
+    git(repo, 'config', 'uploadpack.allowAnySHA1InWant', 'true')
+    sha = commit_files(repo, {'src/A.java': 'class A {}', 'src/with space/B.java': 'class B {}', 'C.java': 'class C {}'})
+    # the clone checks out the files of the last commit only
+    commit_files(repo, {'src/A.java': 'class A { }', 'src/with space/B.java': 'class B { }', 'C.java': 'class C { }'})
+    clone = str(tmp_path / 'clone')
+    repositories.clone('file://' + repo, clone)
+    paths = ['src/A.java', 'src/with space/B.java', 'src/Missing.java']
+    assert not any(has_blob(clone, sha, path) for path in paths[:2])
+
+    transfer = repositories.fetch_blobs(clone, sha, paths)
+    assert transfer is not None
+    assert all(has_blob(clone, sha, path) for path in paths[:2])
+    # only the requested files are fetched, and only once
+    assert not has_blob(clone, sha, 'C.java')
+    assert repositories.fetch_blobs(clone, sha, paths) is None
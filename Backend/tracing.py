@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import db
+
+# lightweight instrumentation of the backend. the stages of the processing of a review are
+# timed with `span`, which keeps a histogram of their durations and stores them in the
+# review_timings table. the metrics are served in the Prometheus text format by /metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # by label values: counts of each bucket (plus +Inf), sum of the observed values
+        self.counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.counts[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[key] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            for key, counts in sorted(self.counts.items()):
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(self.name, _format_labels(dict(labels, le=bound)), cumulative))
+                lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), self.sums[key]))
+                lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    # add a metric whose values are read when the metrics are rendered. `collect` returns a
+    # number, or a list of tuples (labels, value)
+    def collector(self, name, metric_type, help, collect):
+        self.collectors.append((name, metric_type, help, collect))
+
+    # all the metrics in the Prometheus text format
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines += histogram.render()
+        for name, metric_type, help, collect in self.collectors:
+            try:
+                values = collect()
+            except Exception:
+                logger.exception('Cannot collect metric {}'.format(name))
+                continue
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            if not isinstance(values, list):
+                values = [({}, values)]
+            for labels, value in values:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_durations = registry.histogram('review_stage_duration_seconds', 'Duration of the stages of the processing of the reviews')
+
+
+# time a stage. the duration is recorded in the histogram of the stage, and in the
+# review_timings table if the stage belongs to a review
+@contextmanager
+def span(stage, review_id=None):
+    started_at = time.time()
+    start = time.monotonic()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        duration = time.monotonic() - start
+        stage_durations.observe(duration, stage=stage)
+        if review_id is not None:
+            try:
+                with db.connection() as conn:
+                    conn.execute('INSERT INTO review_timings (review_id, stage, started_at, duration, succeeded) VALUES (?, ?, ?, ?, ?)',
+                        (review_id, stage, started_at, duration, succeeded))
+            except Exception:
+                logger.exception('Cannot store the timing of stage {} of review {}'.format(stage, review_id))
@@ -0,0 +1,122 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+import config
+import jobqueue
+
+# workers running the jobs of the job queue. each stage (e.g. network, git, JVM) has its own
+# threads, so slow downloads do not hold the threads running the extractor and vice versa.
+# the workers run inside the backend by default, and can be started as standalone processes
+# on any host sharing the database:
+#   python worker.py [--stages network,git,jvm]
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    # `handlers` maps the kinds of jobs to the functions running them, `threads` maps each
+    # stage to its number of threads. `on_failure(job, error)` is called for each failed job
+    def __init__(self, queue, handlers, threads, on_failure=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.threads = threads
+        self.on_failure = on_failure
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.running = {}
+        self.running_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        for stage, count in self.threads.items():
+            for i in range(count):
+                threading.Thread(target=self._work, args=(stage, ), name='{}-worker-{}'.format(stage, i), daemon=True).start()
+        threading.Thread(target=self._heartbeat, name='worker-heartbeat', daemon=True).start()
+        logger.info('Worker {} started with threads {}'.format(self.name, self.threads))
+
+    def stop(self):
+        self.stopped.set()
+        self.queue.notify()
+
+    def _work(self, stage):
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.claim([stage], self.name)
+            except Exception:
+                logger.exception('Cannot claim jobs')
+                job = None
+            if job is None:
+                self.queue.wait(config.JOB_POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        with self.running_lock:
+            self.running[job.id] = job
+        try:
+            handler = self.handlers[job.kind]
+            handler(*job.args)
+        except Exception as e:
+            logger.error('Job {} {}{} failed: {}\n{}'.format(job.id, job.kind, tuple(job.args), e, traceback.format_exc()))
+            self._failed(self.queue.fail(job.id, job.lease_owner, e), e)
+        else:
+            self.queue.complete(job.id, job.lease_owner)
+        finally:
+            with self.running_lock:
+                del self.running[job.id]
+
+    def _failed(self, jobs, error):
+        for job in jobs:
+            if self.on_failure:
+                try:
+                    self.on_failure(job, error)
+                except Exception:
+                    logger.exception('Cannot handle the failure of job {}'.format(job.id))
+
+    # renew the leases of the running jobs, and fail the jobs whose leases expired too many times
+    def _heartbeat(self):
+        while not self.stopped.wait(config.JOB_LEASE_TIME / 3):
+            with self.running_lock:
+                running = list(self.running.values())
+            try:
+                for job in running:
+                    if not self.queue.heartbeat(job.id, job.lease_owner):
+                        logger.warning('Lease of job {} lost, it will be run again'.format(job.id))
+                self._failed(self.queue.reap(), 'lease expired')
+            except Exception:
+                logger.exception('Cannot renew the leases of the running jobs')
+
+
+# threads of each stage as configured
+def configured_threads(stages=None):
+    threads = {
+        'network': config.SCHEDULER_NETWORK_WORKERS,
+        'git': config.SCHEDULER_GIT_WORKERS,
+        'jvm': config.SCHEDULER_JVM_WORKERS,
+    }
+    if stages:
+        threads = {stage: count for stage, count in threads.items() if stage in stages}
+    return threads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the background jobs of the backend')
+    parser.add_argument('--stages', help='comma-separated stages to run (default: all)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    import db
+    import main
+    db.migrate()
+    worker = Worker(jobqueue.get_queue(), main.JOB_HANDLERS, configured_threads(args.stages and args.stages.split(',')),
+                    on_failure=main.job_failed)
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -9,20 +9,29 @@ import com.github.javaparser.ast.body.MethodDeclaration;
 import com.github.javaparser.ast.expr.MethodCallExpr;
 import com.github.javaparser.resolution.declarations.ResolvedMethodDeclaration;
 import com.github.javaparser.symbolsolver.JavaSymbolSolver;
+import com.github.javaparser.symbolsolver.model.resolution.TypeSolver;
 import com.github.javaparser.symbolsolver.javaparsermodel.declarations.JavaParserMethodDeclaration;
 import com.github.javaparser.symbolsolver.resolution.typesolvers.CombinedTypeSolver;
 import com.github.javaparser.symbolsolver.resolution.typesolvers.JavaParserTypeSolver;
 import com.github.javaparser.symbolsolver.resolution.typesolvers.ReflectionTypeSolver;
 
 import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
 import java.io.IOException;
+import java.io.InputStream;
 import java.io.InputStreamReader;
 import java.io.UncheckedIOException;
+import java.nio.charset.StandardCharsets;
 import java.nio.file.Files;
 import java.nio.file.Path;
 import java.util.*;
+import java.util.regex.Matcher;
+import java.util.regex.Pattern;
 
 public class MethodCallExtractor {
+    // Package declaration at the top of a Java file, the same one searched by extractPackageRoots
+    private static final Pattern PACKAGE_DECLARATION = Pattern.compile("^package \\w(.*?)\\w;$", Pattern.MULTILINE);
+
     private Path repository;
     private ArrayList<Path> modified_classes;
     private ArrayList<Path> possible_caller_classes;
@@ -169,20 +178,95 @@ public class MethodCallExtractor {
         new BufferedReader(new InputStreamReader(rg.getInputStream())).lines()
                 .forEach(line -> {
                     String[] splitLine =  line.split(":");
-                    // Get the path to the class, relative to the repository
-                    String java_class_string = splitLine[0];
-                    // Package identifier, e.g. org.example.myprogram
-                    String packageId = splitLine[3].substring(8, splitLine[3].length() - 1);
-                    int numberPackageParts = packageId.split("\\.").length;
-                    String[] pathParts = java_class_string.split("/");
-                    String packageRootPath = String.join("/", Arrays.copyOfRange(pathParts, 0, pathParts.length - numberPackageParts - 1));
-                    Path packageRoot = repository.resolve(packageRootPath);
-                    package_roots.add(packageRoot);
+                    // Get the path to the class, relative to the repository, and its package declaration
+                    package_roots.add(packageRoot(repository, splitLine[0], splitLine[3]));
                 });
         return package_roots;
     }
 
+    public Set<Path> extractPackageRoots(String revision) throws IOException {
+        // Same as extractPackageRoots, on the files of a revision instead of the working tree, which can have a diff
+        // applied. git grep prints each match as "revision:path\0declaration"
+        String[] searchCmd = {"git", "grep", "-z", "-E", "-e", "^package \\w.*\\w;$", revision, "--", "*.java"};
+        Set<Path> package_roots = new HashSet<>();
+        for (String line : runCommand(repository, searchCmd).split("\n")) {
+            int separator = line.indexOf('\0');
+            if (separator < 0) continue;
+            String java_class_string = line.substring(revision.length() + 1, separator);
+            package_roots.add(packageRoot(repository, java_class_string, line.substring(separator + 1)));
+        }
+        return package_roots;
+    }
+
+    // Package root of a Java class, from its path relative to the repository and its package declaration
+    private static Path packageRoot(Path repository, String java_class_string, String packageDeclaration) {
+        // Package identifier, e.g. org.example.myprogram
+        String packageId = packageDeclaration.substring(8, packageDeclaration.length() - 1);
+        int numberPackageParts = packageId.split("\\.").length;
+        String[] pathParts = java_class_string.split("/");
+        String packageRootPath = String.join("/", Arrays.copyOfRange(pathParts, 0, pathParts.length - numberPackageParts - 1));
+        return repository.resolve(packageRootPath);
+    }
+
+    // Package root of a Java file in the working tree, null if it has no package declaration
+    public static Path packageRoot(Path repository, Path file) throws IOException {
+        Matcher matcher = PACKAGE_DECLARATION.matcher(new String(Files.readAllBytes(file), StandardCharsets.UTF_8));
+        if (!matcher.find()) return null;
+        return packageRoot(repository, repository.toAbsolutePath().relativize(file.toAbsolutePath()).toString(), matcher.group());
+    }
+
+    // Java files of the working tree that differ from a revision: modified, removed or added by the applied diff
+    public static Set<Path> patchedFiles(Path repository, String revision) throws IOException {
+        Set<Path> patched_files = new HashSet<>();
+        String[][] commands = {
+                {"git", "diff", "-z", "--name-only", "--no-renames", revision, "--", "*.java"},
+                {"git", "ls-files", "-z", "--others", "--", "*.java"}
+        };
+        for (String[] command : commands) {
+            for (String file : runCommand(repository, command).split("\0")) {
+                if (!file.isEmpty()) patched_files.add(repository.resolve(file).toAbsolutePath());
+            }
+        }
+        return patched_files;
+    }
+
+    private static String runCommand(Path directory, String[] command) throws IOException {
+        Process process = new ProcessBuilder(command).directory(directory.toFile())
+                .redirectError(ProcessBuilder.Redirect.INHERIT).start();
+        ByteArrayOutputStream output = new ByteArrayOutputStream();
+        try (InputStream in = process.getInputStream()) {
+            byte[] buffer = new byte[8192];
+            for (int read; (read = in.read(buffer)) != -1; ) output.write(buffer, 0, read);
+        }
+        try {
+            process.waitFor();
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+            throw new IOException(e);
+        }
+        return new String(output.toByteArray(), StandardCharsets.UTF_8);
+    }
+
+    public static TypeSolver createTypeSolver(Set<Path> package_roots) {
+        // Create a new type solver and add all the package roots found
+        CombinedTypeSolver combinedTypeSolver = new CombinedTypeSolver();
+        combinedTypeSolver.add(new ReflectionTypeSolver());
+        ParserConfiguration pc = new ParserConfiguration().setAttributeComments(false);
+        for (Path package_root : package_roots) combinedTypeSolver.add(new JavaParserTypeSolver(package_root, pc));
+        return combinedTypeSolver;
+    }
+
     public ArrayList<String> run() throws IOException {
+        // In order for the JavaSymbolSolver type solver to work, it needs as input the package root of the packages
+        // containing the classes that we're trying to analyze. We perform an extraction step to extract all the
+        // possible Java package roots in the repository.
+        System.err.println("Extracting package roots");
+        package_roots = extractPackageRoots();
+
+        return run(createTypeSolver(package_roots));
+    }
+
+    public ArrayList<String> run(TypeSolver typeSolver) throws IOException {
         // The modified_classes list is the list of files from which we want to extract callers and callees.
         // To extract the callees we just need to resolve all the method calls within these files.
         // To extract the callers we need to resolve all the method calls in the files that contain a method call
@@ -194,18 +278,9 @@ public class MethodCallExtractor {
         System.err.println("Extracting possible caller classes");
         possible_caller_classes = extractPossibleCallerClasses();
 
-        // In order for the JavaSymbolSolver type solver to work, it needs as input the package root of the packages
-        // containing the classes that we're trying to analyze. We perform an extraction step to extract all the
-        // possible Java package roots in the repository.
-        System.err.println("Extracting package roots");
-        package_roots = extractPackageRoots();
-
-        // Create a new type solver and add all the package roots found
-        CombinedTypeSolver combinedTypeSolver = new CombinedTypeSolver();
-        combinedTypeSolver.add(new ReflectionTypeSolver());
-        ParserConfiguration pc = new ParserConfiguration().setAttributeComments(false);
-        for (Path package_root : package_roots) combinedTypeSolver.add(new JavaParserTypeSolver(package_root, pc));
-        JavaSymbolSolver symbolSolver = new JavaSymbolSolver(combinedTypeSolver);
+        // The type solver can be shared between runs on the same state of the repository (see Server), since
+        // building it and warming up its caches is the most expensive part of the analysis.
+        JavaSymbolSolver symbolSolver = new JavaSymbolSolver(typeSolver);
         JavaParser.getStaticConfiguration().setSymbolResolver(symbolSolver);
 
         ArrayList<String> calleeMethodCallsFormatted = new ArrayList<>();
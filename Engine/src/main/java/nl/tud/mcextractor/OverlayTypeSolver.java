@@ -0,0 +1,108 @@
+package nl.tud.mcextractor;
+
+import com.github.javaparser.resolution.declarations.ResolvedReferenceTypeDeclaration;
+import com.github.javaparser.symbolsolver.javaparsermodel.JavaParserFacade;
+import com.github.javaparser.symbolsolver.model.resolution.SymbolReference;
+import com.github.javaparser.symbolsolver.model.resolution.TypeSolver;
+
+import java.io.IOException;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.*;
+
+// Type solver of a repository at a revision, with the files changed by the diff applied to the working tree as an
+// overlay. The base type solver caches the files it parses, so it is shared by all the requests on the same
+// revision: it is only asked for the types whose files are not touched by the current diff, so everything it parses
+// is the version of the revision. The other types are solved by an overlay type solver, built for each diff.
+// JavaParserTypeSolver looks for a type a.b.C.D in the files a.java, a/b.java, a/b/C.java and a/b/C/D.java of each
+// package root, and in all the files of their folders, so a type goes to the overlay when one of these folders
+// contains a changed file.
+// The overlay changes with the requests, so the instances of the solver must not be used by more than one thread
+public class OverlayTypeSolver implements TypeSolver {
+    private TypeSolver parent;
+    private final Set<Path> basePackageRoots;
+    private final TypeSolver base;
+    private TypeSolver overlay;
+    // State of the working tree (revision and applied diff) the overlay was built for
+    private String overlayState;
+    // Folders containing the files changed by the diff, and the package roots only found in the changed files
+    private Set<Path> patchedFolders = Collections.emptySet();
+    private Set<Path> addedPackageRoots = Collections.emptySet();
+
+    public OverlayTypeSolver(Set<Path> basePackageRoots) {
+        this.basePackageRoots = normalize(basePackageRoots);
+        this.base = MethodCallExtractor.createTypeSolver(basePackageRoots);
+        // The types of the revision depending on a changed type get its version in the overlay
+        this.base.setParent(this);
+        this.overlay = this.base;
+    }
+
+    // Make the solver match the working tree of a repository, checked out at `revision` with the diff identified by
+    // `state` applied
+    public void applyState(Path repository, String revision, String state) throws IOException {
+        // The declarations resolved by JavaParser are cached by node for each type solver, and the ones of the
+        // files of the revision could refer to the types of the previous overlay
+        JavaParserFacade.clearInstances();
+        if (state.equals(overlayState)) return;
+        overlayState = null;
+
+        Set<Path> patchedFiles = MethodCallExtractor.patchedFiles(repository, revision);
+        Set<Path> folders = new HashSet<>();
+        Set<Path> packageRoots = new HashSet<>(basePackageRoots);
+        for (Path patchedFile : patchedFiles) {
+            folders.add(patchedFile.getParent().normalize());
+            if (Files.isRegularFile(patchedFile)) {
+                Path packageRoot = MethodCallExtractor.packageRoot(repository, patchedFile);
+                if (packageRoot != null) packageRoots.add(packageRoot.toAbsolutePath().normalize());
+            }
+        }
+        if (patchedFiles.isEmpty()) {
+            overlay = base;
+        } else {
+            System.err.format("Overlaying %d changed files\n", patchedFiles.size());
+            overlay = MethodCallExtractor.createTypeSolver(packageRoots);
+            overlay.setParent(this);
+        }
+        patchedFolders = folders;
+        packageRoots.removeAll(basePackageRoots);
+        addedPackageRoots = packageRoots;
+        overlayState = state;
+    }
+
+    private boolean isPatched(String name) {
+        String[] nameElements = name.split("\\.");
+        for (Path packageRoot : basePackageRoots) {
+            Path folder = packageRoot;
+            for (int i = 0; i < nameElements.length; i += 1) {
+                if (patchedFolders.contains(folder)) return true;
+                folder = folder.resolve(nameElements[i]);
+            }
+        }
+        // The base type solver does not look in the package roots added by the diff
+        for (Path packageRoot : addedPackageRoots) {
+            if (Files.exists(packageRoot.resolve(nameElements[0])) || Files.exists(packageRoot.resolve(nameElements[0] + ".java"))) return true;
+        }
+        return false;
+    }
+
+    private static Set<Path> normalize(Set<Path> paths) {
+        Set<Path> normalized = new HashSet<>();
+        for (Path path : paths) normalized.add(path.toAbsolutePath().normalize());
+        return normalized;
+    }
+
+    @Override
+    public TypeSolver getParent() {
+        return parent;
+    }
+
+    @Override
+    public void setParent(TypeSolver parent) {
+        this.parent = parent;
+    }
+
+    @Override
+    public SymbolReference<ResolvedReferenceTypeDeclaration> tryToSolveType(String name) {
+        return (isPatched(name) ? overlay : base).tryToSolveType(name);
+    }
+}
@@ -1,6 +1,13 @@
 package nl.tud.mcextractor;
 
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
 import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
 import java.nio.file.InvalidPathException;
 import java.nio.file.Path;
 import java.nio.file.Paths;
@@ -8,10 +15,19 @@ import java.util.ArrayList;
 
 public class Runner {
     public static void main(String[] args) throws InvalidPathException, IOException {
+        // In server mode the program reads extraction requests from stdin and keeps the analysis caches warm
+        // between them, see Server for the protocol
+        if (args.length == 1 && args[0].equals("--server")) {
+            BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+            PrintStream out = new PrintStream(new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)), false, "UTF-8");
+            new Server().serve(in, out);
+            return;
+        }
+
         // The program takes as input, from the command line, the path to the git repository and the list of files affected by the changes
         // that should be used as starting point for the analysis
         if (args.length < 2) {
-            System.out.println("Invalid number of arguments. Usage: java -jar mcextractor.jar repository modified_class1.java modified_class2.java [...]");
+            System.out.println("Invalid number of arguments. Usage: java -jar mcextractor.jar repository modified_class1.java modified_class2.java [...] or java -jar mcextractor.jar --server");
             System.exit(1);
         }
 
@@ -0,0 +1,104 @@
+package nl.tud.mcextractor;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.*;
+
+public class Server {
+    // Maximum number of repository revisions for which the package roots and the type solver are kept in memory
+    private static final int MAX_CACHED_REPOSITORIES = 8;
+    private static final int MAX_CACHED_SOLVERS = 4;
+
+    // Package roots of the files of a revision, keyed by "repository\trevision". They outlive the type solvers built
+    // from them
+    private final Map<String, Set<Path>> packageRootsCache = new LruCache<>(MAX_CACHED_REPOSITORIES);
+    // The type solvers cache the parsed files of a revision and overlay the files changed by the diff of each request
+    // (see OverlayTypeSolver), so the reviews of the same revision share them. Keyed by "repository\trevision"
+    private final Map<String, OverlayTypeSolver> typeSolverCache = new LruCache<>(MAX_CACHED_SOLVERS);
+
+    private static class LruCache<K, V> extends LinkedHashMap<K, V> {
+        private final int maxEntries;
+
+        LruCache(int maxEntries) {
+            super(16, 0.75f, true);
+            this.maxEntries = maxEntries;
+        }
+
+        @Override
+        protected boolean removeEldestEntry(Map.Entry<K, V> eldest) {
+            return size() > maxEntries;
+        }
+    }
+
+    public void serve(BufferedReader in, PrintStream out) throws IOException {
+        // Line-delimited protocol, fields are separated by tabs.
+        // Requests:
+        //   PING                                             -> PONG
+        //   EXTRACT revision state repository file1 [...]    -> R row (one per method call), then OK count
+        //   QUIT                                             -> the server exits
+        // Any request that fails is answered with ERR message.
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] fields = line.split("\t");
+            switch (fields[0]) {
+                case "PING":
+                    out.println("PONG");
+                    break;
+                case "QUIT":
+                    return;
+                case "EXTRACT":
+                    extract(fields, out);
+                    break;
+                default:
+                    out.println("ERR\tUnknown command " + fields[0]);
+            }
+            out.flush();
+        }
+    }
+
+    private void extract(String[] fields, PrintStream out) {
+        if (fields.length < 5) {
+            out.println("ERR\tUsage: EXTRACT revision state repository file1 [...]");
+            return;
+        }
+        String revision = fields[1];
+        String state = fields[2];
+        Path repository = Paths.get(fields[3]);
+        ArrayList<Path> modified_classes = new ArrayList<>();
+        for (int i = 4; i < fields.length; i += 1) modified_classes.add(repository.resolve(fields[i]));
+
+        String revisionKey = repository + "\t" + revision;
+        try {
+            MethodCallExtractor mcextractor = new MethodCallExtractor(repository, modified_classes);
+
+            OverlayTypeSolver typeSolver = typeSolverCache.get(revisionKey);
+            if (typeSolver == null) {
+                Set<Path> packageRoots = packageRootsCache.get(revisionKey);
+                if (packageRoots == null) {
+                    System.err.println("Extracting package roots");
+                    packageRoots = mcextractor.extractPackageRoots(revision);
+                    packageRootsCache.put(revisionKey, packageRoots);
+                }
+                typeSolver = new OverlayTypeSolver(packageRoots);
+                typeSolverCache.put(revisionKey, typeSolver);
+            } else {
+                System.err.println("Reusing type solver for " + revisionKey);
+            }
+            typeSolver.applyState(repository, revision, state);
+
+            ArrayList<String> formattedMethodCalls = mcextractor.run(typeSolver);
+            for (String formattedMethodCall : formattedMethodCalls) {
+                out.print("R\t");
+                out.println(formattedMethodCall);
+            }
+            out.println("OK\t" + formattedMethodCalls.size());
+        } catch (Throwable e) {
+            // The solver might be in an inconsistent state, don't reuse it
+            typeSolverCache.remove(revisionKey);
+            out.println("ERR\t" + String.valueOf(e).replaceAll("[\t\r\n]+", " "));
+        }
+    }
+}
@@ -2,6 +2,8 @@ const PR_URL_REGEX = /^https?:\/\/(?:www\.)?github\.com\/(.+?)\/(.+?)\/pull\/(\d
 const backendPort = 5000;
 const backendURL = `${window.location.protocol}//${window.location.hostname}:5000`;
 const prParamName = 'url';
+// Maximum number of files requested together to the backend (its FILE_BATCH_MAX_FILES)
+const FILE_BATCH_MAX_FILES = 1000;
 
 // Escape characters reserved in HTML
 const encodeEntities = (value) => value
@@ -60,7 +62,7 @@ const loadVisualization = (pullreq_url) => {
         // When done, display it
         displayMainDiff(data);
         // Then, load the method calls and display them
-        loadMethodCalls(pullreq_url);
+        loadMethodCalls(pullreq_url, true);
     })
     .fail(() => {
         swal({
@@ -105,9 +107,10 @@ const displayMainDiff = (data) => {
     });
 };
 
-// Request method calls from backend and when they become available, display them
-const loadMethodCalls = (pullreq_url) => {
-    const startReviewURL = `${backendURL}/review/start?pr=${pullreq_url}`;
+// Request method calls from backend and when they become available, display them.
+// With refresh, a review processed before is updated if the pull request got new commits
+const loadMethodCalls = (pullreq_url, refresh = false) => {
+    const startReviewURL = `${backendURL}/review/start?pr=${pullreq_url}${refresh ? '&refresh=1' : ''}`;
     $.getJSON(startReviewURL)
         .done((data) => {
             // Error retrieving method calls
@@ -115,10 +118,12 @@ const loadMethodCalls = (pullreq_url) => {
                 mcRetrievalError(data.error);
                 return;
             }
-            // If the review is still processing, retry after 1 second
-            if (data.data.review_status === 'processing') setTimeout(() => { loadMethodCalls(pullreq_url); }, 1000);
+            // If the review is still processing, wait for it to be ready
+            if (data.data.review_status === 'processing') waitForReview(data.data.id, pullreq_url);
             // If the review is ready, display the method calls
             if (data.data.review_status === 'ready') displayMethodCalls(data.data.id);
+            // If the processing of the review failed, signal it
+            if (data.data.review_status === 'error') mcRetrievalError('Error extracting the method calls of the pull request');
         })
         .fail(() => {
             // If something goes wrong while trying to get the method calls, signal it
@@ -126,6 +131,36 @@ const loadMethodCalls = (pullreq_url) => {
         });
 }
 
+// Subscribe to the events of a review being processed and display the method calls as soon as it's ready.
+// If the browser doesn't support server-sent events, poll the backend every second instead
+const waitForReview = (review_id, pullreq_url) => {
+    if (typeof EventSource === 'undefined') {
+        setTimeout(() => { loadMethodCalls(pullreq_url); }, 1000);
+        return;
+    }
+    const eventSource = new EventSource(`${backendURL}/review/${review_id}/events`);
+    eventSource.onmessage = (e) => {
+        const event = JSON.parse(e.data);
+        if (event.stage === 'ready') {
+            eventSource.close();
+            displayMethodCalls(review_id);
+        } else if (event.stage === 'error') {
+            eventSource.close();
+            mcRetrievalError('Error extracting the method calls of the pull request');
+        } else {
+            showReviewProgress(event);
+        }
+    };
+}
+
+// Show the progress of the review processing as tooltip of the 'loading' spinners
+const showReviewProgress = ({ stage, files, calls }) => {
+    const details = [stage.replace('_', ' ')];
+    if (files !== undefined) details.push(`${files} modified files`);
+    if (calls !== undefined) details.push(`${calls} method calls extracted`);
+    $('tr:first-child > td.callsx.loading, tr:first-child > td.calldx.loading').attr('title', details.join(', '));
+}
+
 // Compute map used to associate modified lines to method calls
 // The idea is to create an object containing the information on which lines of the old and new version
 // of each file are shown in the diff, together with a reference to those lines.
@@ -171,6 +206,40 @@ const mcRetrievalError = (error) => {
     });
 };
 
+// Contents and diffs of the files of the review, loaded at once with loadReviewFiles:
+// {'path/to/file1.java': {contents: '...', diff: '...'}, ...}
+const reviewFiles = {};
+
+// Load the contents and the diffs of some files of a review, with a request for each batch of
+// at most FILE_BATCH_MAX_FILES files. The backend streams them as one JSON object per line
+const loadReviewFiles = (review_id, paths) => {
+    const requests = [];
+    for (let i = 0; i < paths.length; i += FILE_BATCH_MAX_FILES) {
+        requests.push($.ajax({
+            url: `${backendURL}/review/${review_id}/files`,
+            method: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify(paths.slice(i, i + FILE_BATCH_MAX_FILES)),
+            dataType: 'text',
+        }).done((text) => {
+            for (const line of text.split('\n')) {
+                if (!line) continue;
+                const file = JSON.parse(line);
+                if (file.status === 'ok') reviewFiles[file.path] = file;
+            }
+        }));
+    }
+    return $.when(...requests);
+};
+
+// Get the contents ('file') or the diff ('diff') of a file of a review, from the files
+// already loaded if possible
+const getReviewFile = (review_id, kind, file_path) => {
+    const file = reviewFiles[file_path];
+    if (file) return $.Deferred().resolve({ data: kind === 'file' ? file.contents : file.diff }).promise();
+    return $.getJSON(`${backendURL}/review/${review_id}/${kind}?path=${file_path}`);
+};
+
 // Popup of modal containing either the caller or the callee
 const popupClass = (review_id, type, file_path, start_line, end_line) => {
     // Append to the modal HTML element the type and line range info
@@ -182,8 +251,7 @@ const popupClass = (review_id, type, file_path, start_line, end_line) => {
     if (type === 'normal') {
         $('.modal').addClass('normal').removeClass('diff');
         // Get file from backend
-        const fileSourceURL =  `${backendURL}/review/${review_id}/file?path=${file_path}`;
-        $.getJSON(fileSourceURL)
+        getReviewFile(review_id, 'file', file_path)
             .done((data) => {
                 const modal_contents = `<div class="source-code"><pre><code class="java">${encodeEntities(data.data)}</code></pre></div>`;
                 $('.modal-title').text(file_path);
@@ -199,8 +267,7 @@ const popupClass = (review_id, type, file_path, start_line, end_line) => {
     } else {
         $('.modal').addClass('diff').removeClass('normal');
         // Get diff from backend
-        const diffSourceURL =  `${backendURL}/review/${review_id}/diff?path=${file_path}`;
-        $.getJSON(diffSourceURL)
+        getReviewFile(review_id, 'diff', file_path)
             .done((data) => {
                 $('.modal-title').text(`[✎] ${file_path}`);
                 const diff2htmlUi = new Diff2HtmlUI({diff: data.data});
@@ -220,6 +287,26 @@ const popupClass = (review_id, type, file_path, start_line, end_line) => {
     }
 }
 
+// Fields of the method calls used by the visualization
+const METHOD_CALL_FIELDS = [
+    'from_file', 'call_start_line', 'call_end_line', 'method_call', 'short_method_qualifier',
+    'full_method_qualifier', 'to_file', 'declaration_start_line', 'declaration_end_line',
+];
+const METHOD_CALL_STRING_FIELDS = ['from_file', 'method_call', 'short_method_qualifier', 'full_method_qualifier', 'to_file'];
+
+// Turn the method calls in the compact format (lists of values, with strings replaced by
+// their index in data.strings) into objects
+const decodeMethodCalls = (data) => {
+    const strings = new Set(METHOD_CALL_STRING_FIELDS);
+    return data.data.map((values) => {
+        const methodCall = {};
+        data.fields.forEach((field, i) => {
+            methodCall[field] = strings.has(field) && values[i] !== null ? data.strings[values[i]] : values[i];
+        });
+        return methodCall;
+    });
+};
+
 // Organize the method calls returned from the backend basing on the displayed portion
 // of the files in the diff, making it easier to place the method call information in the right position
 const organizeMethodCalls = (allMethodCalls, map) => {
@@ -370,12 +457,22 @@ const displayMethodCalls = (review_id) => {
     $('tr:first-child > td.callsx').html('CALLERS');
     $('tr:first-child > td.calldx').html('CALLEES');
 
-    // Retrieve method calls via AJAX from backend
-    const methodCallsURL = `${backendURL}/review/${review_id}/methodcalls`;
+    // Retrieve method calls via AJAX from backend, only with the fields used here and in
+    // the compact format, where each string is sent once
+    const methodCallsURL = `${backendURL}/review/${review_id}/methodcalls?format=compact&fields=${METHOD_CALL_FIELDS.join(',')}`;
     $.getJSON(methodCallsURL)
         .done((data) => {
+            const methodCalls = decodeMethodCalls(data);
+            // Load in the background all the files that can be shown in the modal
+            const paths = new Set(Object.keys(map));
+            for (const mc of methodCalls) {
+                paths.add(mc.from_file);
+                paths.add(mc.to_file);
+            }
+            loadReviewFiles(review_id, [...paths]);
+
             // Organize the callees and callers per file, and per line (callees) in a dictionary (=object)
-            const organized_methodcalls = organizeMethodCalls(data.data, map);
+            const organized_methodcalls = organizeMethodCalls(methodCalls, map);
 
             // Iterate over each of the modified files (that contain at least 1 caller or callee to display)
             for (const [filename, { method_calls: f_method_calls, reference }] of Object.entries(organized_methodcalls)) {
@@ -0,0 +1,73 @@
+import com.github.gumtreediff.actions.ActionGenerator;
+import com.github.gumtreediff.actions.model.*;
+import com.github.gumtreediff.client.Run;
+import com.github.gumtreediff.gen.Generators;
+import com.github.gumtreediff.matchers.Matcher;
+import com.github.gumtreediff.matchers.Matchers;
+import com.github.gumtreediff.tree.ITree;
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+
+// Computes the fine-grained differences of many pairs of Java files in a single JVM, with the
+// Gumtree 2.1 API, so the cost of starting the JVM and loading Gumtree is paid once.
+// Compile and run with the jars of the Gumtree distribution on the classpath:
+//   javac -cp 'gumtree/lib/*' GumtreeBatch.java
+//   java -cp 'gumtree/lib/*:.' GumtreeBatch
+public class GumtreeBatch {
+    public static void main(String[] args) throws Exception {
+        Run.initGenerators();
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(System.out, false, "UTF-8");
+        // Line-delimited protocol, fields are separated by tabs.
+        // Requests:
+        //   DIFF old_file new_file   -> OK inserts deletes updates moves
+        //   PING                     -> PONG
+        //   QUIT                     -> the driver exits
+        // Any request that fails is answered with ERR message.
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] fields = line.split("\t");
+            switch (fields[0]) {
+                case "PING":
+                    out.println("PONG");
+                    break;
+                case "QUIT":
+                    return;
+                case "DIFF":
+                    if (fields.length != 3) {
+                        out.println("ERR\tUsage: DIFF old_file new_file");
+                        break;
+                    }
+                    try {
+                        out.println(diff(fields[1], fields[2]));
+                    } catch (Exception e) {
+                        out.println("ERR\t" + String.valueOf(e.getMessage()).replaceAll("\\s+", " "));
+                    }
+                    break;
+                default:
+                    out.println("ERR\tUnknown command " + fields[0]);
+            }
+            out.flush();
+        }
+    }
+
+    private static String diff(String oldFile, String newFile) throws Exception {
+        ITree src = Generators.getInstance().getTree(oldFile).getRoot();
+        ITree dst = Generators.getInstance().getTree(newFile).getRoot();
+        Matcher matcher = Matchers.getInstance().getMatcher(src, dst);
+        matcher.match();
+        ActionGenerator generator = new ActionGenerator(src, dst, matcher.getMappings());
+        generator.generate();
+
+        int inserts = 0, deletes = 0, updates = 0, moves = 0;
+        for (Action action : generator.getActions()) {
+            if (action instanceof Insert) inserts += 1;
+            else if (action instanceof Delete) deletes += 1;
+            else if (action instanceof Update) updates += 1;
+            else if (action instanceof Move) moves += 1;
+        }
+        return "OK\t" + inserts + "\t" + deletes + "\t" + updates + "\t" + moves;
+    }
+}
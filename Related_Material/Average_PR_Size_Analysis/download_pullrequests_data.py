@@ -1,115 +1,261 @@
 #!/usr/bin/env python3
 
-import pygit2
-import requests
-import pprint
+import argparse
+import calendar
 import csv
+import email.utils
+import json
+import os
+import random
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Downloads the merged pull requests of one or more repositories to CSV files
+# (output_<organization>_<repository>.csv). Each page of pull requests is appended to the
+# CSV file as soon as it arrives, and the cursor of the next page is saved in a checkpoint
+# file next to it (output_<organization>_<repository>.checkpoint), so an interrupted
+# download resumes from the last saved page when the script is run again.
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+# attempts of a query failing with a transient error before giving up on a repository
+MAX_ATTEMPTS = 6
+# the queries wait for the rate limit to be reset when fewer points than this are left
+RATE_LIMIT_RESERVE = 50
+# seconds to wait when a rate limited response does not tell when to retry
+DEFAULT_RETRY_AFTER = 60
+
+FIELDNAMES = ['id', 'number', 'title', 'mergeCommit', 'changedFiles', 'mergedAt']
+
+QUERY = """
+query($owner: String!, $name: String!, $after: String) {
+  rateLimit {
+    remaining
+    resetAt
+  }
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: 100, states: [MERGED], after: $after) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        number
+        title
+        id
+        mergedAt
+        changedFiles
+        mergeCommit {
+          oid
+        }
+      }
+    }
+  }
+}"""
+
+
+class TransientError(Exception):
+    pass
+
+
+class RateLimit:
+    '''
+    Rate limit budget shared by the threads downloading the repositories: when it is almost
+    exhausted, all the queries wait for it to be reset.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset_at = 0
+
+    def wait(self):
+        with self.lock:
+            delay = self.reset_at - time.time() if self.remaining is not None and self.remaining < RATE_LIMIT_RESERVE else 0
+        if delay > 0:
+            print('Rate limit almost exhausted, waiting {:.0f}s for it to be reset'.format(delay))
+            time.sleep(delay)
+
+    def update(self, remaining, reset_at):
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = reset_at
+
+    def block(self, seconds):
+        with self.lock:
+            self.remaining = 0
+            self.reset_at = max(self.reset_at, time.time() + seconds)
+
+
+def retry_after_delay(value):
+    '''
+    Seconds to wait given by a Retry-After header, either a number of seconds or an HTTP date.
+    '''
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def run_query(session, rate_limit, variables):
+    rate_limit.wait()
+    try:
+        request = session.post(GRAPHQL_URL, json={'query': QUERY, 'variables': variables}, timeout=60)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise TransientError('Query failed: {}'.format(e))
+    if request.status_code in (403, 429) and request.headers.get('Retry-After'):
+        # secondary rate limit
+        delay = retry_after_delay(request.headers['Retry-After'])
+        rate_limit.block(delay)
+        raise TransientError('Rate limited, retrying after {:.0f}s'.format(delay))
+    if request.status_code in (403, 429) and request.headers.get('X-RateLimit-Remaining') == '0':
+        # primary rate limit exhausted, e.g. by another client using the same token
+        try:
+            delay = int(request.headers['X-RateLimit-Reset']) - time.time()
+        except (KeyError, ValueError):
+            delay = DEFAULT_RETRY_AFTER
+        rate_limit.block(max(0, delay))
+        raise TransientError('Rate limit exhausted, retrying after {:.0f}s'.format(max(0, delay)))
+    if request.status_code >= 500:
+        raise TransientError('Query failed with code {}'.format(request.status_code))
+    if request.status_code != 200:
+        raise Exception('Query failed to run by returning code of {}. {}'.format(request.status_code, variables))
+    result = request.json()
+    errors = result.get('errors') or []
+    if any(error.get('type') == 'RATE_LIMITED' for error in errors):
+        rate_limit.block(60)
+        raise TransientError('Rate limited')
+    if errors:
+        raise Exception('Query returned errors: {}'.format(errors))
+    rate = result['data']['rateLimit']
+    reset_at = calendar.timegm(time.strptime(rate['resetAt'], '%Y-%m-%dT%H:%M:%SZ'))
+    rate_limit.update(rate['remaining'], reset_at)
+    return result
 
-if len(sys.argv) < 4:
-    print('Usage: {} organization repository access_token'.format(sys.argv[0]))
-    sys.exit(1)
 
-repo_github_org, repo_name = sys.argv[1], sys.argv[2]
+def run_query_with_retries(session, rate_limit, variables):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return run_query(session, rate_limit, variables)
+        except TransientError as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            # exponential backoff, with some jitter so the threads do not retry together
+            delay = 2 ** attempt + random.random()
+            print('{}, attempt {} of {}, retrying in {:.1f}s'.format(e, attempt + 1, MAX_ATTEMPTS, delay))
+            time.sleep(delay)
 
-headers = {"Authorization": "bearer {}".format(sys.argv[3])}
 
-def run_query(query):
-    request = requests.post('https://api.github.com/graphql', json={'query': query}, headers=headers)
-    if request.status_code == 200:
-        return request.json()
+def read_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(checkpoint_file, checkpoint):
+    # written to a temporary file first, so the checkpoint is never left half written
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def download_repository(session, rate_limit, repo_github_org, repo_name):
+    outfile = 'output_{}_{}.csv'.format(repo_github_org, repo_name)
+    checkpoint_file = 'output_{}_{}.checkpoint'.format(repo_github_org, repo_name)
+
+    checkpoint = read_checkpoint(checkpoint_file)
+    if checkpoint and checkpoint['done']:
+        print('{}/{}: already downloaded to {}'.format(repo_github_org, repo_name, outfile))
+        return
+    resume = checkpoint and os.path.exists(outfile)
+    if resume:
+        # drop the rows written after the last checkpoint, they are downloaded again
+        with open(outfile, 'r+') as csvfile:
+            csvfile.truncate(checkpoint['size'])
+        print('{}/{}: resuming after {} pull requests'.format(repo_github_org, repo_name, checkpoint['count']))
     else:
-        raise Exception("Query failed to run by returning code of {}. {}".format(request.status_code, query))
-
-# We run the first query without pagination
-first_query = """
-{{
-  repository(owner: "{}", name: "{}") {{
-    pullRequests(first: 100, states: [MERGED]) {{
-      edges {{
-        cursor
-        node {{
-          number
-          title
-          id
-          mergedAt
-          changedFiles
-          mergeCommit {{
-            oid
-          }}
-        }}
-      }}
-    }}
-  }}
-}}""".format(repo_github_org, repo_name)
-
-# All the pull requests are stored in this list
-all_results_data = []
-
-result = run_query(first_query)
-result_data = result['data']['repository']['pullRequests']['edges']
-
-print('Organisation: {}, Repository: {}'.format(repo_github_org, repo_name))
-print('For the first query, got {} pull requests'.format(len(result_data)))
-all_results_data.extend(result_data)
-
-# Repeat increasing pagination till we are over with all the PRs
-while True:
-    last_cursor = all_results_data[-1]['cursor']
-
-    query = """
-    {{
-      repository(owner: "{}", name: "{}") {{
-        pullRequests(first: 100, states: [MERGED], after: "{}") {{
-          edges {{
-            cursor
-            node {{
-              number
-              title
-              id
-              mergedAt
-              changedFiles
-              mergeCommit {{
-                oid
-              }}
-            }}
-          }}
-        }}
-      }}
-    }}""".format(repo_github_org, repo_name, last_cursor)
-
-    result = run_query(query)
-    result_data = result['data']['repository']['pullRequests']['edges']
-    all_results_data.extend(result_data)
-
-    print('Got {} more pull requests, total is now {}'.format(len(result_data), len(all_results_data)))
-
-    if len(result_data) == 0:
-        break
-
-print('Finished downloading PR info')
-
-# Save results to CSV
-outfile = 'output_{}_{}.csv'.format(repo_github_org, repo_name)
-
-print('Writing output to {}'.format(outfile))
-
-with open(outfile, 'w', newline='') as csvfile:
-    fieldnames = ['id', 'number', 'title', 'mergeCommit', 'changedFiles', 'mergedAt']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for pull_request in all_results_data:
-        mergeCommitInfo = pull_request['node']['mergeCommit']
-        mergeCommitHash = mergeCommitInfo['oid'] if mergeCommitInfo else None
-
-        writer.writerow({
-            'id': pull_request['node']['id'],
-            'number': pull_request['node']['number'],
-            'title': pull_request['node']['title'],
-            'mergeCommit': mergeCommitHash,
-            'changedFiles': pull_request['node']['changedFiles'],
-            'mergedAt': pull_request['node']['mergedAt']
-        })
-
-print('Done.')
+        checkpoint = {'cursor': None, 'size': 0, 'count': 0, 'done': False}
+
+    with open(outfile, 'a' if resume else 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        if checkpoint['size'] == 0:
+            writer.writeheader()
+
+        while True:
+            result = run_query_with_retries(session, rate_limit,
+                                            {'owner': repo_github_org, 'name': repo_name, 'after': checkpoint['cursor']})
+            pull_requests = result['data']['repository']['pullRequests']
+
+            for pull_request in pull_requests['nodes']:
+                mergeCommitInfo = pull_request['mergeCommit']
+                mergeCommitHash = mergeCommitInfo['oid'] if mergeCommitInfo else None
+
+                writer.writerow({
+                    'id': pull_request['id'],
+                    'number': pull_request['number'],
+                    'title': pull_request['title'],
+                    'mergeCommit': mergeCommitHash,
+                    'changedFiles': pull_request['changedFiles'],
+                    'mergedAt': pull_request['mergedAt']
+                })
+
+            # the page is on disk before the checkpoint moves past it
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+            page_info = pull_requests['pageInfo']
+            checkpoint = {
+                'cursor': page_info['endCursor'] or checkpoint['cursor'],
+                'size': os.fstat(csvfile.fileno()).st_size,
+                'count': checkpoint['count'] + len(pull_requests['nodes']),
+                'done': not page_info['hasNextPage'],
+            }
+            write_checkpoint(checkpoint_file, checkpoint)
+            print('{}/{}: got {} more pull requests, total is now {}'.format(
+                repo_github_org, repo_name, len(pull_requests['nodes']), checkpoint['count']))
+
+            if checkpoint['done']:
+                break
+
+    print('{}/{}: finished, output written to {}'.format(repo_github_org, repo_name, outfile))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Download the merged pull requests of GitHub repositories to CSV files',
+        epilog='The previous form "organization repository access_token", downloading a single repository, is still accepted.')
+    parser.add_argument('access_token')
+    parser.add_argument('repositories', nargs='+', metavar='organization/repository')
+    parser.add_argument('--workers', type=int, default=4, help='number of repositories downloaded at the same time')
+    args = parser.parse_args()
+    if len(args.repositories) == 2 and not any('/' in arg for arg in [args.access_token] + args.repositories):
+        # previous form: organization repository access_token
+        args.access_token, args.repositories = args.repositories[1], ['{}/{}'.format(args.access_token, args.repositories[0])]
+
+    session = requests.Session()
+    session.headers['Authorization'] = 'bearer {}'.format(args.access_token)
+    rate_limit = RateLimit()
+
+    def download(repository):
+        repo_github_org, repo_name = repository.split('/', 1)
+        try:
+            download_repository(session, rate_limit, repo_github_org, repo_name)
+        except Exception as e:
+            print('{}: download failed, run again to resume it. {}'.format(repository, e))
+            return False
+        return True
+
+    with ThreadPoolExecutor(args.workers) as executor:
+        succeeded = list(executor.map(download, args.repositories))
+
+    if not all(succeeded):
+        sys.exit(1)
+    print('Done.')
@@ -1,50 +1,109 @@
-import csv
+import argparse
 import pandas as pd
-import git
 import re
 import os
+import shutil
+import sqlite3
 import tempfile
 import subprocess
-import sys
+from multiprocessing import Pool, util
 
 debug = False
 
-if len(sys.argv) != 3:
-    print(f'Usage: {sys.argv[0]} repo_org repo_name')
-    sys.exit(1)
+# path of the binary of gumtree, its jars are in the lib folder next to the bin folder
+gumtree_path = '/home/joined/Downloads/gumtree-20161230-2.1.0-SNAPSHOT/bin/gumtree'
+# database of the fine-grained differences already computed
+fineGrainedCachePath = 'gumtree_cache.db'
 
-repo_org = sys.argv[1]
-repo_name = sys.argv[2]
+# we compile some regexes in advance for speed reasons.
+# regex to match the package name in a java file
+packageRegexPattern = r'package (.+);'
+progPackageRegex = re.compile(packageRegexPattern)
 
-# path of the binary of gumtree
-gumtree_path = '/home/joined/Downloads/gumtree-20161230-2.1.0-SNAPSHOT/bin/gumtree'
+# merge commits handed to a worker process at a time
+commitsPerTask = 16
+
+# kinds of the AST edit actions counted by the fine-grained diff
+actionKinds = ['insertedNodes', 'deletedNodes', 'updatedNodes', 'movedNodes']
+# blob hash standing for the missing version of a created or deleted file
+missingBlob = '0' * 40
+# folder of this script, where GumtreeBatch is compiled
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+def gumtreeClassPath(gumtreeLibPath):
+    return os.pathsep.join([os.path.join(gumtreeLibPath, '*'), scriptDir])
 
-def getFineGrainedStats(firstFileContents, secondFileContents):
+def compileGumtreeBatch(gumtreeLibPath):
     '''
-    This function uses gumtree to extract fine grained differences from two Java files.
-    It takes as parameters two strings containing the contents of the files.
+    Compiles GumtreeBatch if its class is missing or older than its source. Called once by
+    the main process before the workers start, so they never run a partially written class.
     '''
+    sourcePath = os.path.join(scriptDir, 'GumtreeBatch.java')
+    classPath = os.path.join(scriptDir, 'GumtreeBatch.class')
+    if not os.path.exists(classPath) or os.path.getmtime(classPath) < os.path.getmtime(sourcePath):
+        subprocess.check_call(['javac', '-cp', gumtreeClassPath(gumtreeLibPath), sourcePath])
 
-    # create two temporary files materializing on disk the content
-    # of the source code
-    firstFile = tempfile.NamedTemporaryFile(suffix='.java', delete=False)
-    firstFile.write(firstFileContents.encode())
-    firstFile.seek(0)
-    firstFile.close()
+class GumtreeDriver:
+    '''
+    Computes fine-grained differences between Java files with a single long-lived JVM
+    running GumtreeBatch, instead of starting the Gumtree binary for each pair of files.
+    The contents are materialized in a folder of its own inside `runDir`, the folder of the
+    run, which is on tmpfs when one is available. GumtreeBatch must be compiled already.
+    '''
 
-    secondFile = tempfile.NamedTemporaryFile(suffix='.java', delete=False)
-    secondFile.write(secondFileContents.encode())
-    secondFile.seek(0)
-    secondFile.close()
+    def __init__(self, gumtreeLibPath, runDir):
+        self.tempDir = tempfile.mkdtemp(prefix='worker-', dir=runDir)
+        self.process = subprocess.Popen(['java', '-cp', gumtreeClassPath(gumtreeLibPath), 'GumtreeBatch'], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, encoding='utf-8')
 
-    # invoke gumtree to compute the differences and capture the output
-    result = subprocess.check_output([gumtree_path, 'diff', firstFile.name, secondFile.name]).decode()
+    def diff(self, oldFileContents, newFileContents):
+        '''
+        Returns the number of AST nodes inserted, deleted, updated and moved between two
+        versions of a Java file, as a dictionary, or None if Gumtree cannot compare them.
+        '''
+        paths = []
+        for name, contents in (('old.java', oldFileContents), ('new.java', newFileContents)):
+            path = os.path.join(self.tempDir, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(contents)
+            paths.append(path)
+        self.process.stdin.write('DIFF\t{}\t{}\n'.format(*paths))
+        self.process.stdin.flush()
+        fields = self.process.stdout.readline().rstrip('\n').split('\t')
+        if fields[0] != 'OK':
+            printIfDebug(f'-- Gumtree failed: {fields}')
+            return None
+        return dict(zip(actionKinds, map(int, fields[1:])))
 
-    # delete the two files
-    os.unlink(firstFile.name)
-    os.unlink(secondFile.name)
+    def close(self):
+        '''
+        Stops the JVM, which exits at the end of its input, and removes the folder of the contents.
+        '''
+        self.process.stdin.close()
+        self.process.wait()
+        shutil.rmtree(self.tempDir, ignore_errors=True)
 
-    return result
+class FineGrainedCache:
+    '''
+    Fine-grained differences memoized by the pair (old blob hash, new blob hash), in a SQLite
+    database shared by the worker processes and by the runs on other repositories, so the
+    same change (e.g. in forks, or cherry-picked) is compared only once.
+    '''
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS finegrained (oldBlob TEXT, newBlob TEXT, {}, PRIMARY KEY (oldBlob, newBlob))'.format(
+            ', '.join(f'{kind} INTEGER' for kind in actionKinds)))
+
+    def get(self, oldBlob, newBlob):
+        row = self.conn.execute('SELECT {} FROM finegrained WHERE oldBlob = ? AND newBlob = ?'.format(', '.join(actionKinds)),
+                                (oldBlob, newBlob)).fetchone()
+        return dict(zip(actionKinds, row)) if row else None
+
+    def put(self, oldBlob, newBlob, stats):
+        self.conn.execute('INSERT OR IGNORE INTO finegrained VALUES (?, ?, {})'.format(', '.join('?' * len(actionKinds))),
+                          [oldBlob, newBlob] + [stats[kind] for kind in actionKinds])
 
 def extractPackageFromFileContents(fileContents):
     '''
@@ -60,86 +119,122 @@ def printIfDebug(s):
     if debug:
         print(s)
 
-def getCommitStats(commit):
-    printIfDebug(f'Processing commit {commit.hexsha}')
-    changedFiles = commit.stats.files.keys()
+class ObjectReader:
+    '''
+    Reads objects from a repository through a single long-lived `git cat-file --batch`
+    process, instead of spawning a `git show` for every file version.
+    '''
+
+    def __init__(self, repoPath):
+        self.repoPath = repoPath
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch=%(objectname) %(objecttype) %(objectsize)'], cwd=repoPath,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, objectName):
+        '''
+        Returns a tuple (type, contents as bytes) of the object, or None if it does not exist.
+        The object can be named as anything git understands, e.g. `commit:path/to/file`.
+        '''
+        self.process.stdin.write(objectName.encode() + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode().rstrip('\n').split(' ')
+        # "<name> missing" or "<name> ambiguous", the name may contain spaces
+        if header[-1] in ('missing', 'ambiguous'):
+            return None
+        objectType, size = header[1], int(header[2])
+        contents = self.process.stdout.read(size + 1)[:-1]
+        return objectType, contents
+
+    def readBlob(self, blobSHA):
+        '''
+        Returns the contents of a blob as a string, or None if it does not exist.
+        '''
+        result = self.read(blobSHA)
+        if result is None or result[0] != 'blob':
+            return None
+        return result[1].decode(errors='replace')
+
+def getFirstParent(reader, commitSHA):
+    '''
+    Returns the first parent of a commit, '' if it has none, or None if the commit
+    does not exist in the repository.
+    '''
+    result = reader.read(commitSHA)
+    if result is None or result[0] != 'commit':
+        return None
+    for line in result[1].decode(errors='replace').split('\n'):
+        if line.startswith('parent '):
+            return line.split()[1]
+        if not line:
+            # end of the headers
+            break
+    return ''
+
+def getChangedFiles(repoPath, parentSHA, commitSHA):
+    '''
+    Returns the files changed by a commit with respect to its first parent, as a list of
+    tuples (old path, new path, old blob, new blob), where the old path is None for created
+    files and the new path is None for deleted files. Renames are detected like
+    `commit.stats` does.
+    '''
+    # a commit without parents is compared with the empty tree
+    revisions = [parentSHA, commitSHA] if parentSHA else ['--root', commitSHA]
+    output = subprocess.check_output(['git', 'diff-tree', '-r', '-M', '-z', '--no-commit-id', '--no-abbrev'] + revisions,
+                                     cwd=repoPath).decode(errors='replace')
+    fields = output.split('\0')
+    changedFiles = []
+    i = 0
+    while i < len(fields) - 1:
+        # ":old_mode new_mode old_blob new_blob status", followed by the path
+        _, _, oldBlob, newBlob, status = fields[i].split()
+        if status[0] in 'RC':
+            # renames and copies are followed by the old and the new path
+            oldPath, newPath = fields[i + 1], fields[i + 2]
+            i += 3
+        else:
+            oldPath = newPath = fields[i + 1]
+            i += 2
+        if status[0] == 'A':
+            oldPath = None
+        elif status[0] == 'D':
+            newPath = None
+        changedFiles.append((oldPath, newPath, oldBlob, newBlob))
+    return changedFiles
+
+def getFineGrainedStats(oldBlob, newBlob, oldFileContents, newFileContents):
+    '''
+    Returns the number of AST nodes changed in a file by kind of change, from the cache
+    or computed with gumtree. None if gumtree cannot compare the two versions.
+    '''
+    stats = fineGrainedCache.get(oldBlob, newBlob)
+    if stats is None:
+        stats = gumtree.diff(oldFileContents, newFileContents)
+        if stats is not None:
+            fineGrainedCache.put(oldBlob, newBlob, stats)
+    return stats
+
+def getCommitStats(reader, commitSHA, parentSHA):
+    '''
+    Returns the packages modified by a commit, and the number of AST nodes it changes in
+    Java files by kind of change if the fine-grained differences are enabled (None otherwise).
+    '''
+    printIfDebug(f'Processing commit {commitSHA}')
     changedJavaFiles = [changedFile
-                        for changedFile in changedFiles
-                        if changedFile.rstrip().endswith('.java')]
+                        for changedFile in getChangedFiles(reader.repoPath, parentSHA, commitSHA)
+                        if (changedFile[1] or changedFile[0]).rstrip().endswith('.java')]
 
     modifiedPackages = set()
+    fineGrainedStats = dict.fromkeys(actionKinds, 0) if gumtree else None
 
-    for filePath in changedJavaFiles:
-        printIfDebug(f'- Analyzing changes to file {filePath}')
-
-        newFileExists, oldFileExists = True, True
-
-        # if the file was renamed in the current commit, we will get the renaming
-        # in the path of the file. we can tell the file was renamed because there is a
-        # fat arrow in the path to indicate the renaming
-        if '=>' in filePath:
-            printIfDebug('-- File was renamed/moved')
-            # there are two main possibilities for the renaming: either a partial
-            # renaming (only a part of the part) or a full rename.
-            # we handle the two cases distinctly because in the first case curly braces
-            # are used to indicate the partial rename
-            partialRenamingMatch = re.search(progRenamedFileRegexPattern, filePath)
-            if partialRenamingMatch:
-                printIfDebug(f'group1 {partialRenamingMatch.group(1)}, group2 {partialRenamingMatch.group(2)}')
-                # in this case the renaming is indicated as follows
-                # {old/partial/path => new/partial/path}/file.java
-
-                # it turns out that one of the two partial paths (old and new)
-                # can be empty, meaning that either the file was moved into a subfolder
-                # which was just created or it was moved to its parent folder
-                # the following logic deals with this.
-                if partialRenamingMatch.group(1) == '':
-                    oldPath = re.sub(r'{.*}/', '', filePath)
-                    newPath = re.sub(r'{.*}', partialRenamingMatch.group(2), filePath)
-                elif partialRenamingMatch.group(2) == '':
-                    newPath = re.sub(r'{.*}/', '', filePath)
-                    oldPath = re.sub(r'{.*}', partialRenamingMatch.group(1), filePath)
-                else:
-                    oldPath = re.sub(r'{.*}', partialRenamingMatch.group(1), filePath)
-                    newPath = re.sub(r'{.*}', partialRenamingMatch.group(2), filePath)
-            else:
-                # in this case it's
-                # oldpath/file1.java => newpath/file2.java
-                oldPath, newPath = filePath.split(' => ')
-
-            # if the file was renamed we know that it existed both previous to and
-            # after the commit so no need for the logic that follows that checks for this
-            newFileContents = repo.git.show(f'{commit}:{newPath}')
-            oldFileContents = repo.git.show(f'{commit}^1:{oldPath}')
-        else:
-            # the file could have been created by the current commit or also deleted by it
-            # we need some logic to handle this cases because git will give an error
-            # if we ask for a file that does not exist
-            try:
-                newFileContents = repo.git.show(f'{commit}:{filePath}')
-            except:
-                newFileExists = False
-                newFileContents = ' '
-
-            try:
-                oldFileContents = repo.git.show(f'{commit}^1:{filePath}')
-            except:
-                oldFileContents = ' '
-                oldFileExists = False
-
-        if newFileExists and not oldFileExists:
-            printIfDebug('-- File was created in this commit')
-            newPackageName = extractPackageFromFileContents(newFileContents)
-            oldPackageName = None
-        elif oldFileExists and not newFileExists:
-            printIfDebug('-- File was deleted in this commit')
-            newPackageName = None
-            oldPackageName = extractPackageFromFileContents(oldFileContents)
-        else:
-            # at least one among old and new file must exist so if we arrive here
-            # we know that they both exist.
-            newPackageName = extractPackageFromFileContents(newFileContents)
-            oldPackageName = extractPackageFromFileContents(oldFileContents)
+    for oldPath, newPath, oldBlob, newBlob in changedJavaFiles:
+        printIfDebug(f'- Analyzing changes to file {oldPath} -> {newPath}')
+
+        # the file could have been created by the current commit or also deleted by it,
+        # in which case only one of its versions exists
+        newFileContents = reader.readBlob(newBlob) if newPath else None
+        oldFileContents = reader.readBlob(oldBlob) if oldPath else None
+        newPackageName = extractPackageFromFileContents(newFileContents) if newFileContents is not None else None
+        oldPackageName = extractPackageFromFileContents(oldFileContents) if oldFileContents is not None else None
 
         printIfDebug(f'-- New package name: {newPackageName}, Old package name: {oldPackageName}')
 
@@ -148,13 +243,80 @@ def getCommitStats(commit):
         if newPackageName:
             modifiedPackages.add(newPackageName)
 
-        # getFineGrainedStats(oldFileContents, newFileContents)
+        if gumtree:
+            stats = getFineGrainedStats(oldBlob if oldPath else missingBlob, newBlob if newPath else missingBlob,
+                                        oldFileContents or '', newFileContents or '')
+            printIfDebug(f'-- Fine-grained changes: {stats}')
+            for kind in actionKinds:
+                fineGrainedStats[kind] += stats[kind] if stats else 0
 
     printIfDebug(f'- Modified packages: {modifiedPackages}')
 
-    return modifiedPackages
+    return modifiedPackages, fineGrainedStats
+
+# reader of the repository of the current worker process, opened by initWorker, and gumtree
+# driver and cache of the fine-grained differences if they are enabled
+reader = None
+gumtree = None
+fineGrainedCache = None
+
+def initWorker(repoPath, gumtreeLibPath, runDir):
+    global reader, gumtree, fineGrainedCache
+    reader = ObjectReader(repoPath)
+    if gumtreeLibPath:
+        gumtree = GumtreeDriver(gumtreeLibPath, runDir)
+        fineGrainedCache = FineGrainedCache(fineGrainedCachePath)
+        # the pool workers leave without running the atexit handlers, but they run the
+        # multiprocessing finalizers when they exit normally
+        util.Finalize(None, gumtree.close, exitpriority=10)
+
+def processCommit(mergeCommitSHA):
+    '''
+    Returns a tuple (merge commit, number of changed packages, fine-grained stats). The
+    number is None if the commit is not in the repository.
+    '''
+    # for some reason, not all the merge commits as returned by the Github API
+    # are valid. the API itself is not really documented so this is not solvable
+    parentSHA = getFirstParent(reader, mergeCommitSHA)
+    if parentSHA is None:
+        return mergeCommitSHA, None, None
+    modifiedPackages, fineGrainedStats = getCommitStats(reader, mergeCommitSHA, parentSHA)
+    return mergeCommitSHA, len(modifiedPackages), fineGrainedStats
+
+def readCheckpoint(checkpointPath):
+    '''
+    Returns the results of the commits completed by a previous run, as a dictionary
+    merge commit -> (number of changed packages, fine-grained stats).
+    '''
+    results = {}
+    if not os.path.exists(checkpointPath):
+        return results
+    with open(checkpointPath) as checkpointFile:
+        for line in checkpointFile:
+            fields = [int(field) if field else None for field in line.rstrip('\n').split(',')[1:]]
+            # the last line can be incomplete if the previous run was killed while writing it
+            if len(fields) not in (1, 1 + len(actionKinds)) or not line.endswith('\n'):
+                continue
+            fineGrainedStats = dict(zip(actionKinds, fields[1:])) if len(fields) > 1 else None
+            results[line.split(',')[0]] = fields[0], fineGrainedStats
+    return results
+
+def formatCheckpoint(mergeCommitSHA, changedPackages, fineGrainedStats):
+    values = [changedPackages] + ([fineGrainedStats[kind] for kind in actionKinds] if fineGrainedStats else [])
+    return ','.join([mergeCommitSHA] + ['' if value is None else str(value) for value in values]) + '\n'
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add to the pull requests of a repository the number of packages they change')
+    parser.add_argument('repo_org')
+    parser.add_argument('repo_name', help='name of the repository, cloned in a folder with the same name')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--fine-grained', action='store_true',
+                        help='also count the AST nodes inserted, deleted, updated and moved with gumtree')
+    parser.add_argument('--gumtree-lib', default=os.path.join(os.path.dirname(os.path.dirname(gumtree_path)), 'lib'),
+                        help='folder of the jars of gumtree')
+    args = parser.parse_args()
+    repo_org, repo_name = args.repo_org, args.repo_name
+
     pullRequestsData = f'output_{repo_org}_{repo_name}.csv'
     # read the csv file containing the pull requests info of the repo
     df = pd.read_csv(pullRequestsData)
@@ -163,27 +325,43 @@ if __name__ == '__main__':
     # we just drop the pull requests without merge commit info.
     df.dropna(subset=['mergeCommit'], inplace=True)
 
-    # we compile some regexes in advance for speed reasons.
-    # regex to match the package name in a java file
-    packageRegexPattern = r'package (.+);'
-    progPackageRegex = re.compile(packageRegexPattern)
-    # regex to match the renaming of a file
-    renamedFileRegexPattern = r'{(.*)? => (.*)?}'
-    progRenamedFileRegexPattern = re.compile(renamedFileRegexPattern)
-
-    repo = git.Repo(repo_name)
-
-    def processCommit(mergeCommitSHA):
-        # for some reason, not all the merge commits as returned by the Github API
-        # are valid. the API itself is not really documented so this is not solvable
-        try:
-            commit = repo.commit(mergeCommitSHA)
-        except:
-            return None
-        else:
-            return len(getCommitStats(commit))
+    # the results of every completed commit are appended to the checkpoint file, so an
+    # interrupted run resumes from where it stopped
+    checkpointPath = f'output_{repo_org}_{repo_name}_withPackageInfo.checkpoint'
+    results = readCheckpoint(checkpointPath)
+    if args.fine_grained:
+        # commits processed by a run without the fine-grained differences are processed again
+        results = {sha: result for sha, result in results.items() if result[1] is not None or result[0] is None}
+    pendingCommits = [sha for sha in df.mergeCommit.unique() if sha not in results]
+    print(f'{len(results)} commits already processed, {len(pendingCommits)} to process')
+
+    runDir = None
+    if args.fine_grained:
+        compileGumtreeBatch(args.gumtree_lib)
+        # the workers write the contents to compare in this folder, removed at the end of the run
+        runDir = tempfile.mkdtemp(prefix='gumtree-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    initArgs = (repo_name, args.gumtree_lib if args.fine_grained else None, runDir)
+    try:
+        with open(checkpointPath, 'a') as checkpointFile, Pool(args.workers, initializer=initWorker, initargs=initArgs) as pool:
+            for i, (mergeCommitSHA, changedPackages, fineGrainedStats) in enumerate(pool.imap_unordered(processCommit, pendingCommits, commitsPerTask)):
+                results[mergeCommitSHA] = changedPackages, fineGrainedStats
+                checkpointFile.write(formatCheckpoint(mergeCommitSHA, changedPackages, fineGrainedStats))
+                checkpointFile.flush()
+                if (i + 1) % 1000 == 0:
+                    print(f'Processed {i + 1} commits')
+            # the workers exit normally instead of being terminated, so they stop their JVMs
+            pool.close()
+            pool.join()
+    finally:
+        if runDir:
+            shutil.rmtree(runDir, ignore_errors=True)
 
     # create new column in the dataframe containing the number of changed packages
-    df['changedPackages'] = df.mergeCommit.apply(processCommit)
+    df['changedPackages'] = df.mergeCommit.map(lambda sha: results[sha][0])
+    if args.fine_grained:
+        # and one for each kind of fine-grained change
+        for kind in actionKinds:
+            df[kind] = df.mergeCommit.map(lambda sha: (results[sha][1] or {}).get(kind))
     # save output to csv
     df.to_csv(f'output_{repo_org}_{repo_name}_withPackageInfo.csv', index=False)
+    os.unlink(checkpointPath)